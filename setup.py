@@ -34,8 +34,6 @@ setup(
         # that you indicate you support Python 3. These classifiers are *not*
         # checked by 'pip install'. See instead 'python_requires' below.
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
         'Programming Language :: Python :: 3 :: Only',
@@ -43,12 +41,11 @@ setup(
     keywords='monero, blockchain, wallet, privacy, finance',
     package_dir={'': 'src'},
     packages=find_packages(where='src'),
-    python_requires='>=3.5, <4',
+    python_requires='>=3.7, <4',
     install_requires=['cryptography', 'requests', 'bidict'],
-    #extras_require={  # Optional
-    #    'dev': ['check-manifest'],
-    #    'test': ['coverage'],
-    #},
+    extras_require={
+        'lmdb': ['lmdb'],
+    },
     #package_data={  # Optional
     #    'sample': ['package_data.dat'],
     #},
@@ -0,0 +1,3 @@
+from .scanner import height_at_time, Hit, Scanner, ScanError, ScanState
+
+__all__ = ['height_at_time', 'Hit', 'Scanner', 'ScanError', 'ScanState']
@@ -1,14 +1,22 @@
 from bidict import bidict
+import cProfile
 from datetime import datetime
 import getpass
+import json
 import random
+import requests
 from sys import stdin, stdout, stderr
 from time import time
 
 from .blobcache import BlobCache
+from .blockhashes import BlockHashTable
+from .bootstrap import BootstrapFile
 from . import handlearg
+from .lmdbchain import LMDBBlockchain
+from .scanner import find_fork, height_at_time, newest_block, Scanner, ScanError, ScanState
+from .scanstats import ScanStats
 from . import xmrconn
-from .xmrtype import Block, Transaction
+from .xmrtype import Block, HeightIntervals, Transaction
 
 def main():
 	# Good morning, time to handle arguments
@@ -26,8 +34,26 @@ def main():
 		return 1
 
 	daemon_login = ':'.join([settings['duser'], settings['dpass']]) if settings['dlogin'] else None
-	daemon = xmrconn.DaemonConnection(settings['daddr'], settings['dport'], settings['duser'], settings['dpass'])
-	wallet = xmrconn.WalletConnection(settings['walletf'], password, daemon.host(), daemon_login, cmd=settings['wallcmd'])
+	stats = ScanStats()
+
+	# A blockchain export file or database answers everything we'd otherwise ask the daemon
+	if settings['raw'] is not None or settings['lmdb'] is not None:
+		try:
+			if settings['raw'] is not None:
+				daemon = BootstrapFile(settings['raw'], stats=stats)
+			else:
+				daemon = LMDBBlockchain(settings['lmdb'], stats=stats)
+		except Exception as e:
+			print("Error: can't read {}:".format(settings['raw'] or settings['lmdb']), e, file=stderr)
+			return 1
+
+		wallet = xmrconn.WalletConnection(settings['walletf'], password, cmd=settings['wallcmd'], offline=True)
+	else:
+		daemon = handlearg.make_daemon_connection(settings['daddr'], settings['dport'], settings['duser'],
+			settings['dpass'], settings['timeout'], settings['retries'], settings['hedge'], stats=stats,
+			max_rps=settings['max_rps'], max_bps=settings['max_bps'])
+		wallet = xmrconn.WalletConnection(settings['walletf'], password, daemon.host(), daemon_login,
+			cmd=settings['wallcmd'])
 
 	# Ask wallet for table of transfer information. The password is passed through stdin. Output from stdout
 	# is stored in variable res. Construct a dictionary 'pubkey_by_index' where the keys are the global indexes
@@ -41,37 +67,99 @@ def main():
 
 	pubkey_by_index = bidict({entry['global_index']: entry['pubkey'] for entry in trans_data})
 
-	# If available, use the cache to query already built txs_by_key_index and scanned_blocks.
+	# The wallet already knows which tx created each of our outputs, so the scan doesn't have to look
+	# for our output keys
+	created_in = {}
+	for entry in trans_data:
+		created_in.setdefault(entry['tx_id'], []).append(entry['global_index'])
+
+	# Blocks older than our outputs can only be skipped if all of them are RingCT outputs. The global
+	# indexes of older outputs only count the outputs of their own amount
+	ringct = all(entry['ringct'] for entry in trans_data)
+
+	# Open the block hash table, which remembers the hashes of scanned blocks. If it was filled on another
+	# network, its hashes are useless
+	block_hashes = None
+	daemon_height = daemon.get_info()['height']
+
+	if settings['block_hashes'] is not None:
+		try:
+			block_hashes = BlockHashTable(settings['block_hashes'])
+		except OSError as e:
+			print(e)
+			print("Warning: can't open block hash table. Continuing without it...")
+
+	if block_hashes is not None:
+		genesis_hash = daemon.get_block_header_by_height(0)['hash']
+
+		if block_hashes.get(0) not in (None, genesis_hash):
+			print("Warning: block hash table belongs to a different network. Resetting it...")
+			block_hashes.truncate(0)
+
+		block_hashes.set(0, genesis_hash)
+
+	# If available, use the cache to query already built txs_by_key_index, scanned_blocks, the coverage
+	# (the heights that have already been scanned) and the start height of the cached scan.
 	txs_by_key_index = {i: [] for i in pubkey_by_index}
 	scanned_blocks = []
+	coverage = HeightIntervals()
+	cached_start = None
 
 	should_read_cache = settings['cachein'] is not None
 	if should_read_cache:
 		if not settings['quiet']: print("Getting scan information from cache...")
-		cached_txs, scanned_blocks = get_cached_info(settings['cachein'], password)
+		cached_txs, scanned_blocks, coverage, cached_start = get_cached_info(settings['cachein'], password)
 
 		txs_by_key_index.update(cached_txs)
 
-	# Calculate the start height. If specified on the command line, use that height. If not, try to use
-	# scanned_blocks from cache to find newest valid block and start from a little before there. If that
-	# doesn't work, then ask the wallet for its restore height and start from a little before there. If
-	# all else fails, resort to scanning from beginning of the blockchain. After all that, calculate the
-	# height to end the scan.
+	# Calculate the start height. If specified on the command line, use that height and scan everything
+	# again. If not, check the cached coverage against the block hash table and the daemon, and scan
+	# everything from the cached start height that isn't covered anymore. Without hashes for the
+	# coverage, try to use scanned_blocks from cache to find newest valid block and rescan a little
+	# before there, plus anything that the cached scan didn't cover. If that doesn't work, then ask the
+	# wallet for its restore height and start from a little before there. If all else fails, resort to
+	# scanning from beginning of the blockchain. After all that, calculate the height to end the scan.
+	if block_hashes is not None:
+		coverage.remove(daemon_height)
+
 	if settings['height'] is not None:
 		start_height = settings['height']
 		scanned_blocks = []
+		coverage = HeightIntervals()
 	else:
 		need_restore_height = True
 
-		if scanned_blocks:
+		# The block hash table is shared by all caches, and another run may have refilled it after a reorg.
+		# It only vouches for the cached coverage if it still holds the cache's own hash of its top block
+		cached_top = scanned_blocks[-1] if scanned_blocks else None
+		table_matches = block_hashes is not None and cached_top is not None and coverage and \
+			cached_top.height == coverage.max() and block_hashes.get(cached_top.height) == cached_top.hash
+
+		if cached_start is not None and table_matches:
+			fork_height = find_fork(block_hashes, daemon, coverage.max())
+
+			if fork_height is not None:
+				if not settings['quiet']: print("Cached blocks from height {} on were reorged".format(fork_height))
+				coverage.remove(fork_height)
+				block_hashes.truncate(fork_height)
+				scanned_blocks = [b for b in scanned_blocks if b.height < fork_height]
+
+			start_height = cached_start
+			need_restore_height = False
+		elif scanned_blocks:
 			newest_valid = newest_block(scanned_blocks, daemon)
 			if newest_valid:
 				scanned_blocks = [newest_valid]
 				height_offset = random.randint(25, 250)
-				start_height = max(newest_valid.height - height_offset, 0)
+				rescan_height = max(newest_valid.height - height_offset, 0)
+				coverage.remove(rescan_height)
+
+				# Caches from before coverage was recorded only know about the newest block
+				start_height = cached_start if coverage and cached_start is not None else rescan_height
 				need_restore_height = False
 			else:
 				scanned_blocks = []
+				coverage = HeightIntervals()
 
 		if need_restore_height:
 			if not settings['quiet']: print("Getting restore height from wallet...")
@@ -84,22 +172,72 @@ def main():
 				height_offset = random.randint(25, 250)
 				start_height = max(restore_height - height_offset, 0)
 
-	end_height = max(daemon.get_info()['height'] - 1, start_height)
+	# The cache remembers the start height worked out above. A time or height window only narrows down
+	# what is scanned this time, and what it covers is merged with the cached coverage
+	scan_from = start_height
+	end_height = daemon_height - 1
+	window = None
+
+	if settings['end_height'] is not None or settings['since'] is not None or settings['until'] is not None:
+		if not settings['quiet'] and (settings['since'] is not None or settings['until'] is not None):
+			print("Finding the heights of the scan window...")
+
+		if settings['end_height'] is not None:
+			end_height = min(end_height, settings['end_height'])
+		if settings['since'] is not None:
+			start_height = height_at_time(daemon, settings['since'], high=daemon_height - 1)
+		if settings['until'] is not None:
+			end_height = min(end_height, height_at_time(daemon, settings['until'], high=daemon_height - 1) - 1)
+
+		window = (start_height, end_height)
 
 	# Now it's time to scan!
+	profiler = start_profiler(settings['profiler']) if settings['profile'] is not None else None
+	pool_txs_by_key_index = None
+
 	try:
-		scan(start_height, end_height, daemon, settings, pubkey_by_index, txs_by_key_index, scanned_blocks)
+		if start_height <= end_height:
+			if not settings['quiet'] and window is not None:
+				print("Scanning blocks {}-{}...".format(start_height, end_height))
+
+			scan(start_height, end_height, daemon, settings, pubkey_by_index, txs_by_key_index, scanned_blocks,
+				coverage, block_hashes, created_in, ringct)
+		elif not settings['vquiet']:
+			print("Nothing to scan: start height {} is above end height {}".format(start_height, end_height))
+
+		# Unconfirmed txs are only reported, never cached, since they may never make it into a block
+		if settings['mempool']:
+			if not settings['quiet']: print("Checking the transaction pool...")
+			pool_txs_by_key_index = scan_pool(daemon, settings, set(pubkey_by_index), created_in)
 
 		if not settings['quiet']: print('\nDone!')
 	except KeyboardInterrupt:
 		print("\nCaught keyboard interrupt. Exiting...")
+	except requests.exceptions.RequestException as e:
+		print("\nError: daemon request failed after {} retries: {}".format(settings['retries'], e), file=stderr)
+	finally:
+		if profiler is not None:
+			stop_profiler(profiler, settings['profile'])
 
-	pretty_print_results(txs_by_key_index, pubkey_by_index, trans_data, extra_quiet=settings['vquiet'])
+		if block_hashes is not None:
+			block_hashes.close()
 
-	# Write txs_by_index and scanned_blocks to output cache
+	spent_status = get_spent_status(daemon if settings['check_key_images'] else None, trans_data)
+	pretty_print_results(txs_by_key_index, pubkey_by_index, trans_data, extra_quiet=settings['vquiet'], window=window,
+		spent_status=spent_status)
+
+	if pool_txs_by_key_index is not None:
+		pretty_print_pool_results(pool_txs_by_key_index, pubkey_by_index, trans_data, extra_quiet=settings['vquiet'])
+
+	# Dump scan statistics
+	if settings['stats'] is not None:
+		stats.dump(settings['stats'])
+
+	# Write txs_by_index, scanned_blocks and coverage to output cache. Even if the scan was interrupted,
+	# the coverage tells the next scan exactly what is left to do.
 	if settings['cacheout'] is not None:
 		cache = settings['cachein'] if settings['cachein'] is not None else BlobCache()
-		add_to_cache(cache, txs_by_key_index, scanned_blocks, password)
+		add_to_cache(cache, txs_by_key_index, scanned_blocks, coverage, scan_from, password)
 
 		try:
 			cache_out_file = settings['cacheout']
@@ -119,77 +257,65 @@ def main():
 ##### OTHER HELPER FUNCTIONS #####
 ##################################
 
-def scan(start_height, end_height, daemon, settings, pubkey_by_gindex, txs_by_key_index, scanned_blocks):
-	# Loop through all transactions in all blocks in [start_height, end_height],
-	# adding txs to txs_by_key_index if tx contains a public key that belongs to us
-	tx_batch_count = 100 if settings['restricted'] else 10000
-	tx_hashes = []
+def scan(start_height, end_height, daemon, settings, gindexes, txs_by_key_index, scanned_blocks,
+		coverage=None, block_hashes=None, created_in=None, ringct=False):
+	# Runs a Scanner over all blocks in [start_height, end_height] which aren't in coverage yet, adding
+	# every tx which uses one of our outputs (gindexes) to txs_by_key_index and reporting the progress
+	# like the settings say. The txs which created our outputs are recognized by their hashes in
+	# created_in. Blocks older than our outputs are only skipped if ringct says they're all RingCT.
+	# scanned_blocks and coverage are updated in place, so an interrupted scan still leaves usable
+	# coverage. Returns 1 if fetching txs failed, otherwise None.
+	should_report = not settings['vquiet'] or settings['progress'] is not None
 	last_time = time()
-	tx_found = 0
-	prog_fmt = "Scanning blockchain (height: {h}/{e}, progress: {p:.2f}%, found: {f})"
-	max_scanned_blocks = 50
-
-	height = start_height
-	while height <= end_height:
-		block = daemon.get_block(height)
-		block_header = block['block_header']
-
-		# If the new block doesn't point to the last block's hash and not a 'decoy scan'. (i.e. when
-		# start_height <= height <= scanned_blocks[0].height
-		decoy_scan = scanned_blocks and height <= scanned_blocks[0].height
-		mismatched_hash = len(scanned_blocks) != 0 and block_header['prev_hash'] != scanned_blocks[-1].hash
-		if mismatched_hash and not decoy_scan:
-			print("\nReorg detected. Rolling back...")
-			scanned_blocks.pop()
-			height -= 1
-
-			if not scanned_blocks:
-				print("Warning! Rolled back all available scanned blocks. Something might be wrong.")
-
-			continue
-
-		# For some reason, the node returns an object w/o a 'tx_hashes' key if there are none
-		if 'tx_hashes' in block:
-			tx_hashes += block['tx_hashes']
-
-		# By batching the responses, I hope to speed up the scanning
-		while (len(tx_hashes) >= tx_batch_count or height == end_height) and tx_hashes:
-			txs = daemon.get_transactions(tx_hashes[:tx_batch_count])
-
-			# If txs returns None, then that means that the get_transactions failed
-			if txs is None:
-				return 1
-
-			# For each transaction in block
-			for tx in txs:
-				# For each input and output stealth address index in transaction
-				out_gindexes = [pubkey_by_gindex.inverse[p] for p in tx.outs if p in pubkey_by_gindex.values()]
-				for kindex in (tx.ins + out_gindexes):
-					# If index belongs to us
-					if kindex in txs_by_key_index:
-						# If new tx
-						if tx not in txs_by_key_index[kindex]:
-							txs_by_key_index[kindex].append(tx)
-							if not settings['quiet']: print("Found tx:", tx.hash)
-						# If tx already found, replace with newest version. Useful in case of reorg since
-						# last scan
-						else:
-							txs_by_key_index = [(x if x != tx else tx) for x in txs_by_key_index[kindex]]
-
-						tx_found += 1
-
-			tx_hashes = tx_hashes[tx_batch_count:]
-
-			# Poll print progress
-			if not settings['vquiet']:
-				force = height == end_height
-				prog = (height - start_height) / (end_height - start_height) * 100
-				last_time = poll_progress_print(prog_fmt, last_time, force=force, h=height, e=end_height,
-					p=prog, f=tx_found)
-
-		scanned_blocks.append(Block(block_header['height'], block_header['hash']))
-		scanned_blocks[:] = scanned_blocks[-max_scanned_blocks:]
-		height += 1
+
+	def on_progress(progress, force):
+		nonlocal last_time
+		last_time = poll_progress_report(progress, last_time, settings, force=force)
+
+	def log(msg, warning):
+		if warning or not settings['quiet']:
+			print(msg)
+
+	scanner = Scanner(gindexes, daemon, ScanState(coverage, scanned_blocks), block_hashes,
+		order=settings['order'], batch_size=100 if settings['restricted'] else 10000,
+		ring_only=settings['ring_only'], on_progress=on_progress if should_report else None, log=log,
+		created_in=created_in, ringct=ringct)
+
+	try:
+		for hit in scanner.iter_hits(start_height, end_height):
+			txs = txs_by_key_index.setdefault(hit.gindex, [])
+
+			# If new tx
+			if hit.tx not in txs:
+				txs.append(hit.tx)
+				if not settings['quiet']: print("Found tx:", hit.tx.hash)
+			# If tx already found, replace with newest version. Useful in case of reorg since last scan
+			else:
+				txs_by_key_index[hit.gindex] = [(x if x != hit.tx else hit.tx) for x in txs]
+	except ScanError:
+		return 1
+
+def scan_pool(daemon, settings, gindexes, created_in=None):
+	# Matches the txs in the daemon's pool, fetched in a single request, against our outputs like scan()
+	# does for blocks. Returns a dict of global index -> list of pending txs which use the output, or None
+	# if the pool couldn't be fetched.
+	scanner = Scanner(gindexes, daemon, created_in=created_in)
+
+	try:
+		hits = scanner.pool_hits()
+	except ScanError as e:
+		print("Error: {}".format(e), file=stderr)
+		return None
+
+	pool_txs_by_key_index = {}
+	for hit in hits:
+		txs = pool_txs_by_key_index.setdefault(hit.gindex, [])
+
+		if hit.tx not in txs:
+			txs.append(hit.tx)
+			if not settings['quiet']: print("Found pending tx:", hit.tx.hash)
+
+	return pool_txs_by_key_index
 
 def getpassword(prompt='Password: '):
 	""" Returns secure password, read from stdin w/o echoing """
@@ -199,71 +325,219 @@ def getpassword(prompt='Password: '):
 	else:
 		return stdin.readline().rstrip()
 
-def pretty_print_results(txs_by_key_index, pubkey_by_index, transfer_data, extra_quiet=False):
+def pretty_print_results(txs_by_key_index, pubkey_by_index, transfer_data, extra_quiet=False, window=None,
+		spent_status=None):
 	"""
 	Pretty prints the final results of the program
 
 	txs_by_key_index: {int: [str]}, dict of global indexes referencing a list of transactions
 	pubkey_by_index: {int: str}, dict of global indexes referencing their corresponding pubkeys
 	transfer_data: [dict], result of call to WalletConnection.incoming_transfers()
+	window: tuple(int, int), only print transactions in blocks of these heights. None to print all
+	spent_status: {int: int}, result of get_spent_status(). None to leave out whether outputs are spent
 	"""
 
+	transfer_by_index = {e['global_index']: e for e in transfer_data}
+	spent_status = spent_status if spent_status is not None else {}
+	status_fmt = {1: " (spent)", 2: " (spent by a transaction in the pool)"}
+
 	print()
 
 	for key_index in txs_by_key_index:
 		pubkey = pubkey_by_index[key_index]
 
-		print("Your stealth address:", pubkey)
+		print("Your stealth address:", pubkey + status_fmt.get(spent_status.get(key_index), ""))
 
 		txs = txs_by_key_index[key_index]
 
+		if window is not None:
+			txs = [tx for tx in txs if window[0] <= tx.height <= window[1]]
+
 		if txs:
 			for tx in txs:
 				print("    [%s]: " % datetime.fromtimestamp(tx.timestamp), end="")
 
-				# Get the transfer which matches the tx_id in transfer_data or None if not found
-				matching_transfer = ([None] + [e for e in transfer_data if e['tx_id'] == tx.hash])[-1]
+				kind = classify_tx(tx, transfer_by_index.get(key_index), transfer_data)
 
-				# If this is originating transaction of current pubkey
-				if matching_transfer and matching_transfer['pubkey'] == pubkey:
+				if kind == 'created':
 					print("Pubkey was created. ", end="")
-				# If you are sender/recipient of transaction but its not originator of current pubkey
-				elif matching_transfer:
+				elif kind == 'spent':
 					print("Pubkey was spent. ", end="")
-				# Otherwise its not yours and thus a decoy
 				else:
 					print("Used as a decoy. ", end="")
 
-				if not extra_quiet:
+				# Outputs aren't decoded while scanning, so only txs from older caches have them
+				if not extra_quiet and tx.outs:
 					tx_fmt = "Transaction(hash=%s, height=%d, ins=%d, outs=%d)"
 					print(tx_fmt % (tx.hash, tx.height, len(tx.ins), len(tx.outs)), end="")
+				elif not extra_quiet:
+					tx_fmt = "Transaction(hash=%s, height=%d, ins=%d)"
+					print(tx_fmt % (tx.hash, tx.height, len(tx.ins)), end="")
 
 				print()
 		else:
 			print("    * no transactions found *")
 
-def poll_progress_print(fmt_str, last_time, delay=1, force=False, **fmtargs):
-	new_time = time()
+def pretty_print_pool_results(pool_txs_by_key_index, pubkey_by_index, transfer_data, extra_quiet=False):
+	"""
+	Pretty prints the txs in the pool which use our outputs, apart from the confirmed ones
 
-	if (new_time >= (last_time + delay) or force) and stdout.isatty():
-		prog_str = fmt_str.format(**fmtargs) + '    '
-		print(prog_str, end='\r')
+	pool_txs_by_key_index: {int: [Transaction]}, result of scan_pool()
+	pubkey_by_index: {int: str}, dict of global indexes referencing their corresponding pubkeys
+	transfer_data: [dict], result of call to WalletConnection.incoming_transfers()
+	"""
+
+	transfer_by_index = {e['global_index']: e for e in transfer_data}
+
+	print()
+	print("Pending transactions in the pool:")
 
-		return new_time
+	if not pool_txs_by_key_index:
+		print("    * no transactions found *")
+		return
+
+	for key_index, txs in pool_txs_by_key_index.items():
+		print("Your stealth address:", pubkey_by_index[key_index])
+
+		for tx in txs:
+			# Pool txs aren't in a block yet, so their timestamp is when the daemon received them
+			print("    [%s]: " % datetime.fromtimestamp(tx.timestamp), end="")
+
+			kind = classify_tx(tx, transfer_by_index.get(key_index), transfer_data)
+
+			if kind == 'created':
+				print("Pubkey is being created. ", end="")
+			elif kind == 'spent':
+				print("Pubkey is being spent. ", end="")
+			else:
+				print("Used as a decoy. ", end="")
+
+			if not extra_quiet:
+				print("Transaction(hash=%s, ins=%d)" % (tx.hash, len(tx.ins)), end="")
+
+			print()
+
+def classify_tx(tx, transfer, transfer_data):
+	"""
+	Returns 'created' if tx created the output of wallet transfer transfer, 'spent' if it spent it and
+	'decoy' if it only used it as a decoy. The creating tx is known to the wallet, and the spending tx
+	is the one which contains the output's key image.
+
+	transfer: dict, entry of WalletConnection.get_incoming_transfers() for the output. None if unknown
+	transfer_data: [dict], result of call to WalletConnection.get_incoming_transfers()
+	"""
+
+	if transfer is not None and tx.hash == transfer['tx_id']:
+		return 'created'
+
+	if tx.kimages:
+		return 'spent' if transfer is not None and transfer['key_image'] in tx.kimages else 'decoy'
+
+	# Txs from caches older than key images can only be told apart by whether we received change in them
+	return 'spent' if any(e['tx_id'] == tx.hash for e in transfer_data) else 'decoy'
+
+def get_spent_status(daemon, transfer_data):
+	"""
+	Returns dict of global index -> spent status of all of our outputs: 0 if unspent, 1 if spent and 2
+	if spent by a tx in the pool. By default, the wallet's spent flags are used. If daemon is given, it
+	is asked about all known key images in a single is_key_image_spent request, falling back to the
+	wallet's flags if that fails. That links all of our key images to us, so only do it on request.
+
+	daemon: DaemonConnection, daemon to ask about our key images. None to only use the wallet's flags
+	"""
+
+	spent_status = {e['global_index']: 1 if e['spent'] else 0 for e in transfer_data}
+	kimage_by_index = {e['global_index']: e['key_image'] for e in transfer_data if is_hex_hash(e['key_image'])}
+
+	if daemon is None or not kimage_by_index:
+		return spent_status
+
+	try:
+		statuses = daemon.is_key_image_spent(list(kimage_by_index.values()))
+	except requests.exceptions.RequestException:
+		statuses = None
+
+	if statuses is not None:
+		spent_status.update(zip(kimage_by_index, statuses))
+
+	return spent_status
+
+def is_hex_hash(value):
+	""" Returns True if value is a hex string of a non-zero 32 byte hash, e.g. a known key image """
+
+	try:
+		return len(value) == 64 and int(value, 16) != 0
+	except ValueError:
+		return False
+
+def start_profiler(profiler_name):
+	""" Starts and returns a profiler of type profiler_name, either 'cprofile' or 'pyinstrument' """
+
+	if profiler_name == 'pyinstrument':
+		import pyinstrument
+
+		profiler = pyinstrument.Profiler()
+		profiler.start()
 	else:
+		profiler = cProfile.Profile()
+		profiler.enable()
+
+	return profiler
+
+def stop_profiler(profiler, out_path):
+	"""
+	Stops profiler and writes its results to out_path. cProfile results are written in the pstats
+	format. pyinstrument results are written as HTML if out_path ends with '.html', otherwise as text.
+	"""
+
+	if isinstance(profiler, cProfile.Profile):
+		profiler.disable()
+		profiler.dump_stats(out_path)
+	else:
+		profiler.stop()
+		output = profiler.output_html() if out_path.endswith('.html') else profiler.output_text()
+
+		with open(out_path, 'w') as f:
+			f.write(output)
+
+def poll_progress_report(progress, last_time, settings, delay=1, force=False):
+	"""
+	Prints the progress line to stdout (if it is a TTY) and appends a JSON progress line to the
+	--progress-file (if set) at most once every delay seconds, unless force is True. Returns the
+	time of the last report.
+
+	progress: ScanProgress, progress of the current scan
+	last_time: float, UNIX time of last report
+	"""
+
+	new_time = time()
+
+	if new_time < last_time + delay and not force:
 		return last_time
 
-def add_to_cache(blob_cache, txs_by_key_index, scanned_blocks, password):
+	if not settings['vquiet'] and stdout.isatty():
+		print(progress.line() + '    ', end='\r')
+
+	if settings['progress'] is not None:
+		settings['progress'].write(json.dumps(progress.tojson()) + '\n')
+		settings['progress'].flush()
+
+	return new_time
+
+def add_to_cache(blob_cache, txs_by_key_index, scanned_blocks, coverage, start_height, password):
 	"""
 	password ->
 		txs_by_gindex
 		recent block hashes/heights
-		minimum height of blocks in block_hashes
+		intervals of scanned heights
+		start height of scan
 	"""
 
 	cache_data = {
 		'txs': txs_by_key_index,
-		'scanned_blocks': scanned_blocks
+		'scanned_blocks': scanned_blocks,
+		'coverage': coverage.tojson(),
+		'scan_from': start_height
 	}
 
 	blob_cache.clear_objs(password)
@@ -273,27 +547,14 @@ def get_cached_info(blob_cache, password):
 	cached_objs = blob_cache.get_objs(password)
 
 	if not cached_objs:
-		return {}, []
+		return {}, [], HeightIntervals(), None
 
 	cached_obj = cached_objs[0]
 	txs = {int(i): list(map(Transaction.fromjson, txs)) for i, txs in cached_obj['txs'].items()}
 	scanned_blocks = list(map(Block.fromjson, cached_obj['scanned_blocks']))
+	coverage = HeightIntervals.fromjson(cached_obj.get('coverage', []))
 
-	return txs, scanned_blocks
-
-def newest_block(blocks, daemon):
-	"""
-	Quieres the daemon for a list of blocks and returns the newest valid block in the list, or None if not available
-	"""
-
-	sorted_blocks = sorted(blocks, key=lambda x: x.height, reverse=True)
-
-	for cached_block in sorted_blocks:
-		network_block = daemon.get_block(cached_block.height)
-
-		# If found a match
-		if 'block_header' in network_block and network_block['block_header']['hash'] == cached_block.hash:
-			return cached_block
+	return txs, scanned_blocks, coverage, cached_obj.get('scan_from')
 
 # Program entry point
 if __name__ == '__main__':
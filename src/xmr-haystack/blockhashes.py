@@ -0,0 +1,122 @@
+import mmap
+import os
+
+class BlockHashTable(object):
+	"""
+	Persistent table of block hashes by height, memory-mapped from a flat file. The hash of the block
+	at height h is stored as 32 raw bytes at offset 32 * h, and heights without a known hash are all
+	zeros. The file grows in steps of grow_heights heights as higher blocks are added. It is never
+	shrunk, since other runs may have it mapped at the same time and would crash reading past its end.
+
+	The table is shared by all wallets on the same network. It is the scanner's memory of which chain
+	the cached results belong to: cached coverage is valid as long as the stored hashes still match
+	the daemon's chain (see find_fork() in scanner).
+	"""
+
+	hash_size = 32
+	grow_heights = 65536
+	empty_hash = bytes(hash_size)
+
+	def __init__(self, path):
+		"""
+		path: str, path of the table file. Created if it doesn't exist
+		"""
+
+		self.path = path
+		self.file = open(path, 'r+b' if os.path.isfile(path) else 'w+b')
+		self.mmap = None
+		self.capacity = 0
+		self._remap()
+		self.top = self._find_top()
+
+	def _remap(self):
+		if self.mmap is not None:
+			self.mmap.close()
+			self.mmap = None
+
+		size = os.fstat(self.file.fileno()).st_size
+		self.capacity = size // self.hash_size
+
+		# Zero length files can't be mapped
+		if size:
+			self.mmap = mmap.mmap(self.file.fileno(), size)
+
+	def _find_top(self):
+		""" Returns the highest height with a stored hash, or -1 if there is none """
+
+		# Truncated files can end in any number of empty grow steps, so search backwards a step at a time
+		end = self.capacity * self.hash_size
+		step_size = self.grow_heights * self.hash_size
+
+		while end > 0:
+			start = max(end - step_size, 0)
+			filled = len(self.mmap[start:end].rstrip(b'\0'))
+
+			if filled:
+				return (start + filled - 1) // self.hash_size
+
+			end = start
+
+		return -1
+
+	def _raw(self, height):
+		offset = height * self.hash_size
+		return self.mmap[offset:offset + self.hash_size]
+
+	def get(self, height):
+		""" Returns the hex hash of the block at height, or None if not known """
+
+		if height < 0 or height >= self.capacity:
+			return None
+
+		raw = self._raw(height)
+
+		return raw.hex() if raw != self.empty_hash else None
+
+	def set(self, height, block_hash):
+		""" Stores hex hash block_hash for the block at height """
+
+		if height >= self.capacity:
+			new_size = (height // self.grow_heights + 1) * self.grow_heights * self.hash_size
+
+			# Another run may have grown the file further already
+			if os.fstat(self.file.fileno()).st_size < new_size:
+				self.file.truncate(new_size)
+
+			self._remap()
+
+		offset = height * self.hash_size
+		self.mmap[offset:offset + self.hash_size] = bytes.fromhex(block_hash)
+		self.top = max(self.top, height)
+
+	def truncate(self, height):
+		""" Forgets the hashes of all blocks at height and above """
+
+		height = max(height, 0)
+
+		# Other runs sharing the file may have stored higher hashes since we last looked
+		self._remap()
+		self.top = self._find_top()
+
+		if height > self.top:
+			return
+
+		start = height * self.hash_size
+		end = (self.top + 1) * self.hash_size
+		self.mmap[start:end] = bytes(end - start)
+		self.top = height - 1
+
+		while self.top >= 0 and self._raw(self.top) == self.empty_hash:
+			self.top -= 1
+
+	def flush(self):
+		if self.mmap is not None:
+			self.mmap.flush()
+
+	def close(self):
+		if self.mmap is not None:
+			self.mmap.flush()
+			self.mmap.close()
+			self.mmap = None
+
+		self.file.close()
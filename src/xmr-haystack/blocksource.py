@@ -0,0 +1,157 @@
+from time import perf_counter
+import sys
+
+from .scanstats import ScanStats
+
+class BlockSource(object):
+	"""
+	Base class of local copies of the blockchain which can be scanned instead of a daemon. It answers
+	the subset of the DaemonConnection interface that scan() and the cache validation use, so it can
+	be passed to them instead of one.
+
+	Like a daemon, get_block() returns the hashes of the block's txs, which can then be passed to
+	get_transactions(). Since txs aren't indexed by hash, get_block() decodes them right away and
+	get_transactions() can only return the txs of blocks which have been returned by get_block() and
+	not yet fetched. Only the txs of the last max_pending_txs are kept, which is plenty for scan()'s
+	batches.
+
+	Subclasses implement num_blocks(), read_header(), read_block(), top_block_hash() and close().
+	"""
+
+	max_pending_txs = 100000
+
+	def __init__(self, stats=None):
+		"""
+		stats: ScanStats, statistics to record the block reads in, like DaemonConnection does
+		"""
+
+		self.stats = stats if stats is not None else ScanStats()
+		self.pending_txs = {}
+
+	def num_blocks(self):
+		raise NotImplementedError
+
+	def read_header(self, height):
+		""" Returns result of xmrbin.read_block_header() for the block at height """
+
+		raise NotImplementedError
+
+	def read_block(self, height):
+		"""
+		Returns tuple (block, txs, size): the result of xmrbin.read_block() for the block at height, a
+		list of Transaction objs of all the txs in block['tx_hashes'] and the number of bytes read
+		"""
+
+		raise NotImplementedError
+
+	def top_block_hash(self):
+		raise NotImplementedError
+
+	def close(self):
+		raise NotImplementedError
+
+	def host(self):
+		return None
+
+	def check_height(self, height):
+		if height < 0 or height >= self.num_blocks():
+			raise ValueError('height {} is not in {}'.format(height, self))
+
+	def get_info(self):
+		""" Returns object like the response of the get_info RPC command, with the height of the chain """
+
+		return {'height': self.num_blocks(), 'status': 'OK', 'untrusted': False}
+
+	def block_hash(self, height):
+		""" Returns hex hash of block at height """
+
+		# Every block but the top one has its hash written in the header of the next one
+		if height + 1 < self.num_blocks():
+			return self.read_header(height + 1)['prev_hash']
+
+		return self.top_block_hash()
+
+	def get_block_header_by_height(self, height):
+		""" Returns object like the block header in the response of the get_block_header_by_height RPC command """
+
+		self.check_height(height)
+
+		header = self.read_header(height)
+		header['height'] = height
+		header['hash'] = self.block_hash(height)
+
+		return header
+
+	def get_block_headers_range(self, start_height, end_height):
+		return [self.get_block_header_by_height(h) for h in range(start_height, end_height + 1)]
+
+	def get_block(self, height):
+		"""
+		Returns object like the result of the get_block RPC command for the block at height. Its txs are
+		decoded right away and kept until they are fetched with get_transactions().
+		"""
+
+		self.check_height(height)
+
+		start = perf_counter()
+
+		with self.stats.stage('parse'):
+			block, txs, size = self.read_block(height)
+
+			for tx in txs:
+				self.pending_txs[tx.hash] = tx
+
+			# Blocks may be asked for without fetching their txs afterwards, e.g. to check their hashes
+			while len(self.pending_txs) > self.max_pending_txs:
+				del self.pending_txs[next(iter(self.pending_txs))]
+
+		header = {
+			'height': height,
+			'hash': self.block_hash(height),
+			'prev_hash': block['prev_hash'],
+			'timestamp': block['timestamp'],
+			'major_version': block['major_version'],
+			'minor_version': block['minor_version'],
+			'nonce': block['nonce'],
+			'num_txes': len(block['tx_hashes'])
+		}
+
+		self.stats.record_rpc('get_block', perf_counter() - start, 0, size)
+
+		result = {'block_header': header, 'status': 'OK', 'untrusted': False}
+
+		# Like monerod, leave out tx_hashes entirely for blocks without any txs
+		if block['tx_hashes']:
+			result['tx_hashes'] = block['tx_hashes']
+
+		return result
+
+	def get_transactions(self, txids, ring_only=False, with_outs=True):
+		"""
+		Returns list of Transaction objs for txids, which have to belong to blocks returned by
+		get_block(), or None if any of them don't. ring_only and with_outs are ignored, since the txs
+		are already decoded from binary.
+		"""
+
+		missing = [txid for txid in txids if txid not in self.pending_txs]
+
+		if missing:
+			print("Error! Transactions not found in {}:".format(self), missing, file=sys.stderr)
+			return None
+
+		return [self.pending_txs.pop(txid) for txid in txids]
+
+	def get_transaction_pool(self, with_outs=True):
+		""" Always returns None, since a copy of the blockchain has no pool """
+
+		return None
+
+	def is_key_image_spent(self, key_images):
+		""" Always returns None, since key images aren't indexed """
+
+		return None
+
+	def get_output_distribution(self, from_height=0, to_height=0, cumulative=True):
+		""" Always returns None, since counting the outputs would mean decoding every block up to to_height """
+
+		return None
@@ -0,0 +1,116 @@
+from array import array
+import mmap
+
+from .blocksource import BlockSource
+from .xmrbin import BlobReader, block_hash, read_block, read_block_header, read_tx
+from .xmrtype import Transaction
+
+class BootstrapFile(BlockSource):
+	"""
+	Offline block source reading the raw blockchain file written by monero-blockchain-export
+	(blockchain.raw) through mmap.
+
+	The file starts with a 4 byte magic number and a header, followed by chunks. Every chunk is a 4
+	byte little endian size and a block package: the block, all of its txs (unpruned), its weight,
+	cumulative difficulty and coins generated. Opening the file only walks the chunk sizes to index
+	the blocks by height. Blocks and txs are only decoded when they are asked for.
+	"""
+
+	magic = 0x28721586
+
+	def __init__(self, path, stats=None):
+		"""
+		path: str, path of blockchain.raw file
+		stats: ScanStats, statistics to record the block reads in, like DaemonConnection does
+		"""
+
+		super().__init__(stats)
+
+		self.path = path
+		self.file = open(path, 'rb')
+
+		try:
+			self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+		except ValueError:
+			self.file.close()
+			raise ValueError('{} is empty'.format(path))
+
+		self.offsets = array('Q')
+		self._index()
+
+	@classmethod
+	def is_bootstrap_file(cls, path):
+		""" Returns True if the file at path starts with the magic number of blockchain.raw files """
+
+		with open(path, 'rb') as f:
+			return int.from_bytes(f.read(4), 'little') == cls.magic
+
+	def _index(self):
+		""" Fills self.offsets with the offset of every block package in the file """
+
+		blob = self.mmap
+		reader = BlobReader(blob)
+
+		if int.from_bytes(reader.read_bytes(4), 'little') != self.magic:
+			raise ValueError('{} is not a blockchain export file'.format(self.path))
+
+		# The header starts with the size and contents of the file info, which holds the header size
+		reader.skip(4)
+		reader.skip(2) # major and minor version
+		offset = 4 + reader.read_varint()
+
+		# An export that was cut off may end in a partial chunk, which is ignored
+		while offset + 4 <= len(blob):
+			chunk_size = int.from_bytes(blob[offset:offset + 4], 'little')
+
+			if offset + 4 + chunk_size > len(blob):
+				break
+
+			self.offsets.append(offset + 4)
+			offset += 4 + chunk_size
+
+	def _chunk_end(self, height):
+		start = self.offsets[height]
+
+		return start + int.from_bytes(self.mmap[start - 4:start], 'little')
+
+	def num_blocks(self):
+		return len(self.offsets)
+
+	def close(self):
+		self.mmap.close()
+		self.file.close()
+
+	def read_header(self, height):
+		return read_block_header(BlobReader(self.mmap, self.offsets[height]))
+
+	def top_block_hash(self):
+		block = read_block(BlobReader(self.mmap, self.offsets[-1]))
+
+		return block_hash(self.mmap, block)
+
+	def read_block(self, height):
+		reader = BlobReader(self.mmap, self.offsets[height])
+		block = read_block(reader)
+
+		if reader.read_varint() != len(block['tx_hashes']):
+			raise ValueError('number of txs in block {} does not match its tx hashes'.format(height))
+
+		txs = []
+		for tx_hash in block['tx_hashes']:
+			tx = read_tx(reader)
+			ins = [gindex for ring in tx['ins'] for gindex in ring]
+			txs.append(Transaction(tx_hash, height, block['timestamp'], ins, tx['outs'], tx['kimages']))
+
+		# Block weight, cumulative difficulty and coins generated. Nothing may follow them, since the
+		# index assumes one block per chunk, like monero-blockchain-export writes them
+		for _ in range(3):
+			reader.read_varint()
+
+		if reader.offset != self._chunk_end(height):
+			raise ValueError('chunk of block {} does not contain exactly one block'.format(height))
+
+		return block, txs, self._chunk_end(height) - self.offsets[height]
+
+	def __str__(self):
+		return 'blockchain export ' + self.path
@@ -1,8 +1,12 @@
 import appdirs
 import argparse
+from datetime import datetime
+import importlib.util
 import os.path
 
 from .blobcache import BlobCache
+from .bootstrap import BootstrapFile
+from .ratelimit import RateLimiter
 from . import xmrconn
 
 def get_parser():
@@ -13,22 +17,30 @@ def get_parser():
 	parser = argparse.ArgumentParser(prog=prog, description=desc)
 	parser.add_argument('wallet file',
 		help='path to wallet file')
-	parser.add_argument('-a', '--daemon-addr',
-		help='daemon address (e.g. node.xmr.to)',
-		default='127.0.0.1',
-		dest='addr')
-	parser.add_argument('-p', '--daemon-port',
-		help='daemon port (e.g. 18081)',
-		default=18081,
-		type=int,
-		dest='port')
-	parser.add_argument('-l', '--daemon-login',
-		help='monerod RPC login in the form of [username]:[password]',
-		dest='login')
+	add_daemon_args(parser)
 	parser.add_argument('-s', '--scan-height',
 		help='rescan blockchain from specified height. defaults to wallet restore height',
 		type=int,
 		dest='height')
+	parser.add_argument('--end-height',
+		help='stop scanning at specified height. defaults to the top of the blockchain',
+		type=int,
+		dest='end_height')
+	parser.add_argument('--since',
+		help='only scan blocks from this time on, e.g. 2024-01-31, 2024-01-31T12:00 or a UNIX timestamp. dates '
+			'are in local time unless they have a UTC offset',
+		metavar='TIME')
+	parser.add_argument('--until',
+		help='only scan blocks from before this time, in the same format as --since',
+		metavar='TIME')
+	parser.add_argument('--mempool',
+		help='also check the transactions in the daemon\'s pool, which are fetched in a single request. pending '
+			'results are shown apart and never cached',
+		action='store_true')
+	parser.add_argument('--check-key-images',
+		help='ask the daemon which of your outputs are spent instead of trusting the wallet. this sends all of '
+			'your key images to the daemon, so only use it with a daemon you trust',
+		action='store_true')
 	quietgrp = parser.add_mutually_exclusive_group()
 	quietgrp.add_argument('-q', '--quiet',
 		help='use this flag if you would like a simpler output',
@@ -47,13 +59,156 @@ def get_parser():
 	parser.add_argument('-n', '--no-cache',
 		help='do not read from cache file and do not save to cache file',
 		action='store_true')
+	parser.add_argument('--block-hashes',
+		help='path to block hash table, which is used to check cached results against the daemon\'s chain. '
+			'defaults to a file in the cache directory',
+		dest='block_hashes_path')
 	parser.add_argument('-c', '--wallet-cli-path',
 		help='path to monero-wallet-cli executable. Helpful if executable is not in PATH',
 		type=argparse.FileType('r'),
 		dest='cli_exe_file')
+	parser.add_argument('--blockchain-raw',
+		help='scan the blockchain export file written by monero-blockchain-export (blockchain.raw) instead of '
+			'asking the daemon. no daemon needed',
+		dest='raw_path')
+	parser.add_argument('--lmdb',
+		help='scan monerod\'s blockchain database (the lmdb directory or its data.mdb) directly instead of '
+			'asking the daemon. monerod may keep running. requires the lmdb package',
+		dest='lmdb_path')
+	parser.add_argument('-r', '--ring-only',
+		help='fetch transactions as binary blobs and only decode their prefixes. much less data than JSON',
+		action='store_true')
+	parser.add_argument('--order',
+		help='order to scan blocks in. newest-first and interleaved walk the chain in chunks, finding recent '
+			'transactions first',
+		choices=['oldest-first', 'newest-first', 'interleaved'],
+		default='oldest-first')
+	parser.add_argument('--progress-file',
+		help='append machine-readable progress reports (one JSON object per line) to this file. use - for stdout',
+		type=argparse.FileType('a'),
+		dest='progress_file')
+	parser.add_argument('--stats',
+		help='write scan statistics (RPC latencies, bytes transferred, stage timings) as JSON to this file at exit. '
+			'use - for stdout',
+		type=argparse.FileType('w'),
+		dest='stats_file')
+	parser.add_argument('--profile',
+		help='profile the scan and write the results to this file',
+		dest='profile_path')
+	parser.add_argument('--profiler',
+		help='profiler used by --profile. cprofile writes pstats files, pyinstrument writes text or .html',
+		choices=['cprofile', 'pyinstrument'],
+		default='cprofile')
 
 	return parser
 
+def add_daemon_args(parser):
+	""" Adds the arguments for connecting to monerod to argparse.ArgumentParser parser """
+
+	parser.add_argument('-a', '--daemon-addr',
+		help='daemon address (e.g. node.xmr.to)',
+		default='127.0.0.1',
+		dest='addr')
+	parser.add_argument('-p', '--daemon-port',
+		help='daemon port (e.g. 18081)',
+		default=18081,
+		type=int,
+		dest='port')
+	parser.add_argument('-l', '--daemon-login',
+		help='monerod RPC login in the form of [username]:[password]',
+		dest='login')
+	parser.add_argument('--timeout',
+		help='seconds before a daemon request times out. get_transactions gets 4 times as long. defaults to 30',
+		type=float,
+		default=30.0)
+	parser.add_argument('--retries',
+		help='number of times to retry failed daemon requests, with jittered exponential backoff. defaults to 3',
+		type=int,
+		default=3)
+	parser.add_argument('--hedge-daemon',
+		help='second daemon (e.g. node2.example.com:18081) to send duplicates of unusually slow requests to. '
+			'the first answer wins',
+		metavar='ADDR:PORT',
+		dest='hedge')
+	parser.add_argument('--max-rps',
+		help='maximum number of daemon requests per second. lowered automatically while the daemon is overloaded. '
+			'defaults to no limit until the daemon shows signs of overload',
+		type=float,
+		dest='max_rps')
+	parser.add_argument('--max-bps',
+		help='maximum number of bytes per second to download from the daemon. defaults to no limit',
+		type=float,
+		dest='max_bps')
+
+def parse_daemon_login(login):
+	"""
+	Returns tuple (username, password) parsed from --daemon-login value login, or (None, None) if
+	login is None. Raises a ValueError if login is malformed.
+	"""
+
+	if login is None:
+		return None, None
+
+	print("Warning: passing passwords as command line arguments is unsafe!")
+
+	login_comps = login.split(':')
+
+	if len(login_comps) != 2:
+		raise ValueError('error: --daemon-login must be in form [username]:[password]')
+
+	return tuple(login_comps)
+
+def parse_hedge_daemon(hedge):
+	"""
+	Returns tuple (addr, port) parsed from --hedge-daemon value hedge, or None if hedge is None.
+	Raises a ValueError if hedge is malformed.
+	"""
+
+	if hedge is None:
+		return None
+
+	addr, _, port = hedge.rpartition(':')
+
+	if not addr or not port.isdigit():
+		raise ValueError('error: --hedge-daemon must be in form [address]:[port]')
+
+	return addr, int(port)
+
+def parse_time(value, flag):
+	"""
+	Returns UNIX timestamp parsed from the value of option flag, which is either a UNIX timestamp or an
+	ISO 8601 date or date and time, or None if value is None. Raises a ValueError if value is malformed.
+	"""
+
+	if value is None:
+		return None
+
+	if value.isdigit():
+		return int(value)
+
+	try:
+		return int(datetime.fromisoformat(value).timestamp())
+	except ValueError:
+		raise ValueError('error: {} must be a date like 2024-01-31, a date and time like 2024-01-31T12:00 or a '
+			'UNIX timestamp'.format(flag))
+
+def make_daemon_connection(addr, port, user, pwd, timeout, retries, hedge=None, stats=None, max_rps=None,
+	max_bps=None):
+	"""
+	Returns a xmrconn.DaemonConnection with the given timeout and retries, hedging requests to
+	hedge (a tuple (addr, port) as returned by parse_hedge_daemon()) if it is not None. Every daemon
+	gets its own RateLimiter with budgets max_rps and max_bps.
+	"""
+
+	hedge_conn = None
+
+	if hedge is not None:
+		hedge_conn = xmrconn.DaemonConnection(hedge[0], hedge[1], timeout=timeout,
+			rate_limiter=RateLimiter(max_rps, max_bps))
+
+	return xmrconn.DaemonConnection(addr, port, user, pwd, stats=stats, timeout=timeout, retries=retries,
+		hedge=hedge_conn, rate_limiter=RateLimiter(max_rps, max_bps))
+
 def validate_and_process(ns, wallet_pass=None):
 	"""
 	Checks the arguments in namespace for any conditions not handled by get_parser
@@ -68,23 +223,44 @@ def validate_and_process(ns, wallet_pass=None):
 	Returns: a dict containing following entries:
 		'walletf' -> str, valid path to monero wallet file
 		'height' -> int >= 0, height to scan from instead of default. None if program should decide
+		'end_height' -> int >= 0, height to stop scanning at. None if scanning to the top of the blockchain
+		'since' -> int, UNIX timestamp of the first blocks to scan. None if not limited
+		'until' -> int, UNIX timestamp of the first blocks not to scan anymore. None if not limited
+		'mempool' -> bool, True if the txs in the daemon's pool should be checked too
+		'check_key_images' -> bool, True if the daemon should be asked which outputs are spent
 		'daddr' -> str, valid address (port not included) of monero daemon
 		'dport' -> int, valid port of monero daemon
 		'dlogin' -> bool, True if valid login is specified, False if not specified
 		'duser' -> str, valid daemon username. None if daemon_login == False
 		'dpass' -> str, valid daemon password. None if daemon_login == False
-		'restricted' -> bool, True if only restricted RPC is enabled
+		'timeout' -> float, seconds before daemon requests time out
+		'retries' -> int >= 0, number of times to retry failed daemon requests
+		'hedge' -> tuple(str, int), address and port of daemon to hedge requests to. None if not hedging
+		'max_rps' -> float, maximum daemon requests per second. None if not limited
+		'max_bps' -> float, maximum bytes per second downloaded from daemon. None if not limited
+		'restricted' -> bool, True if only restricted RPC is enabled. False if scanning a blockchain export
+			or database
+		'raw' -> str, path of blockchain export file to scan instead of the daemon. None if not specified
+		'lmdb' -> str, path of blockchain database to scan instead of the daemon. None if not specified
 		'quiet' -> Bool, True if --quiet or --extra-quiet was specified
 		'vquiet' -> Bool, True if --extra-quiet was specified
 		'caching' -> bool, True if program should cache, False only if explicitly specified
 		'cachein' -> BlobCache, cache object at --cache-input file. None if not caching or unable to load cache
 		'cacheout' -> open() file, writable file at --cache-output. None if not caching
+		'block_hashes' -> str, path of block hash table file. None if not caching
 		'wallcmd' -> str, monero-wallet-cli shell command name
+		'ring_only' -> bool, True if txs should be fetched as binary blobs and only their prefixes decoded
+		'order' -> str, 'oldest-first', 'newest-first' or 'interleaved', order to scan blocks in
+		'progress' -> open() file, file to append JSON progress lines to. None if not specified
+		'stats' -> open() file, writable file to dump scan statistics to. None if not specified
+		'profile' -> str, path to write profiler results to. None if not profiling
+		'profiler' -> str, 'cprofile' or 'pyinstrument'
 	"""
 
 	settings = {}
 	cache_base = appdirs.user_cache_dir('xmr-haystack')
 	default_cache_path = os.path.join(cache_base, 'xmrhaystack.json')
+	default_block_hashes_path = os.path.join(cache_base, 'blockhashes.bin')
 
 	settings['walletf'] = getattr(ns, 'wallet file')
 
@@ -98,52 +274,118 @@ def validate_and_process(ns, wallet_pass=None):
 	if ns.height is not None and ns.height < 0:
 		raise ValueError('error: --height can not be less than zero')
 
+	# Check scan window
+	settings['end_height'] = ns.end_height
+	settings['since'] = parse_time(ns.since, '--since')
+	settings['until'] = parse_time(ns.until, '--until')
+
+	if ns.end_height is not None and ns.end_height < 0:
+		raise ValueError('error: --end-height can not be less than zero')
+	if ns.end_height is not None and ns.height is not None and ns.end_height < ns.height:
+		raise ValueError('error: --end-height can not be less than --scan-height')
+	if ns.since is not None and ns.height is not None:
+		raise ValueError('error: --scan-height and --since can\'t both be set')
+	if settings['since'] is not None and settings['until'] is not None and settings['until'] <= settings['since']:
+		raise ValueError('error: --until must be later than --since')
+
+	settings['mempool'] = ns.mempool
+	settings['check_key_images'] = ns.check_key_images
+	settings['ring_only'] = ns.ring_only
+	settings['order'] = ns.order
+
+	# Check progress reporting, statistics and profiling
+	settings['progress'] = ns.progress_file
+	settings['stats'] = ns.stats_file
+	settings['profile'] = ns.profile_path
+	settings['profiler'] = ns.profiler
+
+	if ns.profiler == 'pyinstrument' and importlib.util.find_spec('pyinstrument') is None:
+		raise ValueError('error: --profiler pyinstrument requires the pyinstrument package to be installed')
+
 	# Check daemon login flag parseability
 	settings['dlogin'] = ns.login is not None
+	settings['duser'], settings['dpass'] = parse_daemon_login(ns.login)
 
-	if ns.login is not None:
-		print("Warning: passing passwords as command line arguments is unsafe!")
+	# Check request timeouts, retries and hedging
+	if ns.timeout <= 0:
+		raise ValueError('error: --timeout must be greater than zero')
+	if ns.retries < 0:
+		raise ValueError('error: --retries can not be less than zero')
 
-		login_comps = ns.login.split(':')
+	settings['timeout'] = ns.timeout
+	settings['retries'] = ns.retries
+	settings['hedge'] = parse_hedge_daemon(ns.hedge)
 
-		if len(login_comps) != 2:
-			raise ValueError('error: --daemon-login must be in form [username]:[password]')
+	if ns.max_rps is not None and ns.max_rps <= 0:
+		raise ValueError('error: --max-rps must be greater than zero')
+	if ns.max_bps is not None and ns.max_bps <= 0:
+		raise ValueError('error: --max-bps must be greater than zero')
 
-		settings['duser'], settings['dpass'] = login_comps
-	else:
-		settings['duser'], settings['dpass'] = None, None
+	settings['max_rps'] = ns.max_rps
+	settings['max_bps'] = ns.max_bps
 
-	# Check daemon address + port + login
-	conn = xmrconn.DaemonConnection(ns.addr, ns.port, settings['duser'], settings['dpass'])
+	# Check blockchain export file and database. If we scan one, we don't need the daemon
+	settings['raw'] = ns.raw_path
+	settings['lmdb'] = ns.lmdb_path
+	settings['daddr'] = ns.addr
+	settings['dport'] = ns.port
+	offline = ns.raw_path is not None or ns.lmdb_path is not None
 
-	if not settings['quiet']: print("Checking daemon access...")
-	try:
-		info = conn.get_info()
-	except:
-		err_msg = 'error: daemon at {} not reachable'.format(conn.host())
-		raise ValueError(err_msg)
+	if ns.raw_path is not None and ns.lmdb_path is not None:
+		raise ValueError('error: --blockchain-raw and --lmdb can\'t both be set')
+	if offline and ns.mempool:
+		raise ValueError('error: --mempool needs a daemon, a blockchain export or database has no transaction pool')
+	if offline and ns.check_key_images:
+		raise ValueError('error: --check-key-images needs a daemon, a blockchain export or database has no key images')
 
-	if 'status' not in info or info['status'] != 'OK':
-		raise ValueError('error: daemon responded unexpectedly')
+	if ns.lmdb_path is not None:
+		if importlib.util.find_spec('lmdb') is None:
+			raise ValueError('error: --lmdb requires the lmdb package to be installed')
 
-	settings['daddr'] = ns.addr
-	settings['dport'] = ns.port
+		data_path = os.path.join(ns.lmdb_path, 'data.mdb') if os.path.isdir(ns.lmdb_path) else ns.lmdb_path
+		if not os.path.isfile(data_path):
+			raise ValueError('error: blockchain database "{}" not found'.format(data_path))
 
-	# sync_info is a command only allowed in unrestricted RPC mode. If it isn't enabled, there's a
-	# good chance that the daemon will reject large get_transactions requests. Warn the user of this
-	if not settings['quiet']: print("Checking restricted RPC command access...")
+		settings['restricted'] = False
+	elif ns.raw_path is not None:
+		try:
+			is_export = BootstrapFile.is_bootstrap_file(ns.raw_path)
+		except OSError:
+			raise ValueError('error: unable to open blockchain export file "{}"'.format(ns.raw_path))
 
-	try:
-		sync_info = conn.sync_info()
-	except:
-		err_msg = 'error: daemon at {}:{} not reachable'.format(ns.addr, ns.port)
-		raise ValueError(err_msg)
+		if not is_export:
+			raise ValueError('error: "{}" is not a blockchain export file'.format(ns.raw_path))
+
+		settings['restricted'] = False
+	else:
+		# Check daemon address + port + login
+		conn = xmrconn.DaemonConnection(ns.addr, ns.port, settings['duser'], settings['dpass'], timeout=ns.timeout)
 
-	# If in unrestricted mode then resp['result']['status'] == 'OK'
-	settings['restricted'] = sync_info is None
-	if settings['restricted']:
-		if not settings['vquiet']:
-			print("Warning: daemon is in restricted RPC mode. Some functionality may not be available")
+		if not settings['quiet']: print("Checking daemon access...")
+		try:
+			info = conn.get_info()
+		except:
+			err_msg = 'error: daemon at {} not reachable'.format(conn.host())
+			raise ValueError(err_msg)
+
+		if 'status' not in info or info['status'] != 'OK':
+			raise ValueError('error: daemon responded unexpectedly')
+
+		# sync_info is a command only allowed in unrestricted RPC mode. If it isn't enabled, there's a
+		# good chance that the daemon will reject large get_transactions requests. Warn the user of this
+		if not settings['quiet']: print("Checking restricted RPC command access...")
+
+		try:
+			sync_info = conn.sync_info()
+		except:
+			err_msg = 'error: daemon at {}:{} not reachable'.format(ns.addr, ns.port)
+			raise ValueError(err_msg)
+
+		# If in unrestricted mode then resp['result']['status'] == 'OK'
+		settings['restricted'] = sync_info is None
+		if settings['restricted']:
+			if not settings['vquiet']:
+				print("Warning: daemon is in restricted RPC mode. Some functionality may not be available")
 
 	# Check monero-wallet-cli
 	settings['wallcmd'] = ns.cli_exe_file.name if ns.cli_exe_file else 'monero-wallet-cli'
@@ -155,7 +397,11 @@ def validate_and_process(ns, wallet_pass=None):
 	# Check wallet login if password is supplied
 	if wallet_pass is not None:
 		if not settings['quiet']: print("Checking wallet login...")
-		wallet = xmrconn.WalletConnection(settings['walletf'], wallet_pass, conn.host(), ns.login, cmd=settings['wallcmd'])
+		if offline:
+			wallet = xmrconn.WalletConnection(settings['walletf'], wallet_pass, cmd=settings['wallcmd'], offline=True)
+		else:
+			wallet = xmrconn.WalletConnection(settings['walletf'], wallet_pass, conn.host(), ns.login,
+				cmd=settings['wallcmd'])
 
 		if not wallet.is_valid():
 			raise ValueError('error: failed to login to wallet')
@@ -166,9 +412,12 @@ def validate_and_process(ns, wallet_pass=None):
 		if ns.cache_in is not None or ns.cache_out is not None:
 			raise ValueError('error: --cache-input and --cache-output can\'t be set if" \
 				" --no-cache is set')
+		if ns.block_hashes_path is not None:
+			raise ValueError('error: --block-hashes can\'t be set if --no-cache is set')
 
 		settings['cachein'] = None
 		settings['cacheout'] = None
+		settings['block_hashes'] = None
 	else: # should cache
 		# Prepare cache dir
 		try:
@@ -176,6 +425,8 @@ def validate_and_process(ns, wallet_pass=None):
 		except:
 			print("Warning: could not prepare cache directory!")
 
+		settings['block_hashes'] = ns.block_hashes_path or default_block_hashes_path
+
 		# Work on input cache. Output cache depends on input cache if unspecified
 		if ns.cache_in is not None:
 			try:
@@ -0,0 +1,152 @@
+import os.path
+import struct
+
+from .blocksource import BlockSource
+from .xmrbin import BlobReader, block_hash, read_block, read_block_header, read_tx_prefix
+from .xmrtype import Transaction
+
+class LMDBBlockchain(BlockSource):
+	"""
+	Block source reading monerod's blockchain database (lmdb/data.mdb) directly, read-only. It needs
+	the lmdb package. The database may be open by a running monerod at the same time.
+
+	Only two tables are read, both keyed by 64 bit integers: 'blocks' holds the serialized block at
+	every height and 'txs_pruned' the pruned tx at every tx id. The other tables are sorted with
+	custom comparison functions inside monerod, so they can't be searched from here. Tx ids are
+	handed out in chain order though, every block's miner tx followed by the block's other txs, so
+	the txs of a block are found by bisecting the tx ids for its miner tx, whose input holds the
+	block height. Blocks are usually read in ascending order, in which case the tx id of the next
+	block is already known and no bisection is needed.
+
+	All reads are zero-copy: the blobs are parsed straight out of LMDB's memory map.
+	"""
+
+	def __init__(self, path, stats=None):
+		"""
+		path: str, path of monerod's lmdb directory or the data.mdb file in it
+		stats: ScanStats, statistics to record the block reads in, like DaemonConnection does
+		"""
+
+		import lmdb
+
+		super().__init__(stats)
+
+		self.path = path
+		self.env = lmdb.open(path, subdir=os.path.isdir(path), readonly=True, max_dbs=32)
+
+		try:
+			self.blocks_db = self.env.open_db(b'blocks', integerkey=True, create=False)
+			self.txs_db = self.env.open_db(b'txs_pruned', integerkey=True, create=False)
+		except lmdb.NotFoundError:
+			self.env.close()
+			raise ValueError('{} is not a monero blockchain database'.format(path))
+
+		# (height, tx id of its miner tx) of the block after the last one read
+		self.next_block = None
+
+	@staticmethod
+	def _key(n):
+		return struct.pack('=Q', n)
+
+	def num_blocks(self):
+		with self.env.begin() as txn:
+			return txn.stat(self.blocks_db)['entries']
+
+	def close(self):
+		self.env.close()
+
+	def _block_blob(self, txn, height):
+		blob = txn.get(self._key(height), db=self.blocks_db)
+
+		if blob is None:
+			raise ValueError('height {} is not in {}'.format(height, self))
+
+		return blob
+
+	def read_header(self, height):
+		with self.env.begin(buffers=True) as txn:
+			return read_block_header(BlobReader(self._block_blob(txn, height)))
+
+	def top_block_hash(self):
+		with self.env.begin(buffers=True) as txn:
+			blob = bytes(self._block_blob(txn, txn.stat(self.blocks_db)['entries'] - 1))
+
+		return block_hash(blob, read_block(BlobReader(blob)))
+
+	@staticmethod
+	def _miner_tx_height(cursor):
+		""" Returns the block height in the input of the tx at cursor, or None if it isn't a miner tx """
+
+		return read_tx_prefix(BlobReader(cursor.value()), with_outs=False)['height']
+
+	def _tx_block_height(self, cursor, tx_id):
+		""" Returns the height of the block containing the tx with tx_id, by walking back to its miner tx """
+
+		if not cursor.set_key(self._key(tx_id)):
+			raise ValueError('tx id {} is not in {}'.format(tx_id, self))
+
+		while True:
+			height = self._miner_tx_height(cursor)
+
+			if height is not None:
+				return height
+
+			if not cursor.prev():
+				raise ValueError('txs before tx id {} have no miner tx in {}'.format(tx_id, self))
+
+	def _find_miner_tx(self, txn, cursor, height):
+		""" Returns the tx id of the miner tx of the block at height """
+
+		if self.next_block is not None and self.next_block[0] == height:
+			tx_id = self.next_block[1]
+
+			# The chain may have been reorganized since the last read
+			if cursor.set_key(self._key(tx_id)) and self._miner_tx_height(cursor) == height:
+				return tx_id
+
+		low, high = 0, txn.stat(self.txs_db)['entries']
+
+		while low < high:
+			mid = (low + high) // 2
+
+			if self._tx_block_height(cursor, mid) < height:
+				low = mid + 1
+			else:
+				high = mid
+
+		if not cursor.set_key(self._key(low)) or self._miner_tx_height(cursor) != height:
+			raise ValueError('miner tx of block {} not found in {}'.format(height, self))
+
+		return low
+
+	def read_block(self, height):
+		with self.env.begin(buffers=True) as txn:
+			blob = self._block_blob(txn, height)
+			block = read_block(BlobReader(blob))
+			size = len(blob)
+
+			cursor = txn.cursor(db=self.txs_db)
+			tx_id = self._find_miner_tx(txn, cursor, height)
+			cursor.set_key(self._key(tx_id))
+
+			txs = []
+			for tx_hash in block['tx_hashes']:
+				if not cursor.next():
+					raise ValueError('txs of block {} are missing in {}'.format(height, self))
+
+				tx_blob = cursor.value()
+				tx = read_tx_prefix(BlobReader(tx_blob))
+				size += len(tx_blob)
+
+				if tx['height'] is not None:
+					raise ValueError('block {} has fewer txs than tx hashes in {}'.format(height, self))
+
+				ins = [gindex for ring in tx['ins'] for gindex in ring]
+				txs.append(Transaction(tx_hash, height, block['timestamp'], ins, tx['outs'], tx['kimages']))
+
+		self.next_block = (height + 1, tx_id + 1 + len(txs))
+
+		return block, txs, size
+
+	def __str__(self):
+		return 'blockchain database ' + self.path
@@ -0,0 +1,194 @@
+from collections import deque
+from time import time
+
+class ScanProgress(object):
+	"""
+	Tracks the progress, throughput and ETA of a scan over the blocks [start_height, end_height].
+
+	Progress is measured in units of work rather than height, since chain density varies enormously.
+	Every block counts as one unit (for its get_block call) plus one unit for every output created in
+	it, which is roughly proportional to the tx data that has to be fetched and matched. Per-height
+	output counts come from the cumulative RCT output distribution of the daemon. Without it, every
+	block is one unit and progress falls back to being height based.
+
+	If a coverage is given, the blocks need not be scanned in order: the work done is the work of all
+	blocks added to the coverage since the progress was created.
+
+	Rates and ETA are calculated over a moving window of the last window seconds.
+	"""
+
+	def __init__(self, start_height, end_height, out_dist=None, coverage=None, window=60.0):
+		"""
+		start_height: int, first height of the scan
+		end_height: int, last height of the scan
+		out_dist: tuple(int, list[int]), result of DaemonConnection.get_output_distribution() for
+			at least [start_height - 1, end_height], or None if not available
+		coverage: HeightIntervals, heights scanned so far, or None if the scan walks upwards from
+			start_height without gaps
+		window: float, number of seconds to average rates over
+		"""
+
+		self.start_height = start_height
+		self.end_height = end_height
+		self.out_dist = out_dist
+		self.coverage = coverage
+		self.window = window
+
+		self.height = start_height - 1
+		self.blocks = 0
+		self.txs = 0
+		self.bytes = 0
+		self.found = 0
+		self.start_time = time()
+		self.samples = deque([(self.start_time, 0, 0, 0, 0)])
+
+		self.base_blocks, self.base_work = self.covered()
+		self.total_work = self.work_until(end_height) - self.base_work
+
+	def outputs_before(self, height):
+		""" Returns cumulative number of outputs created before height, or 0 if unknown """
+
+		if self.out_dist is None:
+			return 0
+
+		dist_start, dist = self.out_dist
+		i = height - 1 - dist_start
+
+		if i < 0 or not dist:
+			return 0
+		else:
+			return dist[min(i, len(dist) - 1)]
+
+	def work_until(self, height):
+		""" Returns the units of work needed to scan [start_height, height] """
+
+		num_blocks = max(height - self.start_height + 1, 0)
+		num_outputs = self.outputs_before(height + 1) - self.outputs_before(self.start_height)
+
+		return num_blocks + max(num_outputs, 0)
+
+	def covered(self):
+		""" Returns tuple of number of blocks and units of work in coverage inside [start_height, end_height] """
+
+		if self.coverage is None:
+			return 0, 0
+
+		blocks = 0
+		work = 0
+
+		for lo, hi in self.coverage.intersection(self.start_height, self.end_height):
+			blocks += hi - lo + 1
+			work += self.work_until(hi) - self.work_until(lo - 1)
+
+		return blocks, work
+
+	def work_done(self):
+		""" Returns the units of work done since the progress was created """
+
+		if self.coverage is None:
+			return self.work_until(self.height)
+
+		return self.covered()[1] - self.base_work
+
+	def update(self, height, txs, bytes_received, found):
+		"""
+		Updates the progress after all blocks up to and including height have been fully processed, or
+		after blocks have been added to the coverage
+
+		height: int, height of last fully processed block
+		txs: int, total number of txs processed so far
+		bytes_received: int, total number of bytes received from the daemon so far
+		found: int, total number of hits found so far
+		"""
+
+		now = time()
+
+		self.height = height
+		if self.coverage is None:
+			self.blocks = max(height - self.start_height + 1, 0)
+		else:
+			self.blocks = self.covered()[0] - self.base_blocks
+
+		self.txs = txs
+		self.bytes = bytes_received
+		self.found = found
+
+		self.samples.append((now, self.work_done(), self.blocks, txs, bytes_received))
+
+		while len(self.samples) > 2 and self.samples[1][0] < now - self.window:
+			self.samples.popleft()
+
+	def percent(self):
+		if self.total_work <= 0:
+			return 100.0
+
+		return min(self.work_done() / self.total_work * 100, 100.0)
+
+	def rates(self):
+		""" Returns dict of moving average rates: work, blocks, txs and MB per second """
+
+		t0, work0, blocks0, txs0, bytes0 = self.samples[0]
+		t1, work1, blocks1, txs1, bytes1 = self.samples[-1]
+		dt = t1 - t0
+
+		if dt <= 0:
+			return {'work_per_s': 0.0, 'blocks_per_s': 0.0, 'txs_per_s': 0.0, 'mb_per_s': 0.0}
+
+		return {
+			'work_per_s': (work1 - work0) / dt,
+			'blocks_per_s': (blocks1 - blocks0) / dt,
+			'txs_per_s': (txs1 - txs0) / dt,
+			'mb_per_s': (bytes1 - bytes0) / dt / 1e6
+		}
+
+	def eta(self):
+		""" Returns estimated number of seconds until the scan is done, or None if unknown """
+
+		remaining = self.total_work - self.work_done()
+
+		if remaining <= 0:
+			return 0.0
+
+		work_rate = self.rates()['work_per_s']
+
+		return remaining / work_rate if work_rate > 0 else None
+
+	def tojson(self):
+		""" Returns a JSON-serializable dict describing the current progress """
+
+		report = {
+			'time': time(),
+			'elapsed_s': time() - self.start_time,
+			'height': self.height,
+			'start_height': self.start_height,
+			'end_height': self.end_height,
+			'percent': self.percent(),
+			'blocks': self.blocks,
+			'txs': self.txs,
+			'bytes_received': self.bytes,
+			'found': self.found,
+			'eta_s': self.eta()
+		}
+
+		report.update(self.rates())
+
+		return report
+
+	def line(self):
+		""" Returns a one line human readable progress report """
+
+		rates = self.rates()
+		eta = self.eta()
+		eta_str = self.format_duration(eta) if eta is not None else '?'
+
+		line_fmt = "Scanning blockchain (height: {h}/{e}, progress: {p:.2f}%, found: {f}, {b:.1f} blk/s, " \
+			"{t:.0f} tx/s, {m:.2f} MB/s, ETA: {eta})"
+
+		return line_fmt.format(h=max(self.height, self.start_height), e=self.end_height, p=self.percent(),
+			f=self.found, b=rates['blocks_per_s'], t=rates['txs_per_s'], m=rates['mb_per_s'], eta=eta_str)
+
+	@staticmethod
+	def format_duration(seconds):
+		seconds = int(seconds)
+
+		return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
@@ -0,0 +1,167 @@
+from collections import deque
+import threading
+from time import monotonic, sleep
+
+class RateLimiter(object):
+	"""
+	Thread-safe token bucket scheduler for the requests to one daemon, with a budget of requests per
+	second and of response bytes per second. Every request takes a request token before it is sent,
+	and its response size is taken from the byte bucket once it arrived, so a large response delays
+	the next requests instead of the current one.
+
+	The budgets adapt to the daemon, AIMD style. Both are scaled by a level between min_level and 1,
+	which is multiplied by decrease whenever the daemon signals overload (HTTP 429 or 5xx, timeouts,
+	connection errors, or latency latency_factor times higher than usual) and grows back by increase
+	per second of successful requests. Without a request budget, requests aren't limited until the
+	first overload signal, which sets the budget to the request rate observed until then.
+	"""
+
+	def __init__(self, max_rps=None, max_bps=None, decrease=0.5, increase=0.05, min_level=0.02,
+		latency_factor=4.0, cooldown=2.0, window=5.0):
+		"""
+		max_rps: float, maximum requests per second. None for no limit
+		max_bps: float, maximum response bytes per second. None for no limit
+		decrease: float, factor the level is multiplied by on overload
+		increase: float, level gained per second of successful requests
+		min_level: float, lowest level
+		latency_factor: float, how many times higher than its baseline a method's latency has to be to
+			count as overload
+		cooldown: float, minimum number of seconds between two decreases, so that a burst of failed
+			concurrent requests only counts once
+		window: float, number of seconds over which the request rate is observed
+		"""
+
+		self.max_rps = max_rps
+		self.max_bps = max_bps
+		self.decrease = decrease
+		self.increase = increase
+		self.min_level = min_level
+		self.latency_factor = latency_factor
+		self.cooldown = cooldown
+		self.window = window
+
+		self.lock = threading.Lock()
+		self.level = 1.0
+		self.last_decrease = 0.0
+		self.last_refill = monotonic()
+		self.request_tokens = 1.0
+		self.byte_tokens = float(max_bps) if max_bps is not None else 0.0
+		self.sent_times = deque()
+		self.baselines = {}
+
+	def rps(self):
+		""" Returns the current requests per second budget, or None if unlimited """
+
+		return self.max_rps * self.level if self.max_rps is not None else None
+
+	def bps(self):
+		""" Returns the current response bytes per second budget, or None if unlimited """
+
+		return self.max_bps * self.level if self.max_bps is not None else None
+
+	def acquire(self):
+		""" Blocks until the budgets allow sending another request """
+
+		while True:
+			with self.lock:
+				wait = self._try_acquire()
+
+			if wait <= 0:
+				return
+
+			sleep(wait)
+
+	def _try_acquire(self):
+		""" Takes a request token and returns 0 if possible, otherwise the number of seconds to wait """
+
+		now = monotonic()
+		rps = self.rps()
+		bps = self.bps()
+		elapsed = now - self.last_refill
+		self.last_refill = now
+
+		# Buckets hold at most one second worth of budget
+		if rps is not None:
+			self.request_tokens = min(self.request_tokens + elapsed * rps, max(rps, 1.0))
+		if bps is not None:
+			self.byte_tokens = min(self.byte_tokens + elapsed * bps, bps)
+
+		if rps is not None and self.request_tokens < 1:
+			return (1 - self.request_tokens) / rps
+		if bps is not None and self.byte_tokens < 0:
+			return -self.byte_tokens / bps
+
+		self.request_tokens -= 1
+		self.sent_times.append(now)
+
+		while self.sent_times and self.sent_times[0] < now - self.window:
+			self.sent_times.popleft()
+
+		return 0
+
+	def record(self, method, seconds, bytes_received, overloaded):
+		"""
+		Records the outcome of a request and adapts the budgets. Returns True if it caused a decrease.
+
+		method: str, name of RPC method
+		seconds: float, latency of request
+		bytes_received: int, size of response body
+		overloaded: bool, True if the daemon answered with HTTP 429 or 5xx, or didn't answer at all
+		"""
+
+		with self.lock:
+			self.byte_tokens -= bytes_received
+
+			if not overloaded:
+				overloaded = self._latency_grew(method, seconds, bytes_received)
+
+			if overloaded:
+				return self._decrease()
+
+			rps = self.rps()
+			self.level = min(self.level + self.increase / max(rps if rps is not None else 1.0, 1.0), 1.0)
+
+			return False
+
+	def _latency_grew(self, method, seconds, bytes_received):
+		"""
+		Returns True if the latency of method is latency_factor times higher than its baseline, which is
+		the lowest moving average latency seen so far. Latency is normalized by response size, since
+		bigger responses (e.g. more txs) naturally take longer.
+		"""
+
+		cost = seconds / (1 + bytes_received / 65536)
+		baseline = self.baselines.get(method)
+
+		if baseline is None:
+			# [samples, moving average, lowest moving average]
+			self.baselines[method] = [1, cost, cost]
+			return False
+
+		baseline[0] += 1
+		baseline[1] += (cost - baseline[1]) * 0.2
+		baseline[2] = min(baseline[2], baseline[1])
+
+		return baseline[0] >= 10 and baseline[1] > baseline[2] * self.latency_factor
+
+	def _decrease(self):
+		now = monotonic()
+
+		if now - self.last_decrease < self.cooldown:
+			return False
+
+		self.last_decrease = now
+
+		# The first overload without a request budget sets it to the request rate that caused it
+		if self.max_rps is None:
+			span = now - self.sent_times[0] if self.sent_times else 0
+			self.max_rps = max(len(self.sent_times) / span if span > 0 else 1.0, 1.0)
+			self.level = 1.0
+
+		self.level = max(self.level * self.decrease, self.min_level)
+
+		# Let the moving latency averages settle at the new rate
+		for baseline in self.baselines.values():
+			baseline[0] = 0
+
+		return True
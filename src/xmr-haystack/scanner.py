@@ -0,0 +1,459 @@
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from .progress import ScanProgress
+from .xmrtype import Block, HeightIntervals
+
+class Hit(namedtuple('Hit', 'gindex tx')):
+	"""
+	A tx which uses one of our outputs, either as a ring member or by creating it. Whether a ring member
+	is a decoy or our own spend depends on whether the tx contains the output's key image.
+
+	Fields:
+		gindex - int, global index of our output
+		tx - Transaction, tx which uses it
+	"""
+
+class ScanError(Exception):
+	""" Raised by Scanner.iter_hits() when the block source fails to return txs """
+
+class ScanState(object):
+	"""
+	Resumable state of the scans of one set of outputs on one chain. A Scanner given the state of an
+	earlier scan, whether it finished or not, skips every height which has already been scanned.
+	The state is updated in place while scanning. Easily serializable to and from JSON.
+
+	Fields:
+		coverage - HeightIntervals, heights whose txs have all been matched
+		scanned_blocks - list[Block], top blocks of the highest walk, used to detect reorgs if there is
+			no block hash table
+	"""
+
+	def __init__(self, coverage=None, scanned_blocks=None):
+		self.coverage = coverage if coverage is not None else HeightIntervals()
+		self.scanned_blocks = scanned_blocks if scanned_blocks is not None else []
+
+	def tojson(self):
+		return {'coverage': self.coverage.tojson(), 'scanned_blocks': [list(b) for b in self.scanned_blocks]}
+
+	@classmethod
+	def fromjson(cls, json_data):
+		coverage = HeightIntervals.fromjson(json_data.get('coverage', []))
+		scanned_blocks = list(map(Block.fromjson, json_data.get('scanned_blocks', [])))
+
+		return cls(coverage, scanned_blocks)
+
+class Scanner(object):
+	"""
+	Scans the txs of a block source for the ones which use any of our outputs, either as a ring member
+	or by creating them. The block source is a DaemonConnection or a BlockSource, and can be shared by
+	several scanners, as can the block hash table.
+
+	Only the ring members of txs are matched against the global indexes of our outputs. The txs which
+	created our outputs are already known to the wallet, so they are recognized by their hashes, and
+	output keys are never looked at. That's why the scanner only needs the global indexes, and txs are
+	fetched without decoding their outputs.
+
+	Nothing is printed or read from stdin. Hits are yielded by iter_hits() as soon as they are found,
+	and progress and messages are passed to the optional callbacks.
+
+	Heights only enter the state's coverage once all of their hits have been yielded. So a scan which is
+	stopped early, by closing the generator or by an error, yields some hits again when resumed with the
+	same state, as does a rescan after a reorg. Consumers should deduplicate hits by gindex and tx hash.
+	"""
+
+	max_scanned_blocks = 50
+
+	# Whether to decode the outputs of fetched txs. Matching never needs them
+	with_outs = False
+
+	def __init__(self, gindexes, daemon, state=None, block_hashes=None, order='oldest-first',
+		batch_size=10000, ring_only=False, on_progress=None, log=None, created_in=None, ringct=False):
+		"""
+		gindexes: iterable of int, global indexes of our outputs
+		daemon: DaemonConnection or BlockSource, source of blocks and txs
+		state: ScanState, state of an earlier scan to resume. A fresh one if None
+		block_hashes: BlockHashTable, table to store the hashes of all walked blocks in and check reorgs
+			against. None if not used
+		order: str, 'oldest-first', 'newest-first' or 'interleaved', see scan_chunks()
+		batch_size: int, maximum number of txs fetched per request
+		ring_only: bool, True if txs should be fetched as binary blobs and only their prefixes decoded
+		on_progress: callable(ScanProgress, bool), called after every block with the progress and
+			whether the current chunk is done. If None, progress isn't tracked
+		log: callable(str, bool), called with messages about the scan and whether they are warnings
+		created_in: {str: list[int]}, global indexes of our outputs by hash of the tx which created them,
+			e.g. the 'tx_id' of the wallet's incoming transfers. Creation txs aren't reported if None
+		ringct: bool, True if all of our outputs are RingCT outputs, which lets blocks older than them be
+			skipped (see first_relevant_height()). Pre-RingCT outputs would be missed then, so it's opt-in
+		"""
+
+		self.gindexes = frozenset(gindexes)
+		self.created_in = dict(created_in) if created_in is not None else {}
+		self.daemon = daemon
+		self.state = state if state is not None else ScanState()
+		self.block_hashes = block_hashes
+		self.order = order
+		self.batch_size = batch_size
+		self.ring_only = ring_only
+		self.ringct = ringct
+		self.on_progress = on_progress
+		self.log = log if log is not None else lambda msg, warning: None
+
+		self.progress = None
+		self.hits_found = 0
+		self.base_txs = 0
+		self.base_bytes = 0
+
+	def iter_hits(self, start_height, end_height):
+		"""
+		Generator which walks all blocks in [start_height, end_height] which aren't covered by the state
+		yet, in the scanner's order, and yields a Hit for every use of our outputs in their txs. Keeps
+		going until the whole range is covered, since reorgs remove blocks from the coverage again.
+		Raises ScanError if fetching txs fails.
+		"""
+
+		coverage = self.state.coverage
+		scanned_blocks = self.state.scanned_blocks
+		daemon = self.daemon
+		stats = daemon.stats
+
+		# Output counts per block let the progress reflect how much tx data is left, not just blocks. They
+		# also tell us the first block that can possibly contain one of our outputs. Nothing before it can
+		# reference them, so we don't have to fetch or even look at those blocks. The distribution covers
+		# the whole range and grows with it, so it's only fetched if it is used for either.
+		out_dist = None
+		first_height = start_height
+
+		if self.ringct or self.on_progress is not None:
+			out_dist = daemon.get_output_distribution(max(start_height - 1, 0), end_height)
+
+		if self.ringct:
+			first_height = first_relevant_height(self.gindexes, out_dist, start_height, end_height)
+
+		requested_start = start_height
+
+		if first_height > start_height:
+			self.log("Skipping blocks {}-{}, which are older than all of your outputs".format(start_height,
+				first_height - 1), False)
+
+			# Still scan the top block if nothing is left so that it gets recorded in scanned_blocks
+			start_height = min(first_height, end_height)
+			stats.count('blocks_skipped', start_height - requested_start)
+			coverage.add(requested_start, start_height - 1)
+
+		if self.on_progress is not None:
+			self.progress = ScanProgress(start_height, end_height, out_dist, coverage)
+
+		self.base_txs = stats.counters['txs']
+		self.base_bytes = stats.bytes_received()
+
+		while True:
+			gaps = coverage.missing(start_height, end_height)
+
+			if not gaps:
+				# When not walking upwards, the tip was scanned first and may have been reorged since
+				if self.order == 'oldest-first' or not scanned_blocks:
+					return
+
+				if self.block_hashes is not None:
+					rollback_height = find_fork(self.block_hashes, daemon, scanned_blocks[-1].height)
+
+					if rollback_height is None:
+						return
+				else:
+					newest_valid = newest_block(scanned_blocks, daemon)
+					if newest_valid is not None and newest_valid == scanned_blocks[-1]:
+						return
+
+					rollback_height = newest_valid.height + 1 if newest_valid is not None else scanned_blocks[0].height
+
+				self.roll_back(rollback_height)
+
+				continue
+
+			for lo, hi in scan_chunks(gaps, self.order):
+				yield from self._scan_range(lo, hi)
+
+	def roll_back(self, height):
+		"""
+		Forgets that the blocks from height upwards were scanned, after they were reorged away, so that
+		the next walk scans them again. Their hashes are removed from the block hash table too.
+		"""
+
+		self.log("\nReorg detected. Rolling back...", True)
+		self.daemon.stats.count('reorg_rollbacks')
+		self.state.coverage.remove(height)
+		self.state.scanned_blocks[:] = [b for b in self.state.scanned_blocks if b.height < height]
+
+		if self.block_hashes is not None:
+			self.block_hashes.truncate(height)
+
+	def pool_hits(self):
+		"""
+		Returns list of Hits in the txs currently in the daemon's pool, which are fetched with a single
+		request. Nothing is added to the state, since the txs aren't confirmed and may never be. Raises
+		ScanError if the pool can't be fetched, which is always the case for a BlockSource.
+		"""
+
+		stats = self.daemon.stats
+		txs = self.daemon.get_transaction_pool(with_outs=self.with_outs)
+
+		if txs is None:
+			raise ScanError('failed to fetch the transaction pool')
+
+		stats.count('pool_txs', len(txs))
+
+		with stats.stage('match'):
+			return self._match(txs)
+
+	def _match(self, txs):
+		""" Returns list of Hits in txs """
+
+		gindexes = self.gindexes
+		created_in = self.created_in
+		hits = []
+
+		# For each transaction in block
+		for tx in txs:
+			# For each ring member in transaction which belongs to us
+			for kindex in tx.ins:
+				if kindex in gindexes:
+					hits.append(Hit(kindex, tx))
+
+			# If transaction created any of our outputs
+			for kindex in created_in.get(tx.hash, ()):
+				hits.append(Hit(kindex, tx))
+
+		return hits
+
+	def _scan_range(self, lo, hi):
+		""" Walks the blocks [lo, hi] upwards, yielding the hits in their txs and adding them to the coverage """
+
+		daemon = self.daemon
+		stats = daemon.stats
+		coverage = self.state.coverage
+		scanned_blocks = self.state.scanned_blocks
+		block_hashes = self.block_hashes
+		tx_hashes = []
+		tx_heights = []
+
+		# Only check the chain continuity against the scanned_blocks if we continue right where they end.
+		# Otherwise, the walk of this chunk only checks itself, or against the block hash table if we have one.
+		chain = list(scanned_blocks) if scanned_blocks and scanned_blocks[-1].height == lo - 1 else []
+		covered_from = lo
+
+		height = lo
+		while height <= hi:
+			block = daemon.get_block(height)
+			block_header = block['block_header']
+
+			if chain:
+				prev_hash = chain[-1].hash
+			else:
+				prev_hash = block_hashes.get(height - 1) if block_hashes is not None else None
+
+			# If the new block doesn't point to the last block's hash, the last block was reorged away. With
+			# the block hash table, we can find the fork point right away. Otherwise, roll back one block at
+			# a time.
+			if prev_hash is not None and block_header['prev_hash'] != prev_hash:
+				fork_height = find_fork(block_hashes, daemon, height - 1) if block_hashes is not None else None
+				height = fork_height if fork_height is not None else height - 1
+
+				# Everything from the fork point upwards has to be scanned again
+				self.roll_back(height)
+				chain = [b for b in chain if b.height < height]
+				covered_from = min(covered_from, height)
+
+				if block_hashes is None and not chain:
+					self.log("Warning! Rolled back all available scanned blocks. Something might be wrong.", True)
+
+				# Pending txs of the rolled back blocks aren't in the chain anymore
+				num_kept = bisect_left(tx_heights, height)
+				del tx_hashes[num_kept:]
+				del tx_heights[num_kept:]
+
+				continue
+
+			# For some reason, the node returns an object w/o a 'tx_hashes' key if there are none
+			if 'tx_hashes' in block:
+				tx_hashes += block['tx_hashes']
+				tx_heights += [height] * len(block['tx_hashes'])
+
+			# By batching the responses, I hope to speed up the scanning
+			while (len(tx_hashes) >= self.batch_size or height == hi) and tx_hashes:
+				txs = daemon.get_transactions(tx_hashes[:self.batch_size], ring_only=self.ring_only,
+					with_outs=self.with_outs)
+
+				# If txs returns None, then that means that the get_transactions failed
+				if txs is None:
+					raise ScanError('failed to fetch txs of blocks {}-{}'.format(covered_from, height))
+
+				stats.record_batch(len(txs))
+				stats.count('txs', len(txs))
+
+				with stats.stage('match'):
+					hits = self._match(txs)
+
+				self.hits_found += len(hits)
+				yield from hits
+
+				tx_hashes = tx_hashes[self.batch_size:]
+				tx_heights = tx_heights[self.batch_size:]
+
+			chain.append(Block(block_header['height'], block_header['hash']))
+			if block_hashes is not None:
+				block_hashes.set(height, block_header['hash'])
+			chain = chain[-self.max_scanned_blocks:]
+			stats.count('blocks')
+
+			# Blocks only count as processed once none of their txs are pending
+			if not tx_hashes:
+				coverage.add(covered_from, height)
+				covered_from = height + 1
+
+				# scanned_blocks always hold the top of the highest walk, which is what the next scan
+				# checks for reorgs
+				if not scanned_blocks or height >= scanned_blocks[-1].height:
+					scanned_blocks[:] = chain
+
+				if self.progress is not None:
+					self.progress.update(height, stats.counters['txs'] - self.base_txs,
+						stats.bytes_received() - self.base_bytes, self.hits_found)
+
+			if self.progress is not None:
+				self.on_progress(self.progress, height == hi)
+
+			height += 1
+
+def scan_chunks(gaps, order, chunk_size=1000):
+	"""
+	Returns list of the chunks of heights (lo, hi) to scan, in the order to scan them in
+
+	gaps: list[tuple(int, int)], ascending list of missing height intervals
+	order: str, 'oldest-first' walks every gap in one go from the bottom up, 'newest-first' walks gaps
+		in chunks of chunk_size blocks starting from the top, 'interleaved' alternates between the
+		newest and oldest remaining chunk
+	"""
+
+	if order == 'oldest-first':
+		return list(gaps)
+
+	chunks = []
+	for lo, hi in gaps:
+		chunks += [(c, min(c + chunk_size - 1, hi)) for c in range(lo, hi + 1, chunk_size)]
+
+	if order == 'newest-first':
+		return chunks[::-1]
+
+	ordered = []
+	while chunks:
+		ordered.append(chunks.pop())
+
+		if chunks:
+			ordered.append(chunks.pop(0))
+
+	return ordered
+
+def first_relevant_height(gindexes, out_dist, start_height, end_height):
+	"""
+	Returns the height of the first block in [start_height, end_height] which creates or may reference
+	any of the outputs in gindexes, i.e. the block in which the oldest of them was created. Returns
+	start_height if out_dist is None or any of the outputs was created before start_height, and
+	end_height + 1 if none of them were created up to end_height.
+
+	The global index of a pre-RingCT output only counts the outputs of its own amount, so it can't be
+	placed in the RingCT distribution. Callers must only pass gindexes if all of our outputs are RingCT
+	outputs, since any older one may be referenced before the returned height.
+
+	gindexes: iterable of int, global indexes of our outputs, which all have to be RingCT outputs
+	out_dist: tuple(int, list[int]), cumulative result of DaemonConnection.get_output_distribution()
+		covering [start_height - 1, end_height]
+	"""
+
+	if out_dist is None or not out_dist[1]:
+		return start_height
+
+	dist_start, dist = out_dist
+	first_height = end_height + 1
+
+	for gindex in gindexes:
+		# dist[i] is number of outputs up to and including block dist_start + i, so the block which
+		# creates gindex is the first one with more than gindex outputs up to it
+		created = dist_start + bisect_right(dist, gindex)
+		first_height = min(first_height, created)
+
+	return max(first_height, start_height)
+
+def height_at_time(daemon, timestamp, low=0, high=None):
+	"""
+	Returns the lowest height in [low, high] of a block with a timestamp of at least timestamp, or
+	high + 1 if there is none. Bisects with O(log(high - low)) get_block_header_by_height requests.
+	Block timestamps only roughly increase with height, since miners can set them up to a few hours off,
+	so the result can be a few blocks off.
+
+	daemon: DaemonConnection or BlockSource, source of the block headers
+	timestamp: int, UNIX timestamp
+	high: int, highest height to consider. Defaults to the top block
+	"""
+
+	if high is None:
+		high = daemon.get_info()['height'] - 1
+
+	high += 1
+
+	while low < high:
+		mid = (low + high) // 2
+
+		if daemon.get_block_header_by_height(mid)['timestamp'] < timestamp:
+			low = mid + 1
+		else:
+			high = mid
+
+	return low
+
+def find_fork(block_hashes, daemon, height, batch_size=1000):
+	"""
+	Returns the lowest height <= height from which on the hashes in block_hashes differ from the chain
+	of the daemon, or None if the highest stored hash at or below height is still valid. Compares up to
+	batch_size stored hashes per get_block_headers_range request, walking down until it finds one which
+	still matches. Heights without a stored hash are skipped, and the walk stops at the first range
+	without any.
+
+	block_hashes: BlockHashTable, hashes of previously scanned blocks
+	height: int, highest height to check. Must not be above the daemon's top block
+	"""
+
+	fork_height = None
+
+	while height >= 0:
+		low = max(height - batch_size + 1, 0)
+		stored = {h: block_hashes.get(h) for h in range(low, height + 1)}
+		stored = {h: block_hash for h, block_hash in stored.items() if block_hash is not None}
+
+		if not stored:
+			break
+
+		for header in reversed(daemon.get_block_headers_range(low, height)):
+			if header['height'] in stored:
+				if stored[header['height']] == header['hash']:
+					return fork_height
+
+				fork_height = header['height']
+
+		height = low - 1
+
+	return fork_height
+
+def newest_block(blocks, daemon):
+	"""
+	Quieres the daemon for a list of blocks and returns the newest valid block in the list, or None if not available
+	"""
+
+	sorted_blocks = sorted(blocks, key=lambda x: x.height, reverse=True)
+
+	for cached_block in sorted_blocks:
+		network_block = daemon.get_block(cached_block.height)
+
+		# If found a match
+		if 'block_header' in network_block and network_block['block_header']['hash'] == cached_block.hash:
+			return cached_block
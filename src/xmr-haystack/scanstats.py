@@ -0,0 +1,159 @@
+from collections import Counter, deque
+from contextlib import contextmanager
+import json
+import threading
+from time import perf_counter, process_time, time
+
+class ScanStats(object):
+	"""
+	Thread-safe collection of statistics about a scan: per-RPC-method latency histograms and byte
+	counts, wall and CPU time spent in named stages (e.g. 'parse', 'match'), tx batch sizes, and
+	general purpose counters (e.g. 'blocks', 'txs'). Serializable to JSON with tojson().
+	"""
+
+	# Upper bounds (in milliseconds) of the latency histogram buckets. Anything slower goes in 'inf'
+	latency_buckets_ms = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000]
+
+	# Number of most recent latencies per method kept for latency_quantile()
+	recent_latencies = 256
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.start_time = time()
+		self.rpc = {}
+		self.recent = {}
+		self.stages = {}
+		self.batch_sizes = Counter()
+		self.counters = Counter()
+
+	def record_rpc(self, method, seconds, bytes_sent=0, bytes_received=0, error=False):
+		"""
+		Records one RPC call
+
+		method: str, name of RPC method (e.g. 'get_block' or 'get_transactions')
+		seconds: float, wall time from sending the request to having received the whole response
+		bytes_sent: int, size of request body
+		bytes_received: int, size of response body
+		error: bool, True if the call failed
+		"""
+
+		bucket = self.latency_bucket(seconds)
+
+		with self.lock:
+			if method not in self.rpc:
+				self.rpc[method] = {
+					'count': 0,
+					'errors': 0,
+					'total_s': 0.0,
+					'max_s': 0.0,
+					'bytes_sent': 0,
+					'bytes_received': 0,
+					'latency_ms': Counter()
+				}
+
+			entry = self.rpc[method]
+			entry['count'] += 1
+			entry['errors'] += int(error)
+			entry['total_s'] += seconds
+			entry['max_s'] = max(entry['max_s'], seconds)
+			entry['bytes_sent'] += bytes_sent
+			entry['bytes_received'] += bytes_received
+			entry['latency_ms'][bucket] += 1
+
+			if not error:
+				self.recent.setdefault(method, deque(maxlen=self.recent_latencies)).append(seconds)
+
+	def latency_quantile(self, method, q, min_samples=20):
+		"""
+		Returns the q quantile (0 <= q <= 1) of the most recent successful call latencies of method in
+		seconds, or None if there are fewer than min_samples of them
+		"""
+
+		with self.lock:
+			recent = sorted(self.recent.get(method, []))
+
+		if len(recent) < max(min_samples, 1):
+			return None
+
+		return recent[min(int(q * len(recent)), len(recent) - 1)]
+
+	@contextmanager
+	def stage(self, name):
+		""" Context manager which adds the wall and CPU time spent inside of it to stage name """
+
+		wall_start = perf_counter()
+		cpu_start = process_time()
+
+		try:
+			yield
+		finally:
+			wall = perf_counter() - wall_start
+			cpu = process_time() - cpu_start
+
+			with self.lock:
+				entry = self.stages.setdefault(name, {'count': 0, 'wall_s': 0.0, 'cpu_s': 0.0})
+				entry['count'] += 1
+				entry['wall_s'] += wall
+				entry['cpu_s'] += cpu
+
+	def record_batch(self, size):
+		with self.lock:
+			self.batch_sizes[size] += 1
+
+	def count(self, name, n=1):
+		with self.lock:
+			self.counters[name] += n
+
+	def bytes_received(self):
+		with self.lock:
+			return sum(entry['bytes_received'] for entry in self.rpc.values())
+
+	def tojson(self):
+		""" Returns a JSON-serializable dict of all the statistics, including derived rates """
+
+		with self.lock:
+			elapsed = time() - self.start_time
+			rpc = {}
+
+			for method, entry in self.rpc.items():
+				rpc[method] = dict(entry)
+				rpc[method]['mean_s'] = entry['total_s'] / entry['count'] if entry['count'] else 0.0
+				rpc[method]['latency_ms'] = {self._bucket_label(b): c for b, c in sorted(entry['latency_ms'].items())}
+
+			rates = {name + '_per_s': n / elapsed if elapsed else 0.0 for name, n in self.counters.items()}
+			rates['bytes_received_per_s'] = sum(e['bytes_received'] for e in self.rpc.values()) / elapsed if elapsed else 0.0
+
+			return {
+				'elapsed_s': elapsed,
+				'counters': dict(self.counters),
+				'rates': rates,
+				'rpc': rpc,
+				'stages': {name: dict(entry) for name, entry in self.stages.items()},
+				'batch_sizes': {str(size): n for size, n in sorted(self.batch_sizes.items())}
+			}
+
+	def dump(self, file):
+		""" Writes statistics as JSON to a writable file object """
+
+		file.write(json.dumps(self.tojson(), indent=4))
+		file.write('\n')
+		file.flush()
+
+	@classmethod
+	def latency_bucket(cls, seconds):
+		""" Returns index of histogram bucket that seconds falls into """
+
+		ms = seconds * 1000
+
+		for i, bound in enumerate(cls.latency_buckets_ms):
+			if ms <= bound:
+				return i
+
+		return len(cls.latency_buckets_ms)
+
+	@classmethod
+	def _bucket_label(cls, bucket):
+		if bucket < len(cls.latency_buckets_ms):
+			return '<={}'.format(cls.latency_buckets_ms[bucket])
+		else:
+			return 'inf'
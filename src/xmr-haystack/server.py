@@ -0,0 +1,440 @@
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import queue
+import requests
+import socketserver
+import sys
+import threading
+from time import sleep
+
+from . import handlearg
+from .scanner import find_fork, Scanner, ScanError
+from .scanstats import ScanStats
+
+class IndexScanner(Scanner):
+	"""
+	Scanner which hands every tx it fetches to a HaystackIndex instead of matching them against our
+	outputs, so the index walks the chain and handles reorgs exactly like scans do
+	"""
+
+	with_outs = True
+
+	def __init__(self, index, daemon, ring_only=False, batch_size=10000):
+		# The index has no outputs of its own, so no blocks may be skipped as older than them
+		super().__init__((), daemon, block_hashes=index, batch_size=batch_size, ring_only=ring_only, ringct=False)
+
+		self.index = index
+
+	def _match(self, txs):
+		self.index.add_txs(txs)
+
+		return []
+
+class HaystackIndex(object):
+	"""
+	In-memory index of every tx in the blocks [start_height, tip] by the gindexes of its ring members
+	and by its output keys. sync() brings the index up to the current chain tip with an IndexScanner,
+	which also rolls back blocks which were reorged away. To the scanner, the index is its block hash
+	table: it stores the hash of every indexed block, and truncating it drops the blocks' txs. All
+	methods are thread-safe.
+	"""
+
+	def __init__(self, daemon, start_height=0, ring_only=False, tx_batch_count=10000):
+		"""
+		daemon: DaemonConnection, daemon to fetch blocks and txs from
+		start_height: int, height of first block to index
+		ring_only: bool, passed to DaemonConnection.get_transactions()
+		tx_batch_count: int, maximum number of txs to request at once
+		"""
+
+		self.daemon = daemon
+		self.start_height = start_height
+
+		self.lock = threading.RLock()
+		self.block_hashes = []
+		self.tx_hashes_by_height = {}
+		self.txs = {}
+		self.txs_by_gindex = {}
+		self.txs_by_out_key = {}
+
+		self.scanner = IndexScanner(self, daemon, ring_only=ring_only, batch_size=tx_batch_count)
+
+	@property
+	def height(self):
+		""" Height of the top indexed block, or start_height - 1 if nothing is indexed yet """
+
+		with self.lock:
+			return self.start_height + len(self.block_hashes) - 1
+
+	def sync(self):
+		"""
+		Indexes all blocks between the top indexed block and the chain tip. Returns False if the
+		daemon failed to return txs, True otherwise.
+		"""
+
+		info = self.daemon.get_info()
+		tip = info['height'] - 1
+
+		# A reorg which replaced the tip at the same height only shows in its hash. Walking up from the
+		# indexed blocks notices reorgs only once a block is mined on top of the new branch
+		if self.get(tip) not in (None, info['top_block_hash']):
+			fork_height = find_fork(self, self.daemon, tip)
+
+			# None if the chain changed again since get_info
+			if fork_height is not None:
+				self.scanner.roll_back(fork_height)
+		elif self.height > tip:
+			self.scanner.roll_back(tip + 1)
+
+		if tip < self.start_height:
+			return True
+
+		try:
+			for _ in self.scanner.iter_hits(self.start_height, tip):
+				pass
+		except ScanError:
+			return False
+
+		return True
+
+	def add_txs(self, txs):
+		""" Indexes txs, which belong to the blocks at their heights """
+
+		with self.lock:
+			for tx in txs:
+				if tx.hash in self.txs:
+					continue
+
+				self.txs[tx.hash] = tx
+				self.tx_hashes_by_height.setdefault(tx.height, []).append(tx.hash)
+
+				for gindex in set(tx.ins):
+					self.txs_by_gindex.setdefault(gindex, []).append(tx.hash)
+
+				for key in tx.outs:
+					self.txs_by_out_key.setdefault(key, []).append(tx.hash)
+
+	##### block hash table interface, see BlockHashTable #####
+
+	def get(self, height):
+		""" Returns the hex hash of the indexed block at height, or None if not indexed """
+
+		with self.lock:
+			i = height - self.start_height
+
+			return self.block_hashes[i] if 0 <= i < len(self.block_hashes) else None
+
+	def set(self, height, block_hash):
+		""" Records the hash of the block at height, which is the next one to be indexed """
+
+		with self.lock:
+			i = height - self.start_height
+
+			if i == len(self.block_hashes):
+				self.block_hashes.append(block_hash)
+			elif 0 <= i < len(self.block_hashes):
+				self.block_hashes[i] = block_hash
+			else:
+				raise ValueError('block {} is not next to the indexed blocks'.format(height))
+
+	def truncate(self, height):
+		""" Removes the blocks at height and above and all of their txs from the index """
+
+		with self.lock:
+			del self.block_hashes[max(height - self.start_height, 0):]
+
+			for tx_height in [h for h in self.tx_hashes_by_height if h >= height]:
+				for tx_hash in self.tx_hashes_by_height.pop(tx_height):
+					tx = self.txs.pop(tx_hash)
+
+					for gindex in set(tx.ins):
+						self._unindex(self.txs_by_gindex, gindex, tx_hash)
+
+					for key in tx.outs:
+						self._unindex(self.txs_by_out_key, key, tx_hash)
+
+	@staticmethod
+	def _unindex(index, k, tx_hash):
+		tx_hashes = index.get(k)
+
+		if tx_hashes is None:
+			return
+
+		tx_hashes[:] = [h for h in tx_hashes if h != tx_hash]
+
+		if not tx_hashes:
+			del index[k]
+
+	def lookup(self, gindexes, keys):
+		"""
+		Returns a tuple (txs_by_gindex, txs_by_key, height) where txs_by_gindex maps every gindex in
+		gindexes to the list of indexed Transactions that use it as a ring member, txs_by_key maps
+		every key in keys to the list of indexed Transactions that create it, and height is the
+		height of the top indexed block at the time of lookup.
+		"""
+
+		with self.lock:
+			txs_by_gindex = {i: [self.txs[h] for h in self.txs_by_gindex.get(i, [])] for i in gindexes}
+			txs_by_key = {k: [self.txs[h] for h in self.txs_by_out_key.get(k, [])] for k in keys}
+
+			return txs_by_gindex, txs_by_key, self.height
+
+	def status(self):
+		with self.lock:
+			return {
+				'start_height': self.start_height,
+				'height': self.height,
+				'txs': len(self.txs),
+				'gindexes': len(self.txs_by_gindex),
+				'out_keys': len(self.txs_by_out_key)
+			}
+
+class QueryBatcher(object):
+	"""
+	Collects queries submitted concurrently by request handler threads and answers all queries that
+	are waiting at the same time with a single HaystackIndex.lookup() pass.
+
+	A query is a dict {'outputs': [{'gindex': int, 'key': str}, ...]} where either entry of an output
+	may be left out. The answer contains, for every output, the txs which use its gindex as a ring
+	member or create its key.
+	"""
+
+	def __init__(self, index, max_batch=1000):
+		self.index = index
+		self.max_batch = max_batch
+		self.queue = queue.Queue()
+		self.thread = threading.Thread(target=self._run, daemon=True)
+		self.thread.start()
+
+	def submit(self, query):
+		""" Blocks until query is answered, then returns the answer. Raises ValueError on bad queries """
+
+		outputs = self.validate(query)
+		done = threading.Event()
+		slot = {}
+
+		self.queue.put((outputs, done, slot))
+		done.wait()
+
+		return slot['answer']
+
+	@staticmethod
+	def validate(query):
+		if not isinstance(query, dict) or not isinstance(query.get('outputs'), list):
+			raise ValueError("query must be an object with an 'outputs' list")
+
+		outputs = []
+
+		for out in query['outputs']:
+			if not isinstance(out, dict) or ('gindex' not in out and 'key' not in out):
+				raise ValueError("every output must be an object with a 'gindex' and/or a 'key'")
+			# JSON booleans are ints to Python, so check the exact type
+			if 'gindex' in out and (type(out['gindex']) is not int or out['gindex'] < 0):
+				raise ValueError("'gindex' must be a non-negative integer")
+			if 'key' in out and not isinstance(out['key'], str):
+				raise ValueError("'key' must be a hex string")
+
+			outputs.append((out.get('gindex'), out.get('key')))
+
+		return outputs
+
+	def _run(self):
+		while True:
+			batch = [self.queue.get()]
+
+			while len(batch) < self.max_batch:
+				try:
+					batch.append(self.queue.get_nowait())
+				except queue.Empty:
+					break
+
+			gindexes = set(g for outputs, _, _ in batch for g, _ in outputs if g is not None)
+			keys = set(k for outputs, _, _ in batch for _, k in outputs if k is not None)
+			txs_by_gindex, txs_by_key, height = self.index.lookup(gindexes, keys)
+
+			for outputs, done, slot in batch:
+				results = []
+
+				for gindex, key in outputs:
+					txs = {}
+
+					for tx in txs_by_gindex.get(gindex, []) + txs_by_key.get(key, []):
+						txs[tx.hash] = tx
+
+					result = {'txs': sorted(txs.values(), key=lambda tx: tx.height)}
+					if gindex is not None:
+						result['gindex'] = gindex
+					if key is not None:
+						result['key'] = key
+
+					results.append(result)
+
+				slot['answer'] = {'height': height, 'results': results}
+				done.set()
+
+class QueryHTTPServer(ThreadingHTTPServer):
+	daemon_threads = True
+	request_queue_size = 128
+
+class QueryUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+	request_queue_size = 128
+
+def make_handler(batcher, index):
+	class Handler(BaseHTTPRequestHandler):
+		protocol_version = 'HTTP/1.1'
+
+		def do_GET(self):
+			if self.path == '/status':
+				self._send(200, index.status())
+			else:
+				self._send(404, {'error': 'not found'})
+
+		def do_POST(self):
+			if self.path != '/query':
+				self._send(404, {'error': 'not found'})
+				return
+
+			try:
+				length = int(self.headers.get('Content-Length', 0))
+				answer = batcher.submit(json.loads(self.rfile.read(length).decode()))
+			except ValueError as e:
+				self._send(400, {'error': str(e)})
+				return
+
+			self._send(200, answer)
+
+		def _send(self, status, obj):
+			body = json.dumps(obj).encode()
+
+			self.send_response(status)
+			self.send_header('Content-Type', 'application/json')
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, format, *args):
+			pass
+
+	return Handler
+
+def follow_tip(index, poll_interval):
+	""" Keeps index synced with the chain tip forever. Meant to be run in a thread """
+
+	while True:
+		try:
+			ok = index.sync()
+
+			if not ok:
+				print("Warning: daemon failed to return txs while syncing index. Retrying...", file=sys.stderr)
+		except Exception as e:
+			print("Warning: syncing index failed:", e, file=sys.stderr)
+
+		sleep(poll_interval)
+
+def get_parser():
+	""" Returns an argparse.ArgumentParser object for the server """
+
+	prog = 'python3 -m xmr-haystack.server'
+	desc = 'Long-lived service answering which txs reference a set of stealth addresses'
+	parser = argparse.ArgumentParser(prog=prog, description=desc)
+	handlearg.add_daemon_args(parser)
+	listengrp = parser.add_mutually_exclusive_group()
+	listengrp.add_argument('--listen',
+		help='address and port to serve HTTP on',
+		default='127.0.0.1:18095',
+		metavar='HOST:PORT')
+	listengrp.add_argument('--unix',
+		help='path of Unix socket to serve HTTP on instead of TCP',
+		metavar='PATH')
+	parser.add_argument('-s', '--start-height',
+		help='height of first block to index. required, since every tx from there on is kept in memory',
+		type=int,
+		required=True,
+		dest='height')
+	parser.add_argument('--poll-interval',
+		help='seconds between checks for new blocks. defaults to 10',
+		type=float,
+		default=10.0)
+	parser.add_argument('-r', '--ring-only',
+		help='fetch transactions as binary blobs and only decode their prefixes. much less data than JSON',
+		action='store_true')
+	parser.add_argument('-q', '--quiet',
+		help='use this flag if you would like a simpler output',
+		action='store_true')
+
+	return parser
+
+def main():
+	arg_parser = get_parser()
+	args = arg_parser.parse_args()
+
+	try:
+		user, pwd = handlearg.parse_daemon_login(args.login)
+		hedge = handlearg.parse_hedge_daemon(args.hedge)
+
+		if args.height < 0:
+			raise ValueError('error: --start-height can not be less than zero')
+		if args.max_rps is not None and args.max_rps <= 0:
+			raise ValueError('error: --max-rps must be greater than zero')
+		if args.max_bps is not None and args.max_bps <= 0:
+			raise ValueError('error: --max-bps must be greater than zero')
+
+		host, _, port = args.listen.rpartition(':')
+		listen_addr = (host, int(port))
+	except ValueError as ve:
+		arg_parser.print_usage()
+		print(ve)
+
+		return 1
+
+	daemon = handlearg.make_daemon_connection(args.addr, args.port, user, pwd, args.timeout, args.retries, hedge,
+		stats=ScanStats(), max_rps=args.max_rps, max_bps=args.max_bps)
+	index = HaystackIndex(daemon, args.height, ring_only=args.ring_only)
+
+	# Build the index before serving so that answers are never based on a partial index
+	if not args.quiet: print("Indexing blocks {}+ from daemon at {}...".format(args.height, daemon.host()))
+	while True:
+		try:
+			if index.sync():
+				break
+
+			print("Warning: daemon failed to return txs while building index. Retrying...", file=sys.stderr)
+		except requests.exceptions.RequestException as e:
+			print("Warning: daemon request failed while building index:", e, file=sys.stderr)
+
+		sleep(args.poll_interval)
+
+	if not args.quiet: print("Indexed up to height {}".format(index.height))
+
+	threading.Thread(target=follow_tip, args=(index, args.poll_interval), daemon=True).start()
+	batcher = QueryBatcher(index)
+	handler = make_handler(batcher, index)
+
+	if args.unix is not None:
+		if os.path.exists(args.unix):
+			os.remove(args.unix)
+
+		httpd = QueryUnixHTTPServer(args.unix, handler)
+		where = args.unix
+	else:
+		httpd = QueryHTTPServer(listen_addr, handler)
+		where = '{}:{}'.format(*httpd.server_address[:2])
+
+	if not args.quiet: print("Serving queries on", where)
+
+	try:
+		httpd.serve_forever()
+	except KeyboardInterrupt:
+		print("\nCaught keyboard interrupt. Exiting...")
+	finally:
+		httpd.server_close()
+
+	return 0
+
+# Program entry point
+if __name__ == '__main__':
+	exitcode = main()
+	exit(0 if exitcode is None else exitcode)
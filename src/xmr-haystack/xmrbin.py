@@ -0,0 +1,381 @@
+class BlobReader(object):
+	""" Sequential reader over a bytes-like object holding binary serialized Monero data """
+
+	def __init__(self, blob, offset=0):
+		self.blob = blob
+		self.offset = offset
+
+	def read_varint(self):
+		""" Reads and returns an unsigned LEB128 varint """
+
+		blob = self.blob
+		result = 0
+		shift = 0
+
+		while True:
+			try:
+				b = blob[self.offset]
+			except IndexError:
+				raise ValueError('unexpected end of blob while reading varint')
+
+			self.offset += 1
+			result |= (b & 0x7f) << shift
+
+			if b < 0x80:
+				return result
+
+			shift += 7
+
+	def read_byte(self):
+		try:
+			b = self.blob[self.offset]
+		except IndexError:
+			raise ValueError('unexpected end of blob while reading byte')
+
+		self.offset += 1
+
+		return b
+
+	def read_bytes(self, n):
+		end = self.offset + n
+
+		if end > len(self.blob):
+			raise ValueError('unexpected end of blob while reading {} bytes'.format(n))
+
+		data = self.blob[self.offset:end]
+		self.offset = end
+
+		return bytes(data)
+
+	def skip(self, n):
+		if self.offset + n > len(self.blob):
+			raise ValueError('unexpected end of blob while skipping {} bytes'.format(n))
+
+		self.offset += n
+
+# Input and output type tags
+TXIN_GEN = 0xff
+TXIN_TO_KEY = 0x02
+TXOUT_TO_KEY = 0x02
+TXOUT_TO_TAGGED_KEY = 0x03
+
+def read_tx_prefix(reader, with_outs=True):
+	"""
+	Reads a transaction prefix from BlobReader reader and returns a dict with the following entries:
+		'version' -> int, tx version
+		'ins' -> list[list[int]], absolute gindexes of ring members of every input
+		'kimages' -> list[str], hex key image of every input
+		'outs' -> list[str], hex output keys. Empty if with_outs is False
+		'height' -> int, height of miner tx input or None if not a miner tx
+
+	If with_outs is False, reading stops right after the inputs, leaving reader in the middle of the
+	prefix. Otherwise reader ends up right after the tx extra.
+
+	Doc: https://monerodocs.org/cryptography/data-structures/
+	"""
+
+	version = reader.read_varint()
+	reader.read_varint() # unlock_time
+
+	ins = []
+	kimages = []
+	height = None
+
+	for _ in range(reader.read_varint()):
+		tag = reader.read_byte()
+
+		if tag == TXIN_GEN:
+			height = reader.read_varint()
+		elif tag == TXIN_TO_KEY:
+			reader.read_varint() # amount
+			gindex = 0
+			ring = []
+
+			for _ in range(reader.read_varint()):
+				gindex += reader.read_varint()
+				ring.append(gindex)
+
+			ins.append(ring)
+			kimages.append(reader.read_bytes(32).hex())
+		else:
+			raise ValueError('unsupported tx input type {}'.format(tag))
+
+	outs = []
+
+	if with_outs:
+		for _ in range(reader.read_varint()):
+			reader.read_varint() # amount
+			tag = reader.read_byte()
+
+			if tag == TXOUT_TO_KEY:
+				outs.append(reader.read_bytes(32).hex())
+			elif tag == TXOUT_TO_TAGGED_KEY:
+				outs.append(reader.read_bytes(32).hex())
+				reader.skip(1) # view tag
+			else:
+				raise ValueError('unsupported tx output type {}'.format(tag))
+
+		reader.skip(reader.read_varint()) # extra
+
+	return {'version': version, 'ins': ins, 'kimages': kimages, 'outs': outs, 'height': height}
+
+def parse_tx_prefix(blob, with_outs=True):
+	""" Returns result of read_tx_prefix() on bytes-like object blob """
+
+	return read_tx_prefix(BlobReader(blob), with_outs)
+
+# RingCT signature types
+RCT_TYPE_NULL = 0
+RCT_TYPE_FULL = 1
+RCT_TYPE_SIMPLE = 2
+RCT_TYPE_BULLETPROOF = 3
+RCT_TYPE_BULLETPROOF2 = 4
+RCT_TYPE_CLSAG = 5
+RCT_TYPE_BULLETPROOF_PLUS = 6
+
+def read_tx(reader):
+	"""
+	Reads a whole (unpruned) transaction from BlobReader reader and returns the dict of
+	read_tx_prefix() with the following additional entries:
+		'rct_type' -> int, RingCT signature type. None for version 1 txs
+		'offsets' -> tuple(int, int, int, int), offsets in the blob where the tx starts, where its
+			prefix ends, where its RingCT base ends and where it ends
+
+	The signatures are skipped without being checked. For ring size dependent parts, the size of the
+	rings is taken from the inputs.
+
+	Doc: https://github.com/monero-project/monero/blob/master/src/ringct/rctTypes.h
+	"""
+
+	start = reader.offset
+	tx = read_tx_prefix(reader)
+	prefix_end = reader.offset
+	rings = tx['ins']
+	num_outs = len(tx['outs'])
+	rct_type = None
+
+	if tx['version'] == 1:
+		# One 64 byte signature per ring member
+		reader.skip(64 * sum(len(ring) for ring in rings))
+		base_end = reader.offset
+	else:
+		rct_type = reader.read_byte()
+
+		if rct_type != RCT_TYPE_NULL:
+			reader.read_varint() # fee
+
+			if rct_type == RCT_TYPE_SIMPLE:
+				reader.skip(32 * len(rings)) # pseudo outputs
+
+			compact_amounts = rct_type in (RCT_TYPE_BULLETPROOF2, RCT_TYPE_CLSAG, RCT_TYPE_BULLETPROOF_PLUS)
+			reader.skip((8 if compact_amounts else 64) * num_outs) # encrypted amounts
+			reader.skip(32 * num_outs) # output commitments
+
+		base_end = reader.offset
+
+		if rct_type != RCT_TYPE_NULL:
+			_skip_rct_prunable(reader, rct_type, rings, num_outs)
+
+	tx['rct_type'] = rct_type
+	tx['offsets'] = (start, prefix_end, base_end, reader.offset)
+
+	return tx
+
+def _skip_rct_prunable(reader, rct_type, rings, num_outs):
+	""" Skips the prunable part of the RingCT signatures of a tx with rings and num_outs outputs """
+
+	def skip_keys():
+		reader.skip(32 * reader.read_varint())
+
+	# Range proofs
+	if rct_type in (RCT_TYPE_BULLETPROOF, RCT_TYPE_BULLETPROOF2, RCT_TYPE_CLSAG):
+		if rct_type == RCT_TYPE_BULLETPROOF:
+			num_proofs = int.from_bytes(reader.read_bytes(4), 'little')
+		else:
+			num_proofs = reader.read_varint()
+
+		for _ in range(num_proofs):
+			reader.skip(6 * 32) # A, S, T1, T2, taux, mu
+			skip_keys() # L
+			skip_keys() # R
+			reader.skip(3 * 32) # a, b, t
+	elif rct_type == RCT_TYPE_BULLETPROOF_PLUS:
+		for _ in range(reader.read_varint()):
+			reader.skip(6 * 32) # A, A1, B, r1, s1, d1
+			skip_keys() # L
+			skip_keys() # R
+	elif rct_type in (RCT_TYPE_FULL, RCT_TYPE_SIMPLE):
+		# Borromean signature (64 + 64 + 1 keys) and 64 commitments per output
+		reader.skip(193 * 32 * num_outs)
+	else:
+		raise ValueError('unsupported RingCT type {}'.format(rct_type))
+
+	# Ring signatures
+	if rct_type in (RCT_TYPE_CLSAG, RCT_TYPE_BULLETPROOF_PLUS):
+		for ring in rings:
+			reader.skip(32 * len(ring) + 64) # s, c1, D
+	elif rct_type == RCT_TYPE_FULL:
+		# One MLSAG over all inputs
+		ring_size = len(rings[0]) if rings else 0
+		reader.skip(32 * ring_size * (len(rings) + 1) + 32)
+	else:
+		for ring in rings:
+			reader.skip(32 * len(ring) * 2 + 32)
+
+	# Pseudo outputs
+	if rct_type in (RCT_TYPE_BULLETPROOF, RCT_TYPE_BULLETPROOF2, RCT_TYPE_CLSAG, RCT_TYPE_BULLETPROOF_PLUS):
+		reader.skip(32 * len(rings))
+
+def tx_hash(blob, tx):
+	"""
+	Returns the hex hash of tx, as returned by read_tx() from bytes-like object blob. Version 1 txs
+	are hashed as a whole, later versions as the hash of the hashes of their prefix, RingCT base and
+	prunable part.
+	"""
+
+	start, prefix_end, base_end, end = tx['offsets']
+
+	if tx['version'] == 1:
+		return keccak256(blob[start:end]).hex()
+
+	prunable_hash = bytes(32) if tx['rct_type'] == RCT_TYPE_NULL else keccak256(blob[base_end:end])
+	hashes = keccak256(blob[start:prefix_end]) + keccak256(blob[prefix_end:base_end]) + prunable_hash
+
+	return keccak256(hashes).hex()
+
+def read_block_header(reader):
+	"""
+	Reads a block header from BlobReader reader and returns a dict with the following entries:
+		'major_version' -> int
+		'minor_version' -> int
+		'timestamp' -> int, UNIX timestamp of block
+		'prev_hash' -> str, hex hash of previous block
+		'nonce' -> int
+	"""
+
+	return {
+		'major_version': reader.read_varint(),
+		'minor_version': reader.read_varint(),
+		'timestamp': reader.read_varint(),
+		'prev_hash': reader.read_bytes(32).hex(),
+		'nonce': int.from_bytes(reader.read_bytes(4), 'little')
+	}
+
+def read_block(reader):
+	"""
+	Reads a block from BlobReader reader and returns the dict of read_block_header() with the
+	following additional entries:
+		'miner_tx' -> dict, result of read_tx() for the miner tx
+		'tx_hashes' -> list[str], hex hashes of all other txs in block
+		'header_offsets' -> tuple(int, int), offsets in the blob where the header starts and ends
+	"""
+
+	start = reader.offset
+	block = read_block_header(reader)
+	block['header_offsets'] = (start, reader.offset)
+	block['miner_tx'] = read_tx(reader)
+	block['tx_hashes'] = [reader.read_bytes(32).hex() for _ in range(reader.read_varint())]
+
+	return block
+
+def block_hash(blob, block):
+	"""
+	Returns the hex hash of block, as returned by read_block() from bytes-like object blob. That is
+	the hash of the block's hashing blob: its header, the merkle root of all its tx hashes and the
+	number of txs, prefixed by the size of it all.
+	"""
+
+	header_start, header_end = block['header_offsets']
+	hashes = [bytes.fromhex(tx_hash(blob, block['miner_tx']))] + [bytes.fromhex(h) for h in block['tx_hashes']]
+	hashing_blob = bytes(blob[header_start:header_end]) + tree_hash(hashes) + varint(len(hashes))
+
+	return keccak256(varint(len(hashing_blob)) + hashing_blob).hex()
+
+def tree_hash(hashes):
+	""" Returns the merkle root of the list of 32 byte hashes, the way Monero calculates it """
+
+	if len(hashes) == 1:
+		return hashes[0]
+	if len(hashes) == 2:
+		return keccak256(hashes[0] + hashes[1])
+
+	# Hash pairs at the end of the list until it is a power of 2 long, then halve it until 2 are left
+	cnt = 1
+	while cnt * 2 < len(hashes):
+		cnt *= 2
+
+	num_kept = 2 * cnt - len(hashes)
+	level = hashes[:num_kept]
+	level += [keccak256(hashes[i] + hashes[i + 1]) for i in range(num_kept, len(hashes), 2)]
+
+	while len(level) > 2:
+		level = [keccak256(level[i] + level[i + 1]) for i in range(0, len(level), 2)]
+
+	return keccak256(level[0] + level[1])
+
+def varint(n):
+	""" Returns n encoded as an unsigned LEB128 varint """
+
+	out = bytearray()
+
+	while n >= 0x80:
+		out.append((n & 0x7f) | 0x80)
+		n >>= 7
+
+	out.append(n)
+
+	return bytes(out)
+
+# Keccak-f[1600] round constants and rotation offsets (by lane index x + 5 * y)
+_KECCAK_RC = [
+	0x0000000000000001, 0x0000000000008082, 0x800000000000808a, 0x8000000080008000,
+	0x000000000000808b, 0x0000000080000001, 0x8000000080008081, 0x8000000000008009,
+	0x000000000000008a, 0x0000000000000088, 0x0000000080008009, 0x000000008000000a,
+	0x000000008000808b, 0x800000000000008b, 0x8000000000008089, 0x8000000000008003,
+	0x8000000000008002, 0x8000000000000080, 0x000000000000800a, 0x800000008000000a,
+	0x8000000080008081, 0x8000000000008080, 0x0000000080000001, 0x8000000080008008
+]
+_KECCAK_ROT = [0, 1, 62, 28, 27, 36, 44, 6, 55, 20, 3, 10, 43, 25, 39, 41, 45, 15, 21, 8, 18, 2, 61, 56, 14]
+_KECCAK_PI = [(x + 5 * y, y + 5 * ((2 * x + 3 * y) % 5)) for y in range(5) for x in range(5)]
+_MASK64 = (1 << 64) - 1
+
+def _keccak_f(lanes):
+	for rc in _KECCAK_RC:
+		# Theta
+		c = [lanes[x] ^ lanes[x + 5] ^ lanes[x + 10] ^ lanes[x + 15] ^ lanes[x + 20] for x in range(5)]
+		d = [c[x - 1] ^ (((c[(x + 1) % 5] << 1) | (c[(x + 1) % 5] >> 63)) & _MASK64) for x in range(5)]
+		lanes = [lanes[i] ^ d[i % 5] for i in range(25)]
+
+		# Rho and pi
+		b = [0] * 25
+		for src, dst in _KECCAK_PI:
+			rot = _KECCAK_ROT[src]
+			b[dst] = ((lanes[src] << rot) | (lanes[src] >> (64 - rot))) & _MASK64 if rot else lanes[src]
+
+		# Chi and iota
+		lanes = [b[i] ^ (~b[i - i % 5 + (i + 1) % 5] & b[i - i % 5 + (i + 2) % 5]) for i in range(25)]
+		lanes[0] ^= rc
+
+	return lanes
+
+def keccak256(data):
+	"""
+	Returns the 32 byte Keccak-256 hash of data, which is Monero's cn_fast_hash. Unlike SHA3-256
+	from hashlib, it uses the original Keccak padding.
+	"""
+
+	rate = 136
+	padded = bytearray(data)
+	padded.append(0x01)
+	padded += bytes(-len(padded) % rate)
+	padded[-1] |= 0x80
+
+	lanes = [0] * 25
+	for block_start in range(0, len(padded), rate):
+		for i in range(rate // 8):
+			offset = block_start + 8 * i
+			lanes[i] ^= int.from_bytes(padded[offset:offset + 8], 'little')
+
+		lanes = _keccak_f(lanes)
+
+	return b''.join(lane.to_bytes(8, 'little') for lane in lanes[:4])
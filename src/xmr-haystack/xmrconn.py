@@ -1,12 +1,37 @@
+import concurrent.futures
 import json
+import random
 import requests
 import subprocess as sp
 import sys
+from time import perf_counter, sleep
 
+from .scanstats import ScanStats
 from .xmrtype import Transaction
 
 class DaemonConnection(object):
-	def __init__(self, addr='127.0.0.1', port=18081, user=None, pwd=None, scheme='http'):
+	"""
+	Connection to a monerod RPC server.
+
+	Every request times out after a per-method number of seconds and failed requests (timeouts,
+	connection errors, HTTP 429 and 5xx) are retried up to retries times with jittered exponential
+	backoff. If hedge is set to another DaemonConnection, a duplicate of any request which takes longer
+	than the hedge_quantile latency of its method is sent to the hedge node, and whichever answer
+	comes first is used. If rate_limiter is set to a RateLimiter, every request waits for its budget
+	before it is sent. Calls, retries, hedges and throttles are all recorded in stats.
+
+	get_transactions() splits up batches that the daemon rejects as too large, and remembers the
+	largest batch size that worked in max_txs_per_request.
+	"""
+
+	# Methods which get 4 times the normal timeout since their responses can be huge
+	slow_methods = ('get_transactions', 'get_output_distribution', 'get_transaction_pool')
+
+	# Most block headers restricted daemons serve per get_block_headers_range request
+	max_headers_per_request = 1000
+
+	def __init__(self, addr='127.0.0.1', port=18081, user=None, pwd=None, scheme='http', stats=None,
+		timeout=30.0, retries=0, backoff=0.5, hedge=None, hedge_quantile=0.95, rate_limiter=None):
 		if (user is None) ^ (pwd is None):
 			raise ValueError('user and pwd must both either be set or not set')
 
@@ -15,6 +40,23 @@ class DaemonConnection(object):
 		self.user = user
 		self.pwd = pwd
 		self.scheme = scheme
+		self.stats = stats if stats is not None else ScanStats()
+		self.stats_prefix = ''
+		self.timeouts = {method: timeout * 4 for method in self.slow_methods}
+		self.timeout = timeout
+		self.retries = retries
+		self.backoff = backoff
+		self.hedge = hedge
+		self.hedge_quantile = hedge_quantile
+		self.executor = None
+		self.rate_limiter = rate_limiter
+		self.max_txs_per_request = None
+
+		# Hedge requests are recorded in our stats, but apart from ours
+		if hedge is not None:
+			hedge.stats = self.stats
+			hedge.stats_prefix = 'hedge:'
+			self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=8)
 
 	def url(self, endpoint=''):
 		if not endpoint.startswith('/'):
@@ -34,22 +76,153 @@ class DaemonConnection(object):
 		else:
 			return None
 
+	def request(self, method, endpoint, post_data=None):
+		"""
+		Sends a request to the daemon and returns the requests.Response object, retrying and hedging
+		as configured. If post_data is None, a GET request is sent, otherwise post_data is POSTed as
+		JSON. Raises a requests.exceptions.RequestException if the request still fails after all
+		retries.
+
+		method: str, name of RPC method to record call under
+		endpoint: str, URL path of request (e.g. '/json_rpc')
+		post_data: JSON-serializable object to send as request body
+		"""
+
+		attempt = 0
+
+		while True:
+			# Wait for the budget before the hedge delay starts, so waiting doesn't count as being slow
+			self._acquire()
+
+			try:
+				if self.hedge is not None:
+					resp = self._hedged_send(method, endpoint, post_data)
+				else:
+					resp = self._send(method, endpoint, post_data)
+
+				if not self.should_retry(resp) or attempt >= self.retries:
+					return resp
+			except requests.exceptions.RequestException:
+				if attempt >= self.retries:
+					raise
+
+			# "Full jitter" backoff, so that many clients don't retry in lockstep
+			self.stats.count('retries')
+			sleep(random.uniform(0, self.backoff * 2 ** attempt))
+			attempt += 1
+
+	@staticmethod
+	def should_retry(resp):
+		""" Returns True if requests.Response resp failed in a way that is worth retrying """
+
+		return resp.status_code == 429 or resp.status_code // 100 == 5
+
+	def timeout_for(self, method):
+		return self.timeouts.get(method, self.timeout)
+
+	def _acquire(self):
+		""" Blocks until the rate limiter, if any, allows sending another request """
+
+		if self.rate_limiter is not None:
+			with self.stats.stage('rate_limit'):
+				self.rate_limiter.acquire()
+
+	def _send(self, method, endpoint, post_data):
+		"""
+		Sends a single request and records it in self.stats. The caller has to wait for the budget of
+		the rate limiter with _acquire() first
+		"""
+
+		url = self.url(endpoint)
+		timeout = self.timeout_for(method)
+		resp = None
+		start = perf_counter()
+
+		try:
+			if post_data is None:
+				resp = requests.get(url, auth=self.auth(), timeout=timeout)
+			else:
+				resp = requests.post(url, json=post_data, auth=self.auth(), timeout=timeout)
+
+			return resp
+		finally:
+			elapsed = perf_counter() - start
+			error = resp is None or resp.status_code // 100 != 2
+			bytes_sent = len(resp.request.body or b'') if resp is not None else 0
+			bytes_received = len(resp.content) if resp is not None else 0
+
+			self.stats.record_rpc(self.stats_prefix + method, elapsed, bytes_sent, bytes_received, error)
+
+			if self.rate_limiter is not None:
+				overloaded = resp is None or self.should_retry(resp)
+
+				if self.rate_limiter.record(method, elapsed, bytes_received, overloaded):
+					self.stats.count(self.stats_prefix + 'throttles')
+
+	def _acquired_send(self, method, endpoint, post_data):
+		""" Waits for the budget of the rate limiter, then sends a single request like _send() """
+
+		self._acquire()
+
+		return self._send(method, endpoint, post_data)
+
+	def _hedged_send(self, method, endpoint, post_data):
+		"""
+		Sends a request, and if no answer arrived after the hedge_quantile latency of method, sends a
+		duplicate to the hedge node. Returns the first successful answer, or raises the primary's
+		exception if both fail.
+		"""
+
+		delay = self.stats.latency_quantile(method, self.hedge_quantile)
+
+		# Not enough samples yet to tell what a slow request is
+		if delay is None:
+			return self._send(method, endpoint, post_data)
+
+		primary = self.executor.submit(self._send, method, endpoint, post_data)
+
+		try:
+			return primary.result(timeout=delay)
+		except concurrent.futures.TimeoutError:
+			pass
+
+		self.stats.count('hedges')
+		backup = self.executor.submit(self.hedge._acquired_send, method, endpoint, post_data)
+		pending = {primary, backup}
+
+		while pending:
+			done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+
+			for future in done:
+				if future.exception() is None and not self.should_retry(future.result()):
+					if future is backup:
+						self.stats.count('hedge_wins')
+
+					return future.result()
+
+		return primary.result()
+
+	def json_rpc(self, method, params=None):
+		""" Sends a JSON RPC request to /json_rpc and returns the requests.Response object """
+
+		post_data = {'jsonrpc': '2.0', 'id': '0', 'method': method}
+
+		if params is not None:
+			post_data['params'] = params
+
+		return self.request(method, '/json_rpc', post_data)
+
 	def get_info(self):
 		"""Returns json response from get_info RPC command"""
 
-		url = self.url('/get_info')
-
-		info = requests.get(url, auth=self.auth()).json()
+		info = self.request('get_info', '/get_info').json()
 
 		return info
 
 	def sync_info(self):
 		""" Returns json response from sync_info RPC command"""
 
-		url = self.url('/json_rpc')
-		post_data = {'jsonrpc': '2.0', 'id': '0', 'method': 'sync_info'}
-
-		resp = requests.post(url, json=post_data, auth=self.auth())
+		resp = self.json_rpc('sync_info')
 
 		if resp.status_code // 100 != 2:
 			return None
@@ -64,22 +237,55 @@ class DaemonConnection(object):
 		except:
 			return None
 
-	def get_transactions(self, txids):
+	def get_transactions(self, txids, ring_only=False, with_outs=True):
 		"""
-		Returns list of Transaction objs from get_transactions RPC command
+		Returns list of Transaction objs from get_transactions RPC command, or None if it fails. If the
+		node rejects the request because it is too large, it is split up into smaller ones.
 
 		txids: list of transaction ids/hashes
+		ring_only: bool, if True, fetch pruned txs as hex blobs and only decode their prefixes instead
+			of having the daemon encode them as JSON. Much smaller responses and faster to parse
+		with_outs: bool, if False, don't decode the outputs of the txs, leaving their outs empty
 		"""
 
 		# Should throw error if not iterable
 		iter(txids)
 
-		url = self.url('/get_transactions')
-		post_data = {'txs_hashes': txids, 'decode_as_json': True, 'prune': True}
-		resp = requests.post(url, json=post_data, auth=self.auth())
+		txids = list(txids)
+		txs = []
+		i = 0
+
+		while i < len(txids):
+			batch = txids[i:i + self.max_txs_per_request] if self.max_txs_per_request else txids[i:]
+
+			try:
+				batch_txs = self._get_transactions(batch, ring_only, with_outs)
+			except KeyError:
+				if len(batch) == 1:
+					print("Error! Node rejected your request because it is too large", file=sys.stderr)
+					return None
+
+				self.max_txs_per_request = len(batch) // 2
+				self.stats.count('batch_splits')
+				continue
+
+			if batch_txs is None:
+				return None
+
+			txs += batch_txs
+			i += len(batch)
+
+		return txs
+
+	def _get_transactions(self, txids, ring_only, with_outs):
+		""" Sends a single get_transactions request. Raises a KeyError if the node rejected it as too large """
+
+		post_data = {'txs_hashes': txids, 'decode_as_json': not ring_only, 'prune': True}
+		resp = self.request('get_transactions', '/get_transactions', post_data)
 
 		try:
-			resp_json = resp.json()
+			with self.stats.stage('decode'):
+				resp_json = resp.json()
 		except:
 			print("Error! json decoding from monero daemon. Response shown below:", file=sys.stderr)
 			print(resp.text, file=sys.stderr)
@@ -88,9 +294,10 @@ class DaemonConnection(object):
 			return None
 
 		try:
-			txs_res = Transaction.all_in_rpc_resp(resp_json)
-		except KeyError:
-			print("Error! Node rejected your request because it is too large", file=sys.stderr)
+			with self.stats.stage('parse'):
+				txs_res = Transaction.all_in_rpc_resp(resp_json, binary=ring_only, with_outs=with_outs)
+		except ValueError as e:
+			print("Error! Could not decode transaction blob from monero daemon:", e, file=sys.stderr)
 			return None
 
 		if len(txs_res) != len(txids):
@@ -99,6 +306,43 @@ class DaemonConnection(object):
 
 		return txs_res
 
+	def is_key_image_spent(self, key_images):
+		"""
+		Returns list of the spent status of every key image from the is_key_image_spent RPC command: 0 if
+		unspent, 1 if spent in the blockchain and 2 if spent in a tx in the pool. Returns None if it fails.
+
+		key_images: list of hex key images
+		"""
+
+		resp = self.request('is_key_image_spent', '/is_key_image_spent', {'key_images': list(key_images)})
+
+		try:
+			statuses = resp.json()['spent_status']
+		except:
+			return None
+
+		return statuses if len(statuses) == len(key_images) else None
+
+	def get_transaction_pool(self, with_outs=True):
+		"""
+		Returns list of Transaction objs of all txs in the daemon's pool from a single
+		get_transaction_pool RPC command, or None if it fails
+
+		with_outs: bool, if False, don't decode the outputs of the txs, leaving their outs empty
+		"""
+
+		resp = self.request('get_transaction_pool', '/get_transaction_pool')
+
+		try:
+			with self.stats.stage('decode'):
+				resp_json = resp.json()
+
+			with self.stats.stage('parse'):
+				return Transaction.all_in_pool_resp(resp_json, with_outs=with_outs)
+		except (ValueError, KeyError) as e:
+			print("Error! Could not decode transaction pool from monero daemon:", e, file=sys.stderr)
+			return None
+
 	def get_outs(self, key_indexes):
 		"""
 		Returns list of output info objects from get_outs RPC command
@@ -109,9 +353,8 @@ class DaemonConnection(object):
 		# Should throw error if not iterable
 		iter(key_indexes)
 
-		url = self.url('/get_outs')
 		post_data = {'outputs': [{'index': x} for x in key_indexes] }
-		outs = requests.post(url, json=post_data, auth=self.auth()).json()
+		outs = self.request('get_outs', '/get_outs', post_data).json()
 
 		return outs['outs']
 
@@ -122,37 +365,80 @@ class DaemonConnection(object):
 		height: height of said block
 		"""
 
-		url = self.url('/json_rpc')
-		post_data = {
-			'jsonrpc': '2.0',
-			'id': '0',
-			'method': 'get_block',
-			'params': {
-				'height': height
-			}
-		}
+		resp = self.json_rpc('get_block', {'height': height}).json()
 
-		resp = requests.post(url, json=post_data, auth=self.auth()).json()
 		block = resp['result']
 
 		return block
 
+	def get_block_header_by_height(self, height):
+		""" Returns json object representing block header from get_block_header_by_height RPC command """
+
+		resp = self.json_rpc('get_block_header_by_height', {'height': height}).json()
+
+		return resp['result']['block_header']
+
+	def get_block_headers_range(self, start_height, end_height):
+		"""
+		Returns list of json objects representing the headers of blocks [start_height, end_height] from
+		the get_block_headers_range RPC command. Restricted daemons only serve up to
+		max_headers_per_request headers at once, so larger ranges are split up.
+		"""
+
+		headers = []
+
+		for lo in range(start_height, end_height + 1, self.max_headers_per_request):
+			hi = min(lo + self.max_headers_per_request - 1, end_height)
+			resp = self.json_rpc('get_block_headers_range', {'start_height': lo, 'end_height': hi}).json()
+			headers += resp['result']['headers']
+
+		return headers
+
+	def get_output_distribution(self, from_height=0, to_height=0, cumulative=True):
+		"""
+		Returns tuple (start_height, distribution) from the get_output_distribution RPC command for
+		RingCT outputs, or None if the command fails. distribution[i] is the number of outputs created
+		in block start_height + i, or the total number of outputs created up to and including that
+		block if cumulative is True.
+
+		from_height: int, first height of distribution
+		to_height: int, last height of distribution. 0 means the top block
+		cumulative: bool, whether counts are cumulative
+		"""
+
+		params = {
+			'amounts': [0],
+			'from_height': from_height,
+			'to_height': to_height,
+			'cumulative': cumulative,
+			'binary': False
+		}
+
+		try:
+			resp = self.json_rpc('get_output_distribution', params).json()
+			dist = resp['result']['distributions'][0]
+
+			return dist['start_height'], dist['distribution']
+		except:
+			return None
+
 	def needs_login(self):
 		"""
 		Returns a boolean value whether the daemon needs authorization to use RPC commands.
 		"""
 
-		resp = requests.get(self.url('/get_info'))
+		resp = requests.get(self.url('/get_info'), timeout=self.timeout)
 
 		return resp.status_code == 401
 
 class WalletConnection(object):
-	def __init__(self, wallet_path, password, host=None, host_login=None, cmd='monero-wallet-cli'):
+	def __init__(self, wallet_path, password, host=None, host_login=None, cmd='monero-wallet-cli', offline=False):
 		self.wallet_path = wallet_path
 		self.password = password
 		self.host = host
 		self.host_login = host_login
 		self.cmd = cmd
+		self.offline = offline
 
 	def send_command(self, cmd_strs):
 		"""
@@ -164,7 +450,9 @@ class WalletConnection(object):
 
 		daemon_args = []
 
-		if self.host:
+		if self.offline:
+			daemon_args.append('--offline')
+		elif self.host:
 			daemon_args.extend(['--daemon-host', self.host])
 
 			if self.host_login:
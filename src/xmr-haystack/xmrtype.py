@@ -1,6 +1,8 @@
 from collections import namedtuple
 import json
 
+from .xmrbin import parse_tx_prefix
+
 class Block(namedtuple('Block', 'height hash')):
 	@classmethod
 	def fromjson(cls, obj):
@@ -12,7 +14,7 @@ class Block(namedtuple('Block', 'height hash')):
 	def __ne__(self, other):
 		return self.hash != other.hash
 
-class Transaction(namedtuple('Transaction', 'hash height timestamp ins outs')):
+class Transaction(namedtuple('Transaction', 'hash height timestamp ins outs kimages')):
 	"""
 	Lightweight class to represent the important information about a monero transaction. Easily
 	serialiable to and from JSON.
@@ -22,28 +24,50 @@ class Transaction(namedtuple('Transaction', 'hash height timestamp ins outs')):
 		height - int, height of block that contains transaction
 		timestamp - int, UNIX timestamp of block that contains transaction
 		ins - list[int], flat list of all gindexes in all rings of stealth addresses in tx
-		outs - list[str], list of all output stealth addresses (targets) in transaction
+		outs - list[str], list of all output stealth addresses (targets) in transaction. Empty if
+			the outputs weren't decoded
+		kimages - list[str], key image of every input. Empty in caches from before they were recorded
 	"""
 
 	@classmethod
 	def fromjson(cls, json_data):
-		return cls(*json_data)
+		# Caches from before key images were recorded lack them
+		return cls(*json_data) if len(json_data) == len(cls._fields) else cls(*json_data, [])
 
 	@classmethod
-	def all_in_rpc_resp(cls, json_resp):
+	def all_in_rpc_resp(cls, json_resp, binary=False, with_outs=True):
 		"""
 		Returns a list of Transaction objects respresenting all valid transactions that are
 		contained in a RPC command /get_transactions JSON response. json_resp is just a JSON
 		obj parsed from the text response from the RPC command. It is used in the method
-		DaemonConnection.get_transactions().
+		DaemonConnection.get_transactions(). If binary is True, the txs are decoded from their
+		hex blobs (requested with decode_as_json=False) instead of from 'as_json'. If with_outs is
+		False, the outputs aren't decoded.
 
 		Doc: https://web.getmonero.org/resources/developer-guides/daemon-rpc.html#get_transactions
 		"""
 
-		return [cls._fromrpcobj(x) for x in json_resp['txs']]
+		if binary:
+			return [cls._fromrpcblob(x, with_outs) for x in json_resp['txs']]
+		else:
+			return [cls._fromrpcobj(x, with_outs) for x in json_resp['txs']]
+
+	@classmethod
+	def all_in_pool_resp(cls, json_resp, with_outs=True):
+		"""
+		Returns a list of Transaction objects representing all transactions in a RPC command
+		/get_transaction_pool JSON response. Pool txs aren't in a block yet, so like in the response of
+		/get_transactions, their height is 0. Their timestamp is the time the node received them.
+
+		Doc: https://web.getmonero.org/resources/developer-guides/daemon-rpc.html#get_transaction_pool
+		"""
+
+		# For some reason, the node leaves out 'transactions' if the pool is empty
+		return [cls._fromtxjson(x['id_hash'], 0, x['receive_time'], json.loads(x['tx_json']), with_outs)
+			for x in json_resp.get('transactions', [])]
 
 	@classmethod
-	def _fromrpcobj(cls, json_data):
+	def _fromrpcobj(cls, json_data, with_outs=True):
 		"""
 		Returns a Transaction object from JSON object inside response of RPC /get_transactions
 		command. json_data is a json obj representation of a tx found at resp["txs"][x], where
@@ -56,10 +80,15 @@ class Transaction(namedtuple('Transaction', 'hash height timestamp ins outs')):
 		blk_height = json_data['block_height']
 		timestamp = json_data['block_timestamp']
 
-		tx_json = json.loads(json_data['as_json'])
+		return cls._fromtxjson(tx_hash, blk_height, timestamp, json.loads(json_data['as_json']), with_outs)
+
+	@classmethod
+	def _fromtxjson(cls, tx_hash, blk_height, timestamp, tx_json, with_outs=True):
+		""" Returns a Transaction object from the JSON decoding of a tx, like the 'as_json' field of txs """
 
 		ins = []
 		outs = []
+		kimages = []
 
 		# I don't know why this structure is so damn convoluted
 		for in_entry in tx_json['vin']:
@@ -68,13 +97,36 @@ class Transaction(namedtuple('Transaction', 'hash height timestamp ins outs')):
 			gindexes = [sum(gindex_offsets[:i+1]) for i in range(len(gindex_offsets))]
 
 			ins.extend(gindexes)
+			kimages.append(k['k_image'])
 
-		for out_entry in tx_json['vout']:
-			key = out_entry['target']['key']
+		# Since the view tag hard fork, outputs are 'tagged_key' targets instead of 'key' targets
+		for out_entry in (tx_json['vout'] if with_outs else []):
+			target = out_entry['target']
+			key = target['key'] if 'key' in target else target['tagged_key']['key']
 
 			outs.append(key)
 
-		return cls(tx_hash, blk_height, timestamp, ins, outs)
+		return cls(tx_hash, blk_height, timestamp, ins, outs, kimages)
+
+	@classmethod
+	def _fromrpcblob(cls, json_data, with_outs=True):
+		"""
+		Returns a Transaction object from JSON object inside response of RPC /get_transactions
+		command made with decode_as_json=False. Only the tx prefix at the start of the pruned
+		(or full, if the daemon didn't prune it) hex blob is decoded.
+
+		Doc: https://web.getmonero.org/resources/developer-guides/daemon-rpc.html#get_transactions
+		"""
+
+		tx_hash = json_data['tx_hash']
+		blk_height = json_data['block_height']
+		timestamp = json_data['block_timestamp']
+		blob_hex = json_data.get('pruned_as_hex') or json_data['as_hex']
+
+		prefix = parse_tx_prefix(bytes.fromhex(blob_hex), with_outs)
+		ins = [gindex for ring in prefix['ins'] for gindex in ring]
+
+		return cls(tx_hash, blk_height, timestamp, ins, prefix['outs'], prefix['kimages'])
 
 	def __eq__(self, other):
 		""" Returns True if hashes are equal """
@@ -84,3 +136,107 @@ class Transaction(namedtuple('Transaction', 'hash height timestamp ins outs')):
 		""" Returns True if hashes are not equal """
 
 		return self.hash != other.hash
+
+class HeightIntervals(object):
+	"""
+	Set of block heights stored as a sorted list of disjoint, non-adjacent, inclusive [lo, hi]
+	intervals. Used to record which blocks have been scanned. Easily serializable to and from JSON.
+	"""
+
+	def __init__(self, intervals=()):
+		self.intervals = []
+
+		for lo, hi in intervals:
+			self.add(lo, hi)
+
+	@classmethod
+	def fromjson(cls, json_data):
+		return cls(json_data)
+
+	def tojson(self):
+		return [list(x) for x in self.intervals]
+
+	def add(self, lo, hi):
+		""" Adds the heights [lo, hi] to the set """
+
+		if hi < lo:
+			return
+
+		merged = []
+		i = 0
+
+		# Intervals entirely below [lo, hi] and not adjacent to it stay as they are
+		while i < len(self.intervals) and self.intervals[i][1] < lo - 1:
+			merged.append(self.intervals[i])
+			i += 1
+
+		# Intervals overlapping or adjacent to [lo, hi] get merged into it
+		while i < len(self.intervals) and self.intervals[i][0] <= hi + 1:
+			lo = min(lo, self.intervals[i][0])
+			hi = max(hi, self.intervals[i][1])
+			i += 1
+
+		merged.append((lo, hi))
+		merged.extend(self.intervals[i:])
+
+		self.intervals = merged
+
+	def remove(self, lo, hi=None):
+		""" Removes the heights [lo, hi] from the set. If hi is None, removes all heights >= lo """
+
+		remaining = []
+
+		for a, b in self.intervals:
+			if b < lo or (hi is not None and a > hi):
+				remaining.append((a, b))
+				continue
+
+			if a < lo:
+				remaining.append((a, lo - 1))
+			if hi is not None and b > hi:
+				remaining.append((hi + 1, b))
+
+		self.intervals = remaining
+
+	def intersection(self, lo, hi):
+		""" Returns list of the intervals of the set which lie inside [lo, hi], clipped to it """
+
+		return [(max(a, lo), min(b, hi)) for a, b in self.intervals if b >= lo and a <= hi]
+
+	def missing(self, lo, hi):
+		""" Returns list of the intervals inside [lo, hi] which are not in the set """
+
+		gaps = []
+		cur = lo
+
+		for a, b in self.intersection(lo, hi):
+			if a > cur:
+				gaps.append((cur, a - 1))
+
+			cur = b + 1
+
+		if cur <= hi:
+			gaps.append((cur, hi))
+
+		return gaps
+
+	def __contains__(self, height):
+		return any(a <= height <= b for a, b in self.intervals)
+
+	def __iter__(self):
+		return iter(self.intervals)
+
+	def __bool__(self):
+		return bool(self.intervals)
+
+	def __eq__(self, other):
+		return isinstance(other, HeightIntervals) and self.intervals == other.intervals
+
+	def __repr__(self):
+		return 'HeightIntervals({})'.format(self.intervals)
+
+	def min(self):
+		return self.intervals[0][0] if self.intervals else None
+
+	def max(self):
+		return self.intervals[-1][1] if self.intervals else None
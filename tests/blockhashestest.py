@@ -0,0 +1,95 @@
+"""
+Checks that a block hash table finds its top height again after being truncated and reopened, also
+for files ending in empty grow steps, and that truncating the reopened table forgets the right
+hashes. Also checks two tables sharing one file, like concurrent runs do. Exits non-zero if anything
+doesn't match.
+
+	$ python3 tests/blockhashestest.py
+"""
+
+import hashlib
+import importlib
+import os.path
+import sys
+import tempfile
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src'))
+
+blockhashes = importlib.import_module('xmr-haystack.blockhashes')
+BlockHashTable = blockhashes.BlockHashTable
+
+def fake_hash(height):
+	return hashlib.sha256(str(height).encode()).hexdigest()
+
+def check_truncate_reopen(path):
+	""" Fills two grow steps, truncates into the first, reopens and truncates again """
+
+	table = BlockHashTable(path)
+	for height in range(70000):
+		table.set(height, fake_hash(height))
+	table.truncate(1000)
+	table.close()
+
+	table = BlockHashTable(path)
+	assert table.top == 999
+	assert table.get(700) == fake_hash(700)
+
+	table.truncate(500)
+	assert table.top == 499
+	assert table.get(700) is None
+	assert table.get(499) == fake_hash(499)
+
+	table.truncate(0)
+	table.close()
+
+	assert BlockHashTable(path).top == -1
+
+def check_trailing_empty_steps(path):
+	""" Truncated files can end in several empty grow steps """
+
+	with open(path, 'wb') as f:
+		for height in range(1000):
+			f.write(bytes.fromhex(fake_hash(height)))
+		f.write(bytes((3 * BlockHashTable.grow_heights - 1000) * BlockHashTable.hash_size))
+
+	table = BlockHashTable(path)
+	assert table.top == 999
+
+	table.truncate(500)
+	assert table.get(700) is None
+	assert table.get(499) == fake_hash(499)
+	table.close()
+
+	assert BlockHashTable(path).top == 499
+
+def check_shared_file(path):
+	""" The file is never shrunk under another table mapping it, and truncates see the other's hashes """
+
+	first = BlockHashTable(path)
+	second = BlockHashTable(path)
+	size = 2 * BlockHashTable.grow_heights * BlockHashTable.hash_size
+
+	first.set(BlockHashTable.grow_heights + 10, fake_hash(1))
+	second.set(5, fake_hash(5))
+	assert os.path.getsize(path) == size
+
+	# second's top is stale, but it has to forget first's hash anyway
+	second.truncate(100)
+	assert os.path.getsize(path) == size
+	assert first.get(BlockHashTable.grow_heights + 10) is None
+	assert first.get(5) == fake_hash(5)
+
+	first.close()
+	second.close()
+
+def main():
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		check_truncate_reopen(os.path.join(tmp_dir, 'blockhashes.bin'))
+		check_trailing_empty_steps(os.path.join(tmp_dir, 'old.bin'))
+		check_shared_file(os.path.join(tmp_dir, 'shared.bin'))
+
+	print('ok')
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,112 @@
+"""
+Checks scanning a blockchain export file (blockchain.raw) with BootstrapFile against a synthetic
+chain written in the export format. Exits non-zero if anything doesn't match.
+
+	$ python3 tests/bootstraptest.py --height 500 --density 10
+"""
+
+import argparse
+import importlib
+import os.path
+import random
+import sys
+import tempfile
+
+import mockdaemon
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src'))
+
+haystack = importlib.import_module('xmr-haystack.__main__')
+bootstrap = importlib.import_module('xmr-haystack.bootstrap')
+xmrbin = importlib.import_module('xmr-haystack.xmrbin')
+
+# Monero mainnet genesis block, and the hashes of it and its miner tx
+GENESIS_BLOB = '010000000000000000000000000000000000000000000000000000000000000000000010270000013c01ff0001ffff' \
+	'ffffffff03029b2e4c0281c0b02e7c53291a94d1d0cbff8883f8024f5142ee494ffbbd08807121017767aafcde9be00dcfd0' \
+	'98715ebcf7f410daebc582fda69d24a28e9d0bc890d100'
+GENESIS_HASH = '418015bb9ae982a1975da7d79277c2705727a56894ba0fb246adaabb1f4632e3'
+GENESIS_TX_HASH = 'c88ce9783b4f11190d7b9c17a69c1c52200f9faaee8e98dd07e6811175177139'
+
+def check_hashing():
+	assert xmrbin.keccak256(b'').hex() == 'c5d2460186f7233c927e7db2dcc703c0e500b653ca82273b7bfad8045d85a470'
+
+	blob = bytes.fromhex(GENESIS_BLOB)
+	block = xmrbin.read_block(xmrbin.BlobReader(blob))
+
+	assert xmrbin.tx_hash(blob, block['miner_tx']) == GENESIS_TX_HASH
+	assert xmrbin.block_hash(blob, block) == GENESIS_HASH
+
+def created_in_of(chain, gindexes):
+	""" Returns the gindexes by hash of the tx that created them, like the wallet reports them """
+
+	created_in = {}
+	for gindex in gindexes:
+		created_in.setdefault(chain.outputs[gindex][2], []).append(gindex)
+
+	return created_in
+
+def check_source(chain, source, num_keys, seed):
+	"""
+	Checks that the BlockSource source holds chain, and that scanning it finds the expected txs. Also
+	used by lmdbtest.py.
+	"""
+
+	try:
+		top = chain.height - 1
+		assert source.get_info()['height'] == chain.height
+
+		# All hashes but the top one are read from the next block. The top one is calculated from the
+		# block itself, which the synthetic chain doesn't do
+		for height in random.Random(seed).sample(range(top), min(top, 50)):
+			assert source.block_hash(height) == chain.blocks[height]['hash']
+
+		assert len(source.block_hash(top)) == 64
+
+		gindexes = random.Random(seed).sample(range(len(chain.outputs)), num_keys)
+		txs_by_key_index = {i: [] for i in gindexes}
+		created_in = created_in_of(chain, gindexes)
+		settings = {'restricted': False, 'quiet': True, 'vquiet': True, 'progress': None, 'ring_only': False,
+			'order': 'newest-first'}
+
+		err = haystack.scan(0, top, source, settings, gindexes, txs_by_key_index, [], created_in=created_in)
+		assert err is None
+
+		for gindex, want in chain.expected_hits(gindexes).items():
+			found = set(tx.hash for tx in txs_by_key_index[gindex])
+			assert found == set(want), (gindex, found ^ set(want))
+	finally:
+		source.close()
+
+def main():
+	parser = argparse.ArgumentParser(description='Check scanning blockchain export files')
+	mockdaemon.add_chain_args(parser)
+	parser.add_argument('--keys', type=int, default=20, help='number of outputs that belong to "us"')
+	args = parser.parse_args()
+
+	check_hashing()
+
+	chain = mockdaemon.chain_from_args(args)
+
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		path = os.path.join(tmp_dir, 'blockchain.raw')
+
+		with open(path, 'wb') as f:
+			chain.write_export(f)
+
+		check_source(chain, bootstrap.BootstrapFile(path), args.keys, args.seed)
+
+		# An export that was cut off in the middle of a block ends at the block before it
+		with open(path, 'rb') as f:
+			blob = f.read()
+		with open(path, 'wb') as f:
+			f.write(blob[:-10])
+
+		export = bootstrap.BootstrapFile(path)
+		assert export.get_info()['height'] == chain.height - 1
+		export.close()
+
+	print('ok')
+
+if __name__ == '__main__':
+	main()
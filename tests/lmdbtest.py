@@ -0,0 +1,52 @@
+"""
+Checks scanning monerod's blockchain database with LMDBBlockchain against a synthetic chain written
+to a small LMDB environment in monerod's table layout. Needs the lmdb package. Exits non-zero if
+anything doesn't match.
+
+	$ python3 tests/lmdbtest.py --height 500 --density 10
+"""
+
+import argparse
+import importlib
+import os.path
+import sys
+import tempfile
+
+import bootstraptest
+import mockdaemon
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src'))
+
+lmdbchain = importlib.import_module('xmr-haystack.lmdbchain')
+
+def main():
+	parser = argparse.ArgumentParser(description='Check scanning monerod blockchain databases')
+	mockdaemon.add_chain_args(parser)
+	parser.add_argument('--keys', type=int, default=20, help='number of outputs that belong to "us"')
+	args = parser.parse_args()
+
+	chain = mockdaemon.chain_from_args(args)
+
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		path = os.path.join(tmp_dir, 'lmdb')
+		chain.write_lmdb(path)
+
+		bootstraptest.check_source(chain, lmdbchain.LMDBBlockchain(path), args.keys, args.seed)
+
+		# Blocks read out of order have their txs found by bisection, also when given data.mdb itself
+		source = lmdbchain.LMDBBlockchain(os.path.join(path, 'data.mdb'))
+		for height in [chain.height - 1, 0, chain.height // 2, chain.height // 2 + 1, 1]:
+			block = chain.blocks[height]
+			result = source.get_block(height)
+			assert result['block_header']['prev_hash'] == block['prev_hash']
+			assert result.get('tx_hashes', []) == block['tx_hashes']
+
+			txs = source.get_transactions(block['tx_hashes'])
+			assert [tx.outs for tx in txs] == [chain.txs[h]['outs'] for h in block['tx_hashes']]
+		source.close()
+
+	print('ok')
+
+if __name__ == '__main__':
+	main()
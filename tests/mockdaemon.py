@@ -0,0 +1,815 @@
+"""
+A mock monerod serving deterministic synthetic blockchains over the daemon RPC interface. Only the
+subset of RPC commands used by xmr-haystack is implemented. It can be run in-process (MockDaemon)
+or standalone:
+
+	$ python3 tests/mockdaemon.py --height 5000 --density 8 --ring-size 16 --port 28081
+"""
+
+import argparse
+from collections import Counter, deque
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import struct
+import threading
+import time
+
+class SyntheticChain(object):
+	"""
+	Deterministic synthetic blockchain. Every block has a miner tx with one output followed by a
+	random number of txs. Every tx has 1 to max_inputs inputs whose rings are sampled uniformly from
+	all outputs created before that block, and outputs_per_tx outputs. The chain for a given set of
+	parameters is always the same, and reorg() replaces the top of the chain with a new branch.
+
+	Fields:
+		blocks - list[dict], block info indexed by height
+		txs - dict{str: dict}, every tx ever generated (including orphaned ones) by hash
+		outputs - list[tuple], (key, height, txid) of every output in the main chain by gindex
+	"""
+
+	def __init__(self, height=1000, tx_density=5, ring_size=11, max_inputs=2, outputs_per_tx=2, seed=0,
+		genesis_time=1600000000, block_time=120):
+		self.tx_density = tx_density
+		self.ring_size = ring_size
+		self.max_inputs = max_inputs
+		self.outputs_per_tx = outputs_per_tx
+		self.seed = seed
+		self.genesis_time = genesis_time
+		self.block_time = block_time
+		self.branch = 0
+
+		self.blocks = []
+		self.txs = {}
+		self.outputs = []
+
+		self.lock = threading.RLock()
+
+		self.extend(height)
+
+	@property
+	def height(self):
+		return len(self.blocks)
+
+	def extend(self, num_blocks):
+		""" Appends num_blocks new blocks to the top of the chain """
+
+		with self.lock:
+			for _ in range(num_blocks):
+				self._add_block()
+
+	def reorg(self, depth):
+		""" Replaces the top depth blocks with blocks from a new branch """
+
+		with self.lock:
+			depth = min(depth, self.height - 1)
+
+			for block in self.blocks[-depth:]:
+				for tx_hash in [block['miner_tx_hash']] + block['tx_hashes']:
+					self.txs[tx_hash]['in_pool'] = True
+
+			first_orphan = self.blocks[-depth]
+			del self.outputs[first_orphan['first_gindex']:]
+			del self.blocks[-depth:]
+
+			self.branch += 1
+			self.extend(depth)
+
+	def add_pool_tx(self, rings):
+		"""
+		Adds a tx with ring members rings (list of lists of gindexes) to the pool and returns it. Its
+		outputs get no gindexes, since it isn't in a block
+		"""
+
+		with self.lock:
+			height = self.height
+			tag = 'pool{}'.format(sum(tx['in_pool'] for tx in self.txs.values()))
+			tx_hash = self._hash('tx', self.branch, height, tag)
+
+			tx = {
+				'hash': tx_hash,
+				'height': height,
+				'timestamp': self.blocks[-1]['timestamp'] + self.block_time // 2,
+				'rings': [sorted(ring) for ring in rings],
+				'kimages': [self._hash('kimage', tx_hash, i) for i in range(len(rings))],
+				'outs': [self._hash('out', tx_hash, i) for i in range(self.outputs_per_tx)],
+				'out_gindexes': [],
+				'in_pool': True
+			}
+
+			self.txs[tx_hash] = tx
+
+			return tx
+
+	def _hash(self, *parts):
+		h = hashlib.sha256()
+		h.update(':'.join(map(str, (self.seed,) + parts)).encode())
+		return h.hexdigest()
+
+	def _add_block(self):
+		height = self.height
+		rng = random.Random('{}:{}:{}'.format(self.seed, self.branch, height))
+		prev_hash = self.blocks[-1]['hash'] if self.blocks else '0' * 64
+		timestamp = self.genesis_time + height * self.block_time + rng.randint(-30, 30)
+		num_prior_outputs = len(self.outputs)
+
+		miner_tx = self._make_tx(rng, height, timestamp, [], 1, 'miner')
+		txs = []
+
+		if num_prior_outputs >= self.ring_size:
+			for i in range(rng.randint(0, 2 * self.tx_density)):
+				rings = []
+				for _ in range(rng.randint(1, self.max_inputs)):
+					rings.append(sorted(rng.sample(range(num_prior_outputs), self.ring_size)))
+
+				txs.append(self._make_tx(rng, height, timestamp, rings, self.outputs_per_tx, i))
+
+		block_hash = self._hash('block', self.branch, height, prev_hash)
+		block = {
+			'height': height,
+			'hash': block_hash,
+			'prev_hash': prev_hash,
+			'timestamp': timestamp,
+			'miner_tx_hash': miner_tx['hash'],
+			'tx_hashes': [tx['hash'] for tx in txs],
+			'first_gindex': num_prior_outputs
+		}
+
+		self.blocks.append(block)
+
+	def _make_tx(self, rng, height, timestamp, rings, num_outs, tag):
+		tx_hash = self._hash('tx', self.branch, height, tag)
+		out_gindexes = list(range(len(self.outputs), len(self.outputs) + num_outs))
+		outs = [self._hash('out', self.branch, gindex) for gindex in out_gindexes]
+		kimages = [self._hash('kimage', tx_hash, i) for i in range(len(rings))]
+
+		tx = {
+			'hash': tx_hash,
+			'height': height,
+			'timestamp': timestamp,
+			'rings': rings,
+			'kimages': kimages,
+			'outs': outs,
+			'out_gindexes': out_gindexes,
+			'in_pool': False
+		}
+
+		self.txs[tx_hash] = tx
+		self.outputs.extend((key, height, tx_hash) for key in outs)
+
+		return tx
+
+	def block_header(self, height):
+		block = self.blocks[height]
+
+		return {
+			'height': height,
+			'hash': block['hash'],
+			'prev_hash': block['prev_hash'],
+			'timestamp': block['timestamp'],
+			'num_txes': len(block['tx_hashes']),
+			'major_version': 16,
+			'minor_version': 16,
+			'nonce': 0,
+			'reward': 600000000000,
+			'depth': self.height - height - 1,
+			'orphan_status': False,
+			'miner_tx_hash': block['miner_tx_hash']
+		}
+
+	def tx_as_json(self, tx):
+		""" Returns the 'as_json' string monerod would give for tx when decode_as_json and prune are set """
+
+		vin = []
+		for ring, kimage in zip(tx['rings'], tx['kimages']):
+			offsets = [ring[0]] + [ring[i] - ring[i - 1] for i in range(1, len(ring))]
+			vin.append({'key': {'amount': 0, 'key_offsets': offsets, 'k_image': kimage}})
+
+		if not vin:
+			vin.append({'gen': {'height': tx['height']}})
+
+		vout = [{'amount': 0, 'target': {'key': key}} for key in tx['outs']]
+
+		tx_json = {
+			'version': 2,
+			'unlock_time': 0,
+			'vin': vin,
+			'vout': vout,
+			'extra': [],
+			'rct_signatures': {'type': 6 if tx['rings'] else 0}
+		}
+
+		return json.dumps(tx_json)
+
+	def tx_blob(self, tx):
+		"""
+		Returns the pruned binary serialization (prefix + RingCT base) of tx. Outputs are tagged keys,
+		like after the view tag hard fork.
+		"""
+
+		blob = bytearray()
+		blob += varint(2) # version
+		blob += varint(tx['height'] + 60 if not tx['rings'] else 0) # unlock_time
+
+		if tx['rings']:
+			blob += varint(len(tx['rings']))
+			for ring, kimage in zip(tx['rings'], tx['kimages']):
+				offsets = [ring[0]] + [ring[i] - ring[i - 1] for i in range(1, len(ring))]
+				blob += b'\x02' + varint(0) + varint(len(offsets))
+				for offset in offsets:
+					blob += varint(offset)
+				blob += bytes.fromhex(kimage)
+		else:
+			blob += varint(1) + b'\xff' + varint(tx['height'])
+
+		blob += varint(len(tx['outs']))
+		for key in tx['outs']:
+			blob += varint(600000000000 if not tx['rings'] else 0) + b'\x03' + bytes.fromhex(key) + b'\x00'
+
+		extra = b'\x01' + bytes.fromhex(self._hash('txkey', tx['hash']))
+		blob += varint(len(extra)) + extra
+
+		# RingCT base: type, fee, 8 byte encrypted amounts and 32 byte commitments
+		if tx['rings']:
+			blob += b'\x06' + varint(30000000)
+			blob += b'\x00' * (8 * len(tx['outs']))
+			blob += b'\x00' * (32 * len(tx['outs']))
+		else:
+			blob += b'\x00'
+
+		return bytes(blob)
+
+	def tx_full_blob(self, tx):
+		"""
+		Returns the unpruned binary serialization of tx: tx_blob() plus random bulletproof+ range proofs,
+		CLSAG ring signatures and pseudo outputs of the right sizes
+		"""
+
+		blob = bytearray(self.tx_blob(tx))
+
+		if tx['rings']:
+			rng = random.Random(tx['hash'])
+			rand_keys = lambda n: bytes(rng.getrandbits(8) for _ in range(32 * n))
+			num_rounds = 6 + (len(tx['outs']) - 1).bit_length()
+
+			blob += varint(1) + rand_keys(6)
+			blob += varint(num_rounds) + rand_keys(num_rounds)
+			blob += varint(num_rounds) + rand_keys(num_rounds)
+
+			for ring in tx['rings']:
+				blob += rand_keys(len(ring) + 2)
+
+			blob += rand_keys(len(tx['rings']))
+
+		return bytes(blob)
+
+	def block_blob(self, block):
+		""" Returns the binary serialization of block: its header, miner tx and tx hashes """
+
+		blob = bytearray()
+		blob += varint(16) + varint(16) + varint(block['timestamp'])
+		blob += bytes.fromhex(block['prev_hash']) + (0).to_bytes(4, 'little')
+		blob += self.tx_full_blob(self.txs[block['miner_tx_hash']])
+		blob += varint(len(block['tx_hashes']))
+
+		for tx_hash in block['tx_hashes']:
+			blob += bytes.fromhex(tx_hash)
+
+		return bytes(blob)
+
+	def write_export(self, f):
+		"""
+		Writes the chain to binary file object f in the blockchain.raw format of monero-blockchain-export:
+		a magic number, a 1024 byte header and one chunk per block
+		"""
+
+		header_size = 1024
+		file_info = b'\x00\x01' + varint(header_size)
+		blocks_info = varint(0) + varint(self.height - 1) + varint(0)
+		header = len(file_info).to_bytes(4, 'little') + file_info + len(blocks_info).to_bytes(4, 'little') + blocks_info
+
+		f.write((0x28721586).to_bytes(4, 'little'))
+		f.write(header + bytes(header_size - len(header)))
+
+		with self.lock:
+			for block in self.blocks:
+				package = bytearray(self.block_blob(block))
+				package += varint(len(block['tx_hashes']))
+
+				for tx_hash in block['tx_hashes']:
+					package += self.tx_full_blob(self.txs[tx_hash])
+
+				# Block weight, cumulative difficulty and coins generated
+				package += varint(len(package)) + varint(block['height'] + 1) + varint(600000000000)
+
+				f.write(len(package).to_bytes(4, 'little'))
+				f.write(package)
+
+	def write_lmdb(self, path):
+		"""
+		Writes the chain to a new LMDB environment in directory path, with the 'blocks' and 'txs_pruned'
+		tables laid out like in monerod's database. Needs the lmdb package.
+		"""
+
+		import lmdb
+
+		key = lambda n: struct.pack('=Q', n)
+		env = lmdb.open(path, map_size=1 << 30, max_dbs=4)
+
+		with self.lock, env.begin(write=True) as txn:
+			blocks_db = env.open_db(b'blocks', txn=txn, integerkey=True)
+			txs_db = env.open_db(b'txs_pruned', txn=txn, integerkey=True)
+			tx_id = 0
+
+			for block in self.blocks:
+				txn.put(key(block['height']), self.block_blob(block), db=blocks_db)
+
+				for tx_hash in [block['miner_tx_hash']] + block['tx_hashes']:
+					txn.put(key(tx_id), self.tx_blob(self.txs[tx_hash]), db=txs_db)
+					tx_id += 1
+
+		env.close()
+
+	def expected_hits(self, gindexes, include_miner_txs=False):
+		"""
+		Returns dict of gindex -> list of hashes of main chain txs which contain gindex as an input or
+		output. Miner txs are left out by default since get_block doesn't list them in 'tx_hashes'.
+		"""
+
+		gindexes = set(gindexes)
+		hits = {i: [] for i in gindexes}
+
+		with self.lock:
+			for block in self.blocks:
+				miner_tx_hashes = [block['miner_tx_hash']] if include_miner_txs else []
+
+				for tx_hash in miner_tx_hashes + block['tx_hashes']:
+					tx = self.txs[tx_hash]
+					matched = set(i for ring in tx['rings'] for i in ring) | set(tx['out_gindexes'])
+
+					for gindex in matched & gindexes:
+						hits[gindex].append(tx_hash)
+
+		return hits
+
+def varint(n):
+	""" Returns n serialized as an unsigned LEB128 varint """
+
+	out = bytearray()
+
+	while n >= 0x80:
+		out.append((n & 0x7f) | 0x80)
+		n >>= 7
+
+	out.append(n)
+
+	return bytes(out)
+
+class MockDaemon(object):
+	"""
+	HTTP server answering daemon RPC requests from a SyntheticChain
+
+	chain: SyntheticChain, the chain to serve
+	latency: float, seconds to sleep before answering every request
+	jitter: float, maximum random extra seconds to sleep before answering every request
+	restricted: bool, if True, behave like a daemon in restricted RPC mode
+	max_txs_per_request: int, if set, get_transactions calls asking for more txs get rejected
+	reorgs: dict{int: int}, when block at key height is first served, reorg value blocks deep
+	fail_rate: float, probability of answering a request with HTTP 500
+	stall_rate: float, probability of sleeping stall_time seconds before answering a request
+	rate_limit: int, if set, requests beyond this many in the last second are answered with HTTP 429
+	"""
+
+	def __init__(self, chain, addr='127.0.0.1', port=0, latency=0.0, jitter=0.0, restricted=False,
+		max_txs_per_request=None, reorgs=None, fail_rate=0.0, stall_rate=0.0, stall_time=30.0, rate_limit=None):
+		self.chain = chain
+		self.latency = latency
+		self.jitter = jitter
+		self.fail_rate = fail_rate
+		self.stall_rate = stall_rate
+		self.stall_time = stall_time
+		self.rate_limit = rate_limit
+		self.recent_requests = deque()
+		self.restricted = restricted
+		self.max_txs_per_request = max_txs_per_request
+		self.reorgs = dict(reorgs) if reorgs else {}
+
+		self.rpc_counts = Counter()
+		self.bytes_sent = 0
+		self.txs_served = 0
+		self.throttled = 0
+		self.stats_lock = threading.Lock()
+
+		self.server = ThreadingHTTPServer((addr, port), self._make_handler())
+		self.server.daemon_threads = True
+		self.thread = None
+
+	@property
+	def addr(self):
+		return self.server.server_address[0]
+
+	@property
+	def port(self):
+		return self.server.server_address[1]
+
+	def start(self):
+		self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+		self.thread.start()
+
+		return self
+
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+	def serve_forever(self):
+		self.server.serve_forever()
+
+	def stats(self):
+		with self.stats_lock:
+			return {
+				'rpc_counts': dict(self.rpc_counts),
+				'bytes_sent': self.bytes_sent,
+				'txs_served': self.txs_served,
+				'throttled': self.throttled,
+				'num_outputs': len(self.chain.outputs)
+			}
+
+	def throttle(self):
+		""" Returns True if the current request is over the rate limit """
+
+		if self.rate_limit is None:
+			return False
+
+		now = time.monotonic()
+
+		with self.stats_lock:
+			while self.recent_requests and self.recent_requests[0] < now - 1:
+				self.recent_requests.popleft()
+
+			if len(self.recent_requests) >= self.rate_limit:
+				self.throttled += 1
+				return True
+
+			self.recent_requests.append(now)
+
+		return False
+
+	def handle(self, endpoint, req):
+		"""
+		Returns a tuple (HTTP status, JSON response object) answering request req to endpoint. Calls
+		to /json_rpc are counted by their method name, all others by endpoint.
+		"""
+
+		if endpoint == '/json_rpc':
+			method = req.get('method')
+			self._count(method)
+			handler = getattr(self, 'rpc_' + str(method), None)
+
+			if handler is None:
+				return 200, {'jsonrpc': '2.0', 'id': req.get('id'), 'error': {'code': -32601, 'message': 'Method not found'}}
+
+			try:
+				result = handler(req.get('params', {}))
+			except (IndexError, KeyError, TypeError, ValueError) as e:
+				return 200, {'jsonrpc': '2.0', 'id': req.get('id'), 'error': {'code': -2, 'message': str(e)}}
+
+			if result is None:
+				return 403, {}
+
+			return 200, {'jsonrpc': '2.0', 'id': req.get('id'), 'result': result}
+		elif endpoint == '/mock_stats':
+			return 200, self.stats()
+		elif endpoint == '/mock_hits':
+			hits = self.chain.expected_hits(req['gindexes'])
+			return 200, {'hits': {str(i): h for i, h in hits.items()}}
+		else:
+			self._count(endpoint.lstrip('/'))
+			handler = getattr(self, 'other_' + endpoint.lstrip('/'), None)
+
+			if handler is None:
+				return 404, {}
+
+			return 200, handler(req)
+
+	def _count(self, name):
+		with self.stats_lock:
+			self.rpc_counts[name] += 1
+
+	##### /json_rpc methods #####
+
+	def rpc_get_block(self, params):
+		chain = self.chain
+
+		with chain.lock:
+			height = params['height']
+			if height < 0 or height >= chain.height:
+				raise ValueError('Requested block height: {} greater than current top block height: {}'.format(
+					height, chain.height - 1))
+
+			header = chain.block_header(height)
+			block = chain.blocks[height]
+			result = {
+				'block_header': header,
+				'miner_tx_hash': block['miner_tx_hash'],
+				'status': 'OK',
+				'untrusted': False
+			}
+
+			# Like monerod, leave out tx_hashes entirely for blocks without any txs
+			if block['tx_hashes']:
+				result['tx_hashes'] = list(block['tx_hashes'])
+
+			if height in self.reorgs:
+				chain.reorg(self.reorgs.pop(height))
+
+		return result
+
+	def rpc_get_block_header_by_height(self, params):
+		chain = self.chain
+
+		with chain.lock:
+			height = params['height']
+			if height < 0 or height >= chain.height:
+				raise ValueError('Requested block height: {} greater than current top block height: {}'.format(
+					height, chain.height - 1))
+
+			return {'block_header': chain.block_header(height), 'status': 'OK', 'untrusted': False}
+
+	def rpc_get_block_headers_range(self, params):
+		chain = self.chain
+		start_height = params['start_height']
+		end_height = params['end_height']
+
+		with chain.lock:
+			if start_height < 0 or end_height >= chain.height or start_height > end_height:
+				raise ValueError('Invalid start/end heights.')
+
+			# Like monerod in restricted mode
+			if self.restricted and end_height - start_height >= 1000:
+				raise ValueError('Too many block headers requested.')
+
+			headers = [chain.block_header(h) for h in range(start_height, end_height + 1)]
+
+		return {'headers': headers, 'status': 'OK', 'untrusted': False}
+
+	def rpc_get_output_distribution(self, params):
+		chain = self.chain
+
+		if params.get('amounts', [0]) != [0]:
+			raise ValueError('only RingCT outputs are supported')
+
+		with chain.lock:
+			from_height = params.get('from_height', 0)
+			to_height = params.get('to_height', 0) or chain.height - 1
+			to_height = min(to_height, chain.height - 1)
+
+			# Outputs created before every block in range, plus the total after the last one
+			firsts = [chain.blocks[h]['first_gindex'] for h in range(from_height, to_height + 1)]
+			firsts.append(len(chain.outputs) if to_height == chain.height - 1 else chain.blocks[to_height + 1]['first_gindex'])
+
+		if params.get('cumulative'):
+			dist = firsts[1:]
+		else:
+			dist = [firsts[i + 1] - firsts[i] for i in range(len(firsts) - 1)]
+
+		return {
+			'distributions': [{'amount': 0, 'base': firsts[0], 'distribution': dist, 'start_height': from_height}],
+			'status': 'OK'
+		}
+
+	def rpc_sync_info(self, params):
+		if self.restricted:
+			return None
+
+		return {'height': self.chain.height, 'peers': [], 'status': 'OK'}
+
+	##### other endpoints #####
+
+	def other_get_info(self, req):
+		chain = self.chain
+
+		with chain.lock:
+			return {
+				'height': chain.height,
+				'top_block_hash': chain.blocks[-1]['hash'],
+				'tx_count': sum(len(b['tx_hashes']) + 1 for b in chain.blocks),
+				'restricted': self.restricted,
+				'status': 'OK',
+				'untrusted': False
+			}
+
+	def other_get_transactions(self, req):
+		chain = self.chain
+		txids = req.get('txs_hashes', [])
+
+		if self.max_txs_per_request is not None and len(txids) > self.max_txs_per_request:
+			return {'status': 'Failed: too many txs requested', 'untrusted': False}
+
+		txs = []
+		missed = []
+
+		with chain.lock:
+			for txid in txids:
+				tx = chain.txs.get(txid)
+
+				if tx is None:
+					missed.append(txid)
+					continue
+
+				entry = {
+					'tx_hash': txid,
+					'as_hex': '',
+					'block_height': 0 if tx['in_pool'] else tx['height'],
+					'block_timestamp': 0 if tx['in_pool'] else tx['timestamp'],
+					'double_spend_seen': False,
+					'in_pool': tx['in_pool'],
+					'output_indices': [] if tx['in_pool'] else list(tx['out_gindexes'])
+				}
+
+				if req.get('decode_as_json'):
+					entry['as_json'] = chain.tx_as_json(tx)
+
+				# The prunable part isn't generated, so 'as_hex' is always left empty
+				if req.get('prune'):
+					entry['pruned_as_hex'] = chain.tx_blob(tx).hex()
+					entry['prunable_as_hex'] = ''
+					entry['prunable_hash'] = '0' * 64
+
+				txs.append(entry)
+
+		with self.stats_lock:
+			self.txs_served += len(txs)
+
+		resp = {'status': 'OK', 'untrusted': False}
+		if txs:
+			resp['txs'] = txs
+			resp['txs_as_hex'] = ['' for _ in txs]
+		if missed:
+			resp['missed_tx'] = missed
+
+		return resp
+
+	def other_get_transaction_pool(self, req):
+		chain = self.chain
+		txs = []
+
+		# Like monerod, the pool txs are full txs decoded as JSON, with their receive time
+		with chain.lock:
+			for tx in chain.txs.values():
+				if not tx['in_pool']:
+					continue
+
+				blob = chain.tx_full_blob(tx)
+				txs.append({
+					'id_hash': tx['hash'],
+					'tx_json': chain.tx_as_json(tx),
+					'tx_blob': blob.hex(),
+					'receive_time': tx['timestamp'],
+					'blob_size': len(blob),
+					'double_spend_seen': False,
+					'relayed': True
+				})
+
+		with self.stats_lock:
+			self.txs_served += len(txs)
+
+		resp = {'spent_key_images': [], 'status': 'OK', 'untrusted': False}
+		if txs:
+			resp['transactions'] = txs
+
+		return resp
+
+	def other_is_key_image_spent(self, req):
+		chain = self.chain
+		spent = {}
+
+		with chain.lock:
+			for tx in chain.txs.values():
+				for kimage in tx['kimages']:
+					spent[kimage] = min(spent.get(kimage, 2), 2 if tx['in_pool'] else 1)
+
+		statuses = [spent.get(kimage, 0) for kimage in req.get('key_images', [])]
+
+		return {'spent_status': statuses, 'status': 'OK', 'untrusted': False}
+
+	def other_get_outs(self, req):
+		chain = self.chain
+		outs = []
+
+		with chain.lock:
+			for out in req.get('outputs', []):
+				key, height, txid = chain.outputs[out['index']]
+				unlocked = chain.height - height > 10
+				outs.append({'key': key, 'mask': '0' * 64, 'unlocked': unlocked, 'height': height, 'txid': txid})
+
+		return {'outs': outs, 'status': 'OK', 'untrusted': False}
+
+	def _make_handler(self):
+		mock = self
+
+		class Handler(BaseHTTPRequestHandler):
+			protocol_version = 'HTTP/1.1'
+
+			def do_GET(self):
+				self._respond({})
+
+			def do_POST(self):
+				length = int(self.headers.get('Content-Length', 0))
+				body = self.rfile.read(length) if length else b''
+
+				try:
+					req = json.loads(body.decode()) if body else {}
+				except ValueError:
+					self._send(400, b'')
+					return
+
+				self._respond(req)
+
+			def _respond(self, req):
+				if mock.latency or mock.jitter:
+					time.sleep(mock.latency + random.uniform(0, mock.jitter))
+
+				# Requests made by the test harness itself are never stalled or failed
+				if not self.path.startswith('/mock_'):
+					if random.random() < mock.stall_rate:
+						time.sleep(mock.stall_time)
+					elif random.random() < mock.fail_rate:
+						self._send(500, b'')
+						return
+
+					if mock.throttle():
+						self._send(429, b'')
+						return
+
+				status, resp = mock.handle(self.path, req)
+				body = json.dumps(resp).encode()
+
+				with mock.stats_lock:
+					mock.bytes_sent += len(body)
+
+				self._send(status, body)
+
+			def _send(self, status, body):
+				self.send_response(status)
+				self.send_header('Content-Type', 'application/json')
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+
+				# The client may have timed out and hung up already
+				try:
+					self.wfile.write(body)
+				except (BrokenPipeError, ConnectionResetError):
+					self.close_connection = True
+
+			def log_message(self, format, *args):
+				pass
+
+		return Handler
+
+def add_chain_args(parser):
+	""" Adds the arguments describing a SyntheticChain and MockDaemon to argparse parser """
+
+	parser.add_argument('--height', type=int, default=1000, help='number of blocks in chain')
+	parser.add_argument('--density', type=int, default=5, help='average number of txs per block')
+	parser.add_argument('--ring-size', type=int, default=16, help='number of ring members per input')
+	parser.add_argument('--max-inputs', type=int, default=2, help='maximum number of inputs per tx')
+	parser.add_argument('--seed', type=int, default=0, help='chain generation seed')
+	parser.add_argument('--latency', type=float, default=0.0, help='seconds of latency added to every request')
+	parser.add_argument('--jitter', type=float, default=0.0, help='max random seconds of latency added to every request')
+	parser.add_argument('--restricted', action='store_true', help='act like a restricted RPC node')
+	parser.add_argument('--max-txs', type=int, help='reject get_transactions requests for more txs than this')
+	parser.add_argument('--fail-rate', type=float, default=0.0, help='probability of answering a request with HTTP 500')
+	parser.add_argument('--stall-rate', type=float, default=0.0, help='probability of stalling a request')
+	parser.add_argument('--stall-time', type=float, default=30.0, help='seconds a stalled request takes')
+	parser.add_argument('--rate-limit', type=int, help='answer requests beyond this many per second with HTTP 429')
+	parser.add_argument('--reorg', action='append', default=[], metavar='HEIGHT:DEPTH',
+		help='reorg DEPTH blocks after block HEIGHT is first served. can be given multiple times')
+
+def chain_from_args(args):
+	return SyntheticChain(args.height, args.density, args.ring_size, args.max_inputs, seed=args.seed)
+
+def daemon_from_args(chain, args, addr='127.0.0.1', port=0):
+	reorgs = dict(map(int, r.split(':')) for r in args.reorg)
+
+	return MockDaemon(chain, addr, port, latency=args.latency, jitter=args.jitter, restricted=args.restricted,
+		max_txs_per_request=args.max_txs, reorgs=reorgs, fail_rate=args.fail_rate, stall_rate=args.stall_rate,
+		stall_time=args.stall_time, rate_limit=args.rate_limit)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Mock monerod serving a synthetic blockchain')
+	parser.add_argument('--addr', default='127.0.0.1', help='address to bind to')
+	parser.add_argument('--port', type=int, default=28081, help='port to bind to. 0 picks a free port')
+	add_chain_args(parser)
+	args = parser.parse_args()
+
+	daemon = daemon_from_args(chain_from_args(args), args, args.addr, args.port)
+
+	# The bench harness reads this line to find the port
+	print('listening on {}:{}'.format(daemon.addr, daemon.port), flush=True)
+
+	try:
+		daemon.serve_forever()
+	except KeyboardInterrupt:
+		pass
@@ -0,0 +1,209 @@
+"""
+End to end benchmark of scan() against a mock daemon serving a synthetic chain. The mock daemon runs
+in a separate process so that the measured RSS belongs to the scanner only. Prints a JSON report and
+exits non-zero if scan() missed any tx that the synthetic chain says it should have found.
+
+	$ python3 tests/scanbench.py --height 2000 --density 10 --latency 0.002 --keys 20
+"""
+
+import argparse
+import importlib
+import json
+import os.path
+import random
+import resource
+import subprocess as sp
+import sys
+import tempfile
+from time import perf_counter
+
+import requests
+
+import mockdaemon
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src'))
+
+haystack = importlib.import_module('xmr-haystack.__main__')
+xmrconn = importlib.import_module('xmr-haystack.xmrconn')
+ratelimit = importlib.import_module('xmr-haystack.ratelimit')
+blockhashes = importlib.import_module('xmr-haystack.blockhashes')
+bootstrap = importlib.import_module('xmr-haystack.bootstrap')
+lmdbchain = importlib.import_module('xmr-haystack.lmdbchain')
+
+def start_mock_daemon(argv):
+	""" Starts tests/mockdaemon.py with argv on a free port and returns (Popen, port) """
+
+	cmd = [sys.executable, os.path.join(here, 'mockdaemon.py'), '--port', '0'] + argv
+	proc = sp.Popen(cmd, stdout=sp.PIPE)
+	line = proc.stdout.readline().decode()
+
+	if not line.startswith('listening on'):
+		proc.kill()
+		raise RuntimeError('mock daemon failed to start')
+
+	port = int(line.strip().split(':')[-1])
+
+	return proc, port
+
+def mock_argv(args):
+	argv = ['--height', args.height, '--density', args.density, '--ring-size', args.ring_size,
+		'--max-inputs', args.max_inputs, '--seed', args.seed, '--latency', args.latency, '--jitter', args.jitter,
+		'--fail-rate', args.fail_rate, '--stall-rate', args.stall_rate, '--stall-time', args.stall_time]
+
+	if args.restricted:
+		argv.append('--restricted')
+	if args.max_txs is not None:
+		argv.extend(['--max-txs', args.max_txs])
+	if args.rate_limit is not None:
+		argv.extend(['--rate-limit', args.rate_limit])
+	for reorg in args.reorg:
+		argv.extend(['--reorg', reorg])
+
+	return list(map(str, argv))
+
+def run(args):
+	proc, port = start_mock_daemon(mock_argv(args))
+	hedge_proc = None
+	tmp_dir = tempfile.TemporaryDirectory()
+	block_hashes = None
+	source = None
+
+	try:
+		hedge = None
+
+		# The hedge node serves the same chain, but without any stalls or failures
+		if args.hedge:
+			hedge_args = argparse.Namespace(**vars(args))
+			hedge_args.fail_rate = hedge_args.stall_rate = 0.0
+			hedge_proc, hedge_port = start_mock_daemon(mock_argv(hedge_args))
+			hedge = xmrconn.DaemonConnection('127.0.0.1', hedge_port)
+
+		rate_limiter = ratelimit.RateLimiter(args.max_rps, args.max_bps) if args.rate_limiter else None
+		daemon = xmrconn.DaemonConnection('127.0.0.1', port, timeout=args.timeout, retries=args.retries, hedge=hedge,
+			rate_limiter=rate_limiter)
+
+		# Pick our "owned" outputs deterministically among all outputs in the chain. Outputs in blocks
+		# which are going to be reorged away would have different keys after the reorg, so avoid those
+		base_stats = requests.get(daemon.url('/mock_stats')).json()
+		end_height = daemon.get_info()['height'] - 1
+		reorgs = [tuple(map(int, r.split(':'))) for r in args.reorg]
+		safe_height = min([h - d for h, d in reorgs] + [end_height + 1])
+		candidates = random.Random(args.seed).sample(range(base_stats['num_outputs']), base_stats['num_outputs'])
+		gindexes = set()
+		created_in = {}
+
+		while len(gindexes) < args.keys and candidates:
+			batch, candidates = candidates[:args.keys], candidates[args.keys:]
+			for gindex, out in zip(batch, daemon.get_outs(batch)):
+				if out['height'] <= safe_height and len(gindexes) < args.keys:
+					gindexes.add(gindex)
+					created_in.setdefault(out['txid'], []).append(gindex)
+
+		gindexes = sorted(gindexes)
+		txs_by_key_index = {i: [] for i in gindexes}
+		scanned_blocks = []
+		settings = {'restricted': args.restricted, 'quiet': True, 'vquiet': True, 'progress': None,
+			'ring_only': args.ring_only, 'order': args.order}
+
+		if args.block_hashes:
+			block_hashes = blockhashes.BlockHashTable(os.path.join(tmp_dir.name, 'blockhashes.bin'))
+
+		# Scan an export or database of the same chain instead of asking the mock daemon
+		source = daemon
+		if args.lmdb:
+			lmdb_path = os.path.join(tmp_dir.name, 'lmdb')
+			mockdaemon.chain_from_args(args).write_lmdb(lmdb_path)
+			source = lmdbchain.LMDBBlockchain(lmdb_path, stats=daemon.stats)
+		elif args.blockchain_raw:
+			raw_path = os.path.join(tmp_dir.name, 'blockchain.raw')
+
+			with open(raw_path, 'wb') as f:
+				mockdaemon.chain_from_args(args).write_export(f)
+
+			source = bootstrap.BootstrapFile(raw_path, stats=daemon.stats)
+
+		# Don't count setup requests against the scan
+		base_stats = requests.get(daemon.url('/mock_stats')).json()
+
+		t0 = perf_counter()
+		err = haystack.scan(args.start_height, end_height, source, settings, gindexes, txs_by_key_index,
+			scanned_blocks, block_hashes=block_hashes, created_in=created_in, ringct=True)
+		elapsed = perf_counter() - t0
+
+		stats = requests.get(daemon.url('/mock_stats')).json()
+		expected = requests.post(daemon.url('/mock_hits'), json={'gindexes': gindexes}).json()['hits']
+	finally:
+		if block_hashes is not None:
+			block_hashes.close()
+		if source is not None and source is not daemon:
+			source.close()
+		tmp_dir.cleanup()
+
+		for p in (proc, hedge_proc):
+			if p is not None:
+				p.kill()
+				p.wait()
+
+	rpc_counts = {k: v - base_stats['rpc_counts'].get(k, 0) for k, v in stats['rpc_counts'].items()}
+	rpc_counts = {k: v for k, v in rpc_counts.items() if v}
+	num_blocks = end_height - args.start_height + 1
+	num_txs = daemon.stats.counters['txs'] if source is not daemon else stats['txs_served'] - base_stats['txs_served']
+
+	missing = 0
+	extra = 0
+	for gindex in gindexes:
+		found = set(tx.hash for tx in txs_by_key_index[gindex])
+		want = set(expected[str(gindex)])
+		missing += len(want - found)
+		extra += len(found - want)
+
+	report = {
+		'ok': err is None and missing == 0,
+		'scan_return': err,
+		'elapsed_s': round(elapsed, 4),
+		'blocks': num_blocks,
+		'blocks_per_s': round(num_blocks / elapsed, 2),
+		'txs': num_txs,
+		'txs_per_s': round(num_txs / elapsed, 2),
+		'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+		'rpc_counts': rpc_counts,
+		'rpc_total': sum(rpc_counts.values()),
+		'throttled': stats['throttled'] - base_stats['throttled'],
+		'bytes_received': stats['bytes_sent'] - base_stats['bytes_sent'],
+		'hits': sum(len(txs) for txs in txs_by_key_index.values()),
+		'missing_hits': missing,
+		'extra_hits': extra,
+		'scan_stats': daemon.stats.tojson()
+	}
+
+	return report
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark scan() against a mock daemon')
+	mockdaemon.add_chain_args(parser)
+	parser.add_argument('--keys', type=int, default=10, help='number of outputs that belong to "us"')
+	parser.add_argument('--start-height', type=int, default=0, help='height to start scanning from')
+	parser.add_argument('--ring-only', action='store_true', help='fetch txs as binary blobs instead of JSON')
+	parser.add_argument('--order', choices=['oldest-first', 'newest-first', 'interleaved'], default='oldest-first',
+		help='order to scan blocks in')
+	parser.add_argument('--block-hashes', action='store_true', help='record block hashes in a temporary hash table')
+	parser.add_argument('--blockchain-raw', action='store_true',
+		help='scan a blockchain export file of the chain instead of the mock daemon. no reorgs')
+	parser.add_argument('--lmdb', action='store_true',
+		help='scan an LMDB database of the chain in monerod\'s layout instead of the mock daemon. no reorgs')
+	parser.add_argument('--timeout', type=float, default=30.0, help='seconds before a request times out')
+	parser.add_argument('--retries', type=int, default=3, help='number of times to retry failed requests')
+	parser.add_argument('--rate-limiter', action='store_true', help='pace requests with an adaptive rate limiter')
+	parser.add_argument('--max-rps', type=float, help='request budget of the rate limiter')
+	parser.add_argument('--max-bps', type=float, help='response bytes budget of the rate limiter')
+	parser.add_argument('--hedge', action='store_true', help='hedge slow requests to a second, healthy mock daemon')
+	args = parser.parse_args()
+
+	if (args.blockchain_raw or args.lmdb) and args.reorg:
+		parser.error('--reorg can not be used with --blockchain-raw or --lmdb')
+
+	report = run(args)
+	print(json.dumps(report, indent=4))
+
+	exit(0 if report['ok'] else 1)
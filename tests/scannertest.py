@@ -0,0 +1,137 @@
+"""
+Checks driving scans in-process through the Scanner API against an in-process mock daemon: hits are
+yielded lazily, a scan stopped early resumes from its serialized ScanState, and two scanners can
+share one daemon connection. Also checks finding heights by timestamp, skipping old blocks and
+matching the txs in the pool. Exits non-zero if anything doesn't match.
+
+	$ python3 tests/scannertest.py --height 1000 --density 8
+"""
+
+import argparse
+import importlib
+import itertools
+import json
+import os.path
+import random
+import sys
+
+import bootstraptest
+import mockdaemon
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src'))
+
+haystack = importlib.import_module('xmr-haystack')
+xmrconn = importlib.import_module('xmr-haystack.xmrconn')
+
+def hits_by_gindex(hits, gindexes):
+	found = {i: set() for i in gindexes}
+	for hit in hits:
+		found[hit.gindex].add(hit.tx.hash)
+
+	return found
+
+def check_height_at_time(chain, daemon, mock, seed):
+	""" Checks that timestamps are found with O(log n) header requests """
+
+	timestamps = [block['timestamp'] for block in chain.blocks]
+	max_requests = chain.height.bit_length() + 1
+
+	for height in random.Random(seed).sample(range(chain.height), 20) + [0, chain.height - 1]:
+		for timestamp in (timestamps[height], timestamps[height] - 1, timestamps[height] + 1):
+			want = next((h for h, t in enumerate(timestamps) if t >= timestamp), chain.height)
+			base = mock.rpc_counts['get_block_header_by_height']
+
+			assert haystack.height_at_time(daemon, timestamp) == want
+			assert mock.rpc_counts['get_block_header_by_height'] - base <= max_requests
+
+	assert haystack.height_at_time(daemon, timestamps[-1] + 1) == chain.height
+	assert haystack.height_at_time(daemon, 0, low=10, high=20) == 10
+
+def check_skip_old_blocks(chain, mock):
+	""" Checks that blocks older than our outputs are only skipped if all of them are RingCT outputs """
+
+	gindex = len(chain.outputs) - 1
+	top = chain.height - 1
+
+	for ringct in (True, False):
+		daemon = xmrconn.DaemonConnection(mock.addr, mock.port)
+		scanner = haystack.Scanner({gindex}, daemon, ringct=ringct)
+		list(scanner.iter_hits(0, top))
+
+		skipped = daemon.stats.counters['blocks_skipped']
+		assert (skipped > 0) if ringct else (skipped == 0 and daemon.stats.counters['blocks'] == chain.height)
+
+def check_pool(chain, daemon, mock, gindexes, state):
+	""" Checks that the pool is matched with a single request and leaves the state alone """
+
+	ours = sorted(gindexes)
+	others = [i for i in range(len(chain.outputs)) if i not in gindexes]
+	decoy_tx = chain.add_pool_tx([ours[:1] + others[:chain.ring_size - 1]])
+	chain.add_pool_tx([others[-chain.ring_size:]])
+
+	coverage = state.coverage.tojson()
+	base = mock.rpc_counts['get_transaction_pool']
+	hits = haystack.Scanner(gindexes, daemon, state).pool_hits()
+
+	assert mock.rpc_counts['get_transaction_pool'] - base == 1
+	assert [(hit.gindex, hit.tx.hash, hit.tx.height) for hit in hits] == [(ours[0], decoy_tx['hash'], 0)]
+	assert state.coverage.tojson() == coverage
+
+def main():
+	parser = argparse.ArgumentParser(description='Check the Scanner API')
+	mockdaemon.add_chain_args(parser)
+	parser.add_argument('--keys', type=int, default=20, help='number of outputs that belong to "us"')
+	args = parser.parse_args()
+
+	chain = mockdaemon.chain_from_args(args)
+	mock = mockdaemon.daemon_from_args(chain, args)
+	mock.start()
+
+	try:
+		daemon = xmrconn.DaemonConnection(mock.addr, mock.port)
+		top = chain.height - 1
+		check_height_at_time(chain, daemon, mock, args.seed)
+		check_skip_old_blocks(chain, mock)
+		wallets = []
+
+		for seed in (args.seed, args.seed + 1):
+			gindexes = random.Random(seed).sample(range(len(chain.outputs)), args.keys)
+			wallets.append((gindexes, bootstraptest.created_in_of(chain, gindexes), chain.expected_hits(gindexes)))
+
+		for gindexes, created_in, expected in wallets:
+			want = {i: set(txs) for i, txs in expected.items()}
+			num_hits = sum(len(txs) for txs in want.values())
+			assert num_hits >= 2, 'too few hits to stop in between, use more --keys'
+
+			# Take half of the hits, then stop and save the state like a service would
+			scanner = haystack.Scanner(gindexes, daemon, order='newest-first', created_in=created_in)
+			hits_iter = scanner.iter_hits(0, top)
+			first = list(itertools.islice(hits_iter, num_hits // 2))
+			hits_iter.close()
+
+			assert len(first) == num_hits // 2
+			assert scanner.state.coverage
+
+			state = haystack.ScanState.fromjson(json.loads(json.dumps(scanner.state.tojson())))
+			assert state.coverage == scanner.state.coverage
+
+			# The resumed scan only walks what's missing. Hits of the block it stopped in come again
+			scanner = haystack.Scanner(gindexes, daemon, state, order='newest-first', created_in=created_in)
+			rest = list(scanner.iter_hits(0, top))
+
+			assert not state.coverage.missing(0, top)
+			assert hits_by_gindex(first + rest, want) == want
+			assert len(first) + len(rest) < 2 * num_hits
+
+			# A finished state has nothing left to do
+			assert list(haystack.Scanner(gindexes, daemon, state, created_in=created_in).iter_hits(0, top)) == []
+
+		check_pool(chain, daemon, mock, wallets[0][0], state)
+	finally:
+		mock.stop()
+
+	print('ok')
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,98 @@
+"""
+Checks the query server against an in-process mock daemon: an index is synced, queried over HTTP
+through /query and /status and compared with the hits the mock expects, also after a reorg, which
+has to roll the index back. Exits non-zero if anything doesn't match.
+
+	$ python3 tests/servertest.py --height 1000 --density 8
+"""
+
+import argparse
+import importlib
+import os.path
+import random
+import sys
+import threading
+
+import requests
+
+import mockdaemon
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'src'))
+
+server = importlib.import_module('xmr-haystack.server')
+xmrconn = importlib.import_module('xmr-haystack.xmrconn')
+
+def query(url, outputs):
+	resp = requests.post(url + '/query', json={'outputs': outputs})
+	assert resp.status_code == 200, resp.text
+
+	return resp.json()
+
+def check_queries(chain, url, gindexes):
+	""" Checks that every output is answered with the txs which use its gindex or create its key """
+
+	answer = query(url, [{'gindex': i, 'key': chain.outputs[i][0]} for i in gindexes])
+	expected = chain.expected_hits(gindexes)
+
+	assert answer['height'] == chain.height - 1
+
+	for result in answer['results']:
+		# Transactions are serialized as lists, with their hash first
+		assert sorted(tx[0] for tx in result['txs']) == sorted(expected[result['gindex']])
+
+	status = requests.get(url + '/status').json()
+	assert status['height'] == chain.height - 1
+	assert status['txs'] == sum(len(b['tx_hashes']) for b in chain.blocks)
+
+def main():
+	parser = argparse.ArgumentParser(description='Check the query server')
+	mockdaemon.add_chain_args(parser)
+	parser.add_argument('--keys', type=int, default=20, help='number of outputs to query')
+	parser.add_argument('--reorg-depth', type=int, default=5, help='number of blocks to reorg')
+	args = parser.parse_args()
+
+	chain = mockdaemon.chain_from_args(args)
+	mock = mockdaemon.daemon_from_args(chain, args)
+	mock.start()
+	httpd = None
+
+	try:
+		daemon = xmrconn.DaemonConnection(mock.addr, mock.port)
+		index = server.HaystackIndex(daemon, tx_batch_count=500)
+		assert index.sync()
+
+		httpd = server.QueryHTTPServer(('127.0.0.1', 0), server.make_handler(server.QueryBatcher(index), index))
+		threading.Thread(target=httpd.serve_forever, daemon=True).start()
+		url = 'http://127.0.0.1:{}'.format(httpd.server_address[1])
+
+		gindexes = random.Random(args.seed).sample(range(len(chain.outputs)), args.keys)
+		check_queries(chain, url, gindexes)
+
+		resp = requests.post(url + '/query', json={'outputs': [{'gindex': True}]})
+		assert resp.status_code == 400
+
+		# The reorg replaces the top blocks without making the chain longer, so only the tip hash shows it
+		orphans = [h for b in chain.blocks[-args.reorg_depth:] for h in b['tx_hashes']]
+		chain.reorg(args.reorg_depth)
+		assert index.sync()
+
+		assert daemon.stats.counters['reorg_rollbacks'] > 0
+
+		# Without outputs to skip blocks for, syncing never needs the output distribution
+		assert mock.rpc_counts['get_output_distribution'] == 0
+		assert not any(h in index.txs for h in orphans)
+
+		# Outputs of the orphaned blocks are gone, so only query the ones which are still there
+		check_queries(chain, url, [i for i in gindexes if i < len(chain.outputs)])
+	finally:
+		if httpd is not None:
+			httpd.shutdown()
+			httpd.server_close()
+
+		mock.stop()
+
+	print('ok')
+
+if __name__ == '__main__':
+	main()